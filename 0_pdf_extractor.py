@@ -3,19 +3,37 @@
 # Versão modificada usando pdfplumber (MIT) + pdf2image (MIT) no lugar de PyMuPDF (AGPL)
 
 import os, re, tempfile, shutil, json
+import numpy as np
 from PIL import Image
 import pdfplumber
 from pdf2image import convert_from_path
+from pipeline_profiling import profiled, add_file_bytes
+from artifact_store import get_store, TAGS_TEXT
+from crop_store import get_crop_store
 
 # ---- CONFIGURAÇÕES ----
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_DIR = os.path.join(BASE_DIR, "01_pdf_input")
 OUTPUT_DIR = os.path.join(BASE_DIR, "02_figures")
+TAGS_OUT_DIR = os.path.join(BASE_DIR, "03_tags")
 
 ZOOM = 2.0    
 MARGIN_TOP = 8    
 MARGIN_BOTTOM = 0    
 CROP_RIGHT_PX = 140   
+RENDER_MODE = "region"   # "page": renderiza páginas inteiras; "region": só o recorte de cada Network
+AUTO_TEXT_PX = 16        # Altura alvo do texto (px) com --auto-dpi (~8 pt em ZOOM = 2)
+AUTO_ZOOM_MIN = 1.0
+AUTO_ZOOM_MAX = 4.0
+AUTO_ZOOM_STEP = 0.25
+TEXT_LAYER_SUFFIX = "_text_layer.json"   # Palavras da camada de texto por Network (lidas pelo 1_detect_tags)
+TEXT_X_TOLERANCE = 1.5    # Tolerância menor que a dos blocos: não junta TAGs vizinhas na mesma linha
+TEXT_Y_TOLERANCE = 2
+VECTOR_SUFFIX = "_vector.json"   # Segmentos das linhas do Ladder por Network (lidos pelo 2_mark_blocks)
+SNAP_TOL_PT = 0.75     # Desvio máximo (pt) para tratar um trecho como horizontal/vertical
+THIN_RECT_PT = 2.0     # Retângulos mais finos que isso são linhas desenhadas como retângulo preenchido
+MIN_SEGMENT_PT = 1.0   # Ignora trechos menores (pontas, serifas)
+MERGE_TOL_PX = 1       # Junta segmentos colineares que se tocam (px do recorte)
 
 # Padrões de busca para identificar blocos
 NETWORK_RE = re.compile(r'\bNetwork\s*\d+\b', re.IGNORECASE)
@@ -54,14 +72,167 @@ def extract_text_blocks(page):
     
     return blocks
 
+# Palavras da camada de texto dentro do recorte, em pixels do recorte (mesma conta de zoom/margem do crop)
+def extract_crop_words(words, pixel_bbox, zoom):
+    px_x0, px_y0, px_x1, px_y1 = pixel_bbox
+    out = []
+    for w in words:
+        # Centro da palavra em pixels da página
+        cx = (w['x0'] + w['x1']) / 2.0 * zoom
+        cy = (w['top'] + w['bottom']) / 2.0 * zoom
+        if not (px_x0 <= cx < px_x1 and px_y0 <= cy < px_y1):
+            continue
+        x = int(round(w['x0'] * zoom)) - px_x0
+        y = int(round(w['top'] * zoom)) - px_y0
+        out.append({
+            'text': w['text'],
+            'x': max(0, x),
+            'y': max(0, y),
+            'w': max(1, int(round((w['x1'] - w['x0']) * zoom))),
+            'h': max(1, int(round((w['bottom'] - w['top']) * zoom))),
+            'conf': 100.0,
+        })
+    return out
+
+# Salva as palavras da camada de texto de uma Network (banco de artefatos + JSON de depuração)
+def save_text_layer(base, words, page_index, pixel_bbox, zoom, tags_dir=TAGS_OUT_DIR):
+    get_store().put_tags(base, TAGS_TEXT, words)
+    os.makedirs(tags_dir, exist_ok=True)
+    path = os.path.join(tags_dir, f"{base}{TEXT_LAYER_SUFFIX}")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "source": "pdf_text_layer",
+            "page": page_index,
+            "zoom": zoom,
+            "pixel_bbox": list(pixel_bbox),
+            "words": words
+        }, f, ensure_ascii=False, indent=2)
+    add_file_bytes("extract_network_blocks.text_layer", path)
+    return path
+
+# Trechos horizontais/verticais de um objeto gráfico do pdfplumber (pontos, topo da página = 0)
+# Retorna [(orientação, posição, início, fim)]: ("h", y, x1, x2) ou ("v", x, y1, y2)
+def object_segments(obj):
+    out = []
+    if obj.get('object_type') == 'rect':
+        x0, top, x1, bottom = obj['x0'], obj['top'], obj['x1'], obj['bottom']
+        if x1 - x0 <= THIN_RECT_PT and bottom - top >= MIN_SEGMENT_PT:
+            return [("v", (x0 + x1) / 2.0, top, bottom)]
+        if bottom - top <= THIN_RECT_PT and x1 - x0 >= MIN_SEGMENT_PT:
+            return [("h", (top + bottom) / 2.0, x0, x1)]
+        pts = [(x0, top), (x1, top), (x1, bottom), (x0, bottom), (x0, top)]
+    else:
+        pts = obj.get('pts') or []
+
+    # Linhas e curvas: cada par de pontos consecutivos alinhado a um dos eixos vira um trecho
+    for (ax, ay), (bx, by) in zip(pts, pts[1:]):
+        if abs(ay - by) <= SNAP_TOL_PT and abs(bx - ax) >= MIN_SEGMENT_PT:
+            out.append(("h", (ay + by) / 2.0, min(ax, bx), max(ax, bx)))
+        elif abs(ax - bx) <= SNAP_TOL_PT and abs(by - ay) >= MIN_SEGMENT_PT:
+            out.append(("v", (ax + bx) / 2.0, min(ay, by), max(ay, by)))
+    return out
+
+# Junta intervalos colineares [(pos, a, b)] que se tocam ou se sobrepõem
+def merge_collinear(segs, pos_tol=MERGE_TOL_PX, gap=MERGE_TOL_PX):
+    merged = []
+    for pos, a, b in sorted(segs, key=lambda s: (s[1], s[0])):
+        for m in merged:
+            if abs(m[0] - pos) <= pos_tol and a <= m[2] + gap and b >= m[1] - gap:
+                m[1], m[2] = min(m[1], a), max(m[2], b)
+                break
+        else:
+            merged.append([pos, a, b])
+    return merged
+
+# Segmentos das linhas dentro do recorte, em pixels do recorte (mesma conta de zoom/margem do crop)
+def extract_crop_segments(objects, pixel_bbox, zoom):
+    px_x0, px_y0, px_x1, px_y1 = pixel_bbox
+    horiz, vert = [], []
+    for obj in objects:
+        for kind, p, a, b in object_segments(obj):
+            p, a, b = p * zoom, a * zoom, b * zoom
+            if kind == "h":
+                if not (px_y0 <= p < px_y1) or b < px_x0 or a >= px_x1:
+                    continue
+                horiz.append((int(round(p)) - px_y0, max(0, int(round(a)) - px_x0),
+                              min(px_x1 - px_x0 - 1, int(round(b)) - px_x0)))
+            else:
+                if not (px_x0 <= p < px_x1) or b < px_y0 or a >= px_y1:
+                    continue
+                vert.append((int(round(p)) - px_x0, max(0, int(round(a)) - px_y0),
+                             min(px_y1 - px_y0 - 1, int(round(b)) - px_y0)))
+    return {
+        "horizontal": [[a, p, b] for p, a, b in merge_collinear(horiz)],
+        "vertical": [[p, a, b] for p, a, b in merge_collinear(vert)],
+    }
+
+# Salva os segmentos de uma Network (banco de artefatos + JSON de depuração)
+def save_vector_segments(base, segments, page_index, pixel_bbox, zoom, out_dir=OUTPUT_DIR):
+    get_store().put_segments(base, segments)
+    path = os.path.join(out_dir, f"{base}{VECTOR_SUFFIX}")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "source": "pdf_vector",
+            "page": page_index,
+            "zoom": zoom,
+            "pixel_bbox": list(pixel_bbox),
+            "horizontal": segments["horizontal"],
+            "vertical": segments["vertical"]
+        }, f, ensure_ascii=False)
+    add_file_bytes("extract_network_blocks.vector", path)
+    return path
+
+# Zoom da Network a partir da altura do texto dentro do bloco (mediana das palavras), para que as TAGs
+# fiquem com ~AUTO_TEXT_PX de altura, a escala em que os parâmetros das etapas seguintes foram ajustados
+def choose_zoom(words, bbox_pt, default_zoom=ZOOM):
+    x0, top, x1, bottom = bbox_pt
+    heights = sorted(w['bottom'] - w['top'] for w in words
+                     if x0 <= w['x0'] and w['x1'] <= x1 and top <= w['top'] and w['bottom'] <= bottom)
+    if not heights or heights[len(heights) // 2] <= 0:
+        return default_zoom
+    zoom = AUTO_TEXT_PX / heights[len(heights) // 2]
+    zoom = round(zoom / AUTO_ZOOM_STEP) * AUTO_ZOOM_STEP
+    return min(AUTO_ZOOM_MAX, max(AUTO_ZOOM_MIN, zoom))
+
+# Renderiza apenas a região (pixels da página em 72 * zoom DPI) de uma página já aberta no pypdfium2
+# (dependência do pdfplumber): o documento é lido uma vez e cada Network rasteriza só o seu recorte
+def render_region(pdfium_page, pixel_bbox, zoom):
+    px_x0, px_y0, px_x1, px_y1 = pixel_bbox
+    width, height = px_x1 - px_x0, px_y1 - px_y0
+    scale = int(72 * zoom) / 72.0
+    page_w_pt, page_h_pt = pdfium_page.get_size()
+    # crop = pontos removidos de cada borda (esquerda, base, direita, topo)
+    crop = (px_x0 / scale, page_h_pt - px_y1 / scale, page_w_pt - px_x1 / scale, px_y0 / scale)
+    img = pdfium_page.render(scale=scale, crop=crop).to_pil().convert("RGB")
+    if img.size != (width, height):
+        # Arredondamento do renderizador: ajusta ao tamanho exato do recorte
+        canvas = Image.new("RGB", (width, height), (255, 255, 255))
+        canvas.paste(img.crop((0, 0, min(width, img.width), min(height, img.height))), (0, 0))
+        img = canvas
+    return img
+
 # Extrai blocos Network de um PDF e salva como imagens PNG
-def extract_network_blocks(pdf_path, output_dir, zoom=2.0):
+# render="page" renderiza páginas inteiras e recorta; render="region" renderiza só o recorte de cada Network.
+# auto_dpi escolhe o zoom de cada Network pela altura do texto (implica render="region").
+# Os recortes vão em cinza para o contêiner crops.u8 de output_dir; o PNG é opcional (save_png)
+@profiled
+def extract_network_blocks(pdf_path, output_dir, zoom=2.0, render=RENDER_MODE, auto_dpi=False, save_png=True):
     create_output_directory(output_dir)
     results = []
+    crops = get_crop_store(output_dir)
+    crops.reset()
+    if auto_dpi:
+        render = "region"
     
     # Renderiza todas as páginas do PDF como imagens (DPI = 72 * zoom)
-    dpi = int(72 * zoom)
-    images = convert_from_path(pdf_path, dpi=dpi)
+    images = None
+    pdfium_doc = None
+    if render == "page":
+        dpi = int(72 * zoom)
+        images = convert_from_path(pdf_path, dpi=dpi)
+    else:
+        import pypdfium2 as pdfium
+        pdfium_doc = pdfium.PdfDocument(pdf_path)
     
     # Abre PDF com pdfplumber para extração de texto
     with pdfplumber.open(pdf_path) as pdf:
@@ -76,11 +247,14 @@ def extract_network_blocks(pdf_path, output_dir, zoom=2.0):
             if not network_blocks:
                 continue
 
-            # Obtém imagem renderizada da página
-            image = images[page_index]
-            page_width_px = image.width
-            page_height_px = image.height
-            
+            # Palavras da camada de texto (TAGs são texto no PDF do TIA Portal; dispensa o OCR do 1_detect_tags)
+            page_words = page.extract_words(x_tolerance=TEXT_X_TOLERANCE, y_tolerance=TEXT_Y_TOLERANCE)
+            # Linhas desenhadas como vetores (PDF do TIA Portal); vazio em PDFs digitalizados
+            page_objects = page.lines + page.rects + page.curves
+
+            # Página aberta uma vez no pypdfium2 para os recortes de todas as Networks dela
+            pdfium_page = pdfium_doc[page_index] if pdfium_doc is not None else None
+
             # Dimensões da página em pontos (pdfplumber usa pontos)
             page_width_pt = page.width
             page_height_pt = page.height
@@ -101,21 +275,56 @@ def extract_network_blocks(pdf_path, output_dir, zoom=2.0):
                 if bottom_y == page_height_pt and len(network_blocks) > network_index + 1:
                     bottom_y = network_blocks[network_index + 1][1]
 
+                # Zoom da Network (margens em pixels acompanham a escala)
+                net_zoom = choose_zoom(page_words, (nx0, ny0, page_width_pt, bottom_y), zoom) if auto_dpi else zoom
+                px_scale = net_zoom / zoom
+                margin_top = int(round(MARGIN_TOP * px_scale))
+                margin_bottom = int(round(MARGIN_BOTTOM * px_scale))
+                crop_right = int(round(CROP_RIGHT_PX * px_scale))
+
+                # Dimensões da página renderizada em pixels
+                if images is not None:
+                    page_width_px = images[page_index].width
+                    page_height_px = images[page_index].height
+                else:
+                    page_width_px = int(round(page_width_pt * int(72 * net_zoom) / 72.0))
+                    page_height_px = int(round(page_height_pt * int(72 * net_zoom) / 72.0))
+
                 # Converte coordenadas PDF (pontos) para pixels
-                px_x0 = max(0, int(round(nx0 * zoom)))
-                page_right_px = int(round(page_width_pt * zoom))
-                px_x1 = page_right_px - CROP_RIGHT_PX
+                px_x0 = max(0, int(round(nx0 * net_zoom)))
+                page_right_px = int(round(page_width_pt * net_zoom))
+                px_x1 = page_right_px - crop_right
                 px_x1 = min(page_width_px, int(px_x1))
                 px_x1 = max(px_x1, px_x0 + 4)
-                px_y0 = max(0, int(round(ny0 * zoom)) - MARGIN_TOP)
-                px_y1 = min(page_height_px, int(round(bottom_y * zoom)) + MARGIN_BOTTOM)
+                px_y0 = max(0, int(round(ny0 * net_zoom)) - margin_top)
+                px_y1 = min(page_height_px, int(round(bottom_y * net_zoom)) + margin_bottom)
+                pixel_bbox = (px_x0, px_y0, px_x1, px_y1)
 
-                # Recorta e salva imagem
-                crop = image.crop((px_x0, px_y0, px_x1, px_y1))
+                # Recorta (ou renderiza só a região) e salva imagem
+                if images is not None:
+                    crop = images[page_index].crop(pixel_bbox)
+                else:
+                    crop = render_region(pdfium_page, pixel_bbox, net_zoom)
                 safe_label = re.sub(r'[^\w\-_\.]', '_', network_text.strip())[:60]
                 filename = f"page{page_index+1:03d}_network{network_index+1:02d}_{safe_label}.png"
                 output_path = os.path.join(output_dir, filename)
-                crop.save(output_path, format="PNG")
+                crops.put(os.path.splitext(filename)[0], np.asarray(crop.convert("L")))
+                if save_png:
+                    crop.save(output_path, format="PNG")
+                    add_file_bytes("extract_network_blocks.png", output_path)
+
+                # TAGs da camada de texto, nas coordenadas do recorte (camada vazia não é gravada: o 1_detect_tags faz OCR)
+                words = extract_crop_words(page_words, pixel_bbox, net_zoom)
+                text_layer_path = None
+                if words:
+                    text_layer_path = save_text_layer(os.path.splitext(filename)[0], words, page_index, pixel_bbox, net_zoom)
+
+                # Segmentos vetoriais; sem horizontais e verticais o 2_mark_blocks usa a imagem
+                segments = extract_crop_segments(page_objects, pixel_bbox, net_zoom)
+                vector_path = None
+                if segments["horizontal"] and segments["vertical"]:
+                    vector_path = save_vector_segments(os.path.splitext(filename)[0], segments, page_index,
+                                                       pixel_bbox, net_zoom, out_dir=output_dir)
 
                 # Armazena informações do bloco extraído
                 results.append({
@@ -123,20 +332,39 @@ def extract_network_blocks(pdf_path, output_dir, zoom=2.0):
                     "network_index_on_page": network_index,
                     "network_text": network_text,
                     "pdf_bbox": (nx0, ny0, nx1, ny1),
-                    "pixel_bbox": (px_x0, px_y0, px_x1, px_y1),
-                    "file": output_path
+                    "pixel_bbox": pixel_bbox,
+                    "zoom": net_zoom,
+                    "file": output_path,
+                    "text_layer": text_layer_path,
+                    "text_words": len(words),
+                    "vector": vector_path
                 })
 
+    if pdfium_doc is not None:
+        pdfium_doc.close()
+    crops.flush()
+    add_file_bytes("extract_network_blocks.crops", crops.path)
     return results
 
 if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Extrai as figuras das Networks do relatório do TIA Portal")
+    ap.add_argument("--render", choices=["page", "region"], default=RENDER_MODE,
+                    help="page: renderiza páginas inteiras e recorta; region: renderiza só o recorte de cada Network")
+    ap.add_argument("--auto-dpi", action="store_true",
+                    help="Escolhe o DPI de cada Network pela altura do texto (implica --render region)")
+    ap.add_argument("--no-png", action="store_true",
+                    help="Grava os recortes só no contêiner crops.u8 (sem PNG de depuração por Network)")
+    args = ap.parse_args()
+
     # Localiza PDF para processar
     pdf_files = [os.path.join(INPUT_DIR, f) for f in os.listdir(INPUT_DIR) if f.lower().endswith(".pdf")]
 
     # Processa PDF
     pdf_path = pdf_files[0]
     print(f"Processando PDF: {pdf_path}")
-    extracted_blocks = extract_network_blocks(pdf_path, OUTPUT_DIR, zoom=ZOOM)
+    extracted_blocks = extract_network_blocks(pdf_path, OUTPUT_DIR, zoom=ZOOM, render=args.render,
+                                              auto_dpi=args.auto_dpi, save_png=not args.no_png)
 
     # Salva lista de arquivos extraídos
     image_list = [block["file"] for block in extracted_blocks]
@@ -1,9 +1,21 @@
 # 1.5_detect_NF.py
-# Detecta contatos NF/NA analisando pixels abaixo das TAGs e aplica NOT() nos itens NF
+# Detecta contatos NA/NF/P/N e aplica NOT() nos itens NF e P()/N() nos contatos de borda.
+# Método "symbol": localiza de uma vez todos os contatos da Network (duas barras verticais que
+# interrompem um fio), classifica o interior de todos em lote por correlação contra uma biblioteca
+# de símbolos (vazio = NA, diagonal = NF, letra P/N = borda) e associa cada contato à TAG acima dele.
+# TAGs sem contato associado (e o método "pixel") usam a caixa de pixels abaixo da TAG.
 
 import json, os
 from pathlib import Path
-from PIL import Image, ImageOps, ImageDraw
+from typing import List
+import numpy as np
+import cv2
+from PIL import Image, ImageOps, ImageDraw, ImageFont
+from pipeline_profiling import profiled, add_file_bytes
+from pipeline_journal import get_journal, network_key
+from artifact_store import get_store, TAGS_INFO, TAGS_NF
+from crop_store import crop_view
+from glyph_ocr import GLYPH_FONTS, ink_cell, cell_features
 
 # ---- DIRETORIOS ----
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -19,6 +31,20 @@ CONTACT_HALF_W_NARROW = 2          # Meia-largura da caixa (±2px ou ±1px se st
 USE_STRICT_NARROW_BOX = True       # Se True, usa largura de ±1px
 FRAC_THR = 0.14                    # Fração mínima de pixels pretos para considerar NF
 CONSEC_THR = 3                     # Número mínimo de pixels pretos consecutivos para NF
+JOURNAL_STAGE = "1.5_detect_NF"
+
+DETECT_METHOD = "symbol"           # "symbol" (biblioteca de símbolos) ou "pixel" (caixa abaixo de cada TAG)
+MIN_WIRE_RUN = 40                  # Linha com trecho preto contínuo >= 40px é fio
+MIN_BAR_H, MAX_BAR_H = 8, 40       # Altura das barras do contato (px)
+BAR_SYM_TOL = 0.35                 # Diferença tolerada entre as partes da barra acima e abaixo do fio
+BAR_H_TOL = 0.25                   # Diferença tolerada entre as alturas das duas barras
+GAP_REL_MIN, GAP_REL_MAX = 0.5, 2.0  # Distância entre as barras / altura da barra
+GAP_MAX_INK = 0.5                  # Fração máxima do fio preenchida entre as barras (fio interrompido)
+INK_MIN_FRAC = 0.04                # Interior com menos tinta que isso é NA
+SYMBOL_MIN_SIM = 0.55              # Similaridade mínima com NF/P/N; abaixo, usa a caixa de pixels
+ASSOC_MAX_DY = 3 * Y_OFFSET        # Distância máxima (px) entre a base da TAG e o fio do contato
+ASSOC_X_TOL = 8                    # Folga horizontal (px) entre o centro da TAG e o contato
+EDGE_MEMORY_MAX_DY = Y_OFFSET      # TAG logo abaixo de um contato P/N é o bit de memória da borda
 
 # Binariza a imagem (preto e branco) usando limiar fixo
 def binarize_image(img, thresh=BW_THRESH):
@@ -62,24 +88,220 @@ def analyze_contact_region(bw_img, cx, start_y, y_offset, contact_half_h, half_w
     }
     return is_nf, metrics
 
-# Percorre cada TAG e decide NF/NA; pula bobinas; gera visualização de depuração
-def detect_nf_and_generate_debug(image_path, tags_list):
-    img = Image.open(image_path).convert("RGB")
+# ---- BIBLIOTECA DE SÍMBOLOS ----
+
+# Renderiza a biblioteca: diagonal do NF em algumas proporções e as letras P/N nas fontes disponíveis.
+# Interiores e modelos usam a célula e a correlação normalizada do glyph_ocr.
+# NA não tem modelo: é o interior vazio. Retorna (tipo de cada modelo, matriz de características)
+def build_symbol_library():
+    kinds, cells = [], []
+    for aspect in (0.4, 0.6, 0.8, 1.0, 1.3):
+        w = max(3, int(round(48 * aspect)))
+        img = Image.new("L", (w + 8, 56), 0)
+        ImageDraw.Draw(img).line([(4, 52), (w + 4, 4)], fill=255, width=5)
+        kinds.append("NF")
+        cells.append(ink_cell(np.asarray(img) > 127))
+    fonts = []
+    for path in GLYPH_FONTS:
+        try:
+            fonts.append(ImageFont.truetype(path, 40))
+        except OSError:
+            continue
+    try:
+        fonts.append(ImageFont.load_default(size=40))
+    except TypeError:   # Pillow < 10.1: fonte bitmap de tamanho único
+        fonts.append(ImageFont.load_default())
+    for font in fonts:
+        for ch in ("P", "N"):
+            img = Image.new("L", (96, 96), 0)
+            ImageDraw.Draw(img).text((16, 16), ch, fill=255, font=font)
+            kinds.append(ch)
+            cells.append(ink_cell(np.asarray(img) > 127))
+    return np.array(kinds), cell_features(np.array(cells))
+
+_LIBRARY = []
+
+def get_symbol_library():
+    if not _LIBRARY:
+        _LIBRARY.append(build_symbol_library())
+    return _LIBRARY[0]
+
+# ---- DETECÇÃO DOS CONTATOS (UMA VEZ POR IMAGEM) ----
+
+# Fios horizontais: faixas de linhas com um trecho preto contínuo >= MIN_WIRE_RUN (a erosão por
+# um segmento horizontal desse comprimento só preserva essas linhas). Retorna [(y0, y1)]
+def find_wires(bw):
+    kernel = np.ones((1, MIN_WIRE_RUN), np.uint8)
+    eroded = cv2.erode(bw.astype(np.uint8), kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    wire_rows = np.nonzero(eroded.max(axis=1))[0]
+    bands = []
+    for y in wire_rows:
+        if bands and y == bands[-1][1] + 1:
+            bands[-1][1] = y
+        else:
+            bands.append([y, y])
+    return [(int(y0), int(y1)) for y0, y1 in bands]
+
+# Barras verticais que cruzam um fio: colunas pretas na faixa do fio com trechos acima e abaixo
+# de comprimentos parecidos. Retorna [(x0, x1, topo, base)] da esquerda para a direita
+def find_bars(bw, y0, y1):
+    H = bw.shape[0]
+    above = bw[max(0, y0 - MAX_BAR_H):y0][::-1]
+    below = bw[y1 + 1:min(H, y1 + 1 + MAX_BAR_H)]
+    stop = np.zeros((1, bw.shape[1]), bool)
+    run_up = np.argmin(np.vstack([above, stop]), axis=0)
+    run_down = np.argmin(np.vstack([below, stop]), axis=0)
+    bar_h = run_up + run_down + (y1 - y0 + 1)
+    ok = (bw[y0:y1 + 1].all(axis=0) & (bar_h >= MIN_BAR_H) & (bar_h <= MAX_BAR_H)
+          & (np.abs(run_up - run_down) <= BAR_SYM_TOL * bar_h + 1))
+    bars = []
+    for x in np.nonzero(ok)[0]:
+        if bars and x == bars[-1][1] + 1:
+            bars[-1][1] = x
+            bars[-1][2] = min(bars[-1][2], y0 - run_up[x])
+            bars[-1][3] = max(bars[-1][3], y1 + run_down[x])
+        else:
+            bars.append([x, x, y0 - run_up[x], y1 + run_down[x]])
+    return [tuple(int(v) for v in b) for b in bars]
+
+# Pares de barras que formam um contato: alturas parecidas, distância proporcional à altura e fio
+# interrompido entre elas. Retorna [{'x0', 'x1', 'top', 'bottom', 'wire_y', 'inner'}]
+def pair_bars(bw, bars, y0, y1):
+    contacts = []
+    used = set()
+    wire = bw[y0:y1 + 1].all(axis=0)
+    for i, a in enumerate(bars):
+        if i in used:
+            continue
+        ha = a[3] - a[2] + 1
+        for j in range(i + 1, len(bars)):
+            b = bars[j]
+            hb = b[3] - b[2] + 1
+            h = max(ha, hb)
+            gap = (b[0] + b[1]) / 2 - (a[0] + a[1]) / 2
+            if gap > GAP_REL_MAX * h:
+                break
+            if j in used or abs(ha - hb) > BAR_H_TOL * h or gap < GAP_REL_MIN * h:
+                continue
+            inner = wire[a[1] + 1:b[0]]
+            if inner.size == 0 or inner.mean() > GAP_MAX_INK:
+                continue
+            used.update((i, j))
+            contacts.append({"x0": a[0], "x1": b[1], "top": min(a[2], b[2]), "bottom": max(a[3], b[3]),
+                             "wire_y": (y0 + y1) // 2, "inner": (a[1] + 1, b[0] - 1)})
+            break
+    return contacts
+
+# Localiza todos os contatos da imagem e classifica o interior de todos em um único produto de
+# matrizes contra a biblioteca. Cada contato recebe 'kind' (NA/NF/P/N ou None se ambíguo) e 'sim'
+@profiled
+def detect_contact_symbols(bw) -> List[dict]:
+    contacts = []
+    for y0, y1 in find_wires(bw):
+        contacts += pair_bars(bw, find_bars(bw, y0, y1), y0, y1)
+    if not contacts:
+        return contacts
+    cells, inked = [], []
+    for c in contacts:
+        patch = bw[c["top"]:c["bottom"] + 1, c["inner"][0]:c["inner"][1] + 1]
+        ink = float(patch.mean()) if patch.size else 0.0
+        c["ink"] = ink
+        if ink < INK_MIN_FRAC:
+            c["kind"], c["sim"] = "NA", 1.0
+        else:
+            inked.append(c)
+            cells.append(ink_cell(patch))
+    if inked:
+        kinds, feats = get_symbol_library()
+        sims = cell_features(np.array(cells)) @ feats.T
+        best = sims.argmax(axis=1)
+        for c, k, row in zip(inked, best, sims):
+            c["sim"] = float(row[k])
+            c["kind"] = str(kinds[k]) if row[k] >= SYMBOL_MIN_SIM else None
+    return contacts
+
+# Associa cada TAG (não bobina) ao contato mais próximo abaixo dela, sem repetir contatos.
+# Retorna lista (por TAG) com o índice do contato ou None
+def associate_contacts(tags_list, contacts):
+    pairs = []
+    for i, tag in enumerate(tags_list):
+        if tag.get("is_coil", False):
+            continue
+        cx = tag['x'] + tag['w'] / 2
+        bottom = tag['y'] + tag['h']
+        for j, c in enumerate(contacts):
+            dy = c["wire_y"] - bottom
+            dx = abs((c["x0"] + c["x1"]) / 2 - cx)
+            if 0 < dy <= ASSOC_MAX_DY and dx <= max(tag['w'], c["x1"] - c["x0"]) / 2 + ASSOC_X_TOL:
+                pairs.append((dy + 2 * dx, i, j))
+    out = [None] * len(tags_list)
+    taken = set()
+    for _cost, i, j in sorted(pairs):
+        if out[i] is None and j not in taken:
+            out[i] = j
+            taken.add(j)
+    return out
+
+# TAG sem contato logo abaixo de um contato P/N: bit de memória da borda (não é um contato).
+# Retorna o tipo da borda ('P'/'N') ou None
+def edge_memory_kind(tag, contacts):
+    cx = tag['x'] + tag['w'] / 2
+    for c in contacts:
+        if c.get("kind") in ("P", "N") and c["x0"] - ASSOC_X_TOL <= cx <= c["x1"] + ASSOC_X_TOL \
+                and c["wire_y"] < tag['y'] <= c["bottom"] + EDGE_MEMORY_MAX_DY:
+            return c["kind"]
+    return None
+
+# ---- CLASSIFICAÇÃO POR TAG ----
+
+KIND_COLORS = {"NA": (0, 160, 0), "NF": (255, 0, 0), "P": (0, 0, 255), "N": (200, 0, 200)}
+
+# Decide o tipo de contato de cada TAG (NA/NF/P/N; 'coil' para bobinas, 'edge_memory' para o bit de
+# memória de uma borda); gera visualização de depuração. Retorna (tipos, métricas, caminho da visualização)
+@profiled
+def detect_nf_and_generate_debug(image_path, tags_list, method=DETECT_METHOD):
+    gray = crop_view(image_path)
+    img = Image.fromarray(gray, mode="L").convert("RGB") if gray is not None else Image.open(image_path).convert("RGB")
     bw = binarize_image(img)
     
     vis = img.copy()
     draw = ImageDraw.Draw(vis)
     
-    is_nf_list = []
+    contacts, assoc = [], [None] * len(tags_list)
+    if method == "symbol":
+        contacts = detect_contact_symbols(np.asarray(bw) < 128)
+        assoc = associate_contacts(tags_list, contacts)
+        for c in contacts:
+            draw.rectangle([c["x0"], c["top"], c["x1"], c["bottom"]],
+                           outline=KIND_COLORS.get(c.get("kind"), (255, 160, 0)), width=2)
+    
+    kinds = []
     metrics_list = []
     
-    for tag in tags_list:
+    for tag, j in zip(tags_list, assoc):
         # Pula bobinas por flag
         if tag.get("is_coil", False):
-            is_nf_list.append(False)
+            kinds.append("coil")
             metrics_list.append({"reason": "coil_skip"})
             continue
         
+        # Contato localizado pela biblioteca de símbolos
+        if j is not None and contacts[j].get("kind") is not None:
+            c = contacts[j]
+            kinds.append(c["kind"])
+            metrics_list.append({"method": "symbol", "kind": c["kind"], "sim": c["sim"], "ink": c["ink"],
+                                 "box": [c["x0"], c["top"], c["x1"], c["bottom"]], "wire_y": c["wire_y"]})
+            draw.line([(int(tag['x'] + tag['w'] / 2), int(tag['y'] + tag['h'])),
+                       ((c["x0"] + c["x1"]) // 2, c["top"])], fill=KIND_COLORS[c["kind"]], width=1)
+            continue
+        edge = edge_memory_kind(tag, contacts) if j is None else None
+        if edge is not None:
+            kinds.append("edge_memory")
+            metrics_list.append({"reason": "edge_memory", "edge": edge})
+            draw.rectangle([tag['x'], tag['y'], tag['x'] + tag['w'], tag['y'] + tag['h']],
+                           outline=KIND_COLORS[edge], width=1)
+            continue
+        
         # Calcula posição central e início da região de análise
         cx = int(tag['x'] + tag['w'] / 2)
         start_y = int(tag['y'] + tag['h'])
@@ -90,7 +312,8 @@ def detect_nf_and_generate_debug(image_path, tags_list):
         is_nf, metrics = analyze_contact_region(
             bw, cx, start_y, y_offset_eff, CONTACT_HALF_H, half_w, FRAC_THR, CONSEC_THR
         )
-        is_nf_list.append(is_nf)
+        metrics["method"] = "pixel"
+        kinds.append("NF" if is_nf else "NA")
         metrics_list.append(metrics)
         
         # Desenha a caixa do contato para depuração (sem texto)
@@ -102,22 +325,28 @@ def detect_nf_and_generate_debug(image_path, tags_list):
     Path(DEBUG_DIR).mkdir(parents=True, exist_ok=True)
     vis_path = Path(DEBUG_DIR) / f"{image_path.stem}_nf_vis.png"
     vis.save(vis_path)
+    add_file_bytes("detect_nf_and_generate_debug.vis_png", vis_path)
     
-    return is_nf_list, metrics_list, str(vis_path)
+    return kinds, metrics_list, str(vis_path)
 
-# Aplica NOT() apenas nas ocorrências marcadas como NF, preservando os demais campos
-def apply_not_to_nf_tags(tags_list, is_nf_list):
+# Aplica NOT() nos NF e P()/N() nos contatos de borda, preservando os demais campos.
+# Bits de memória de borda não são contatos: mantêm o texto e são marcados com edge_memory = 'P'/'N'
+def apply_contact_kinds(tags_list, kinds, metrics_list):
     out = []
-    for tag, is_nf in zip(tags_list, is_nf_list):
+    for tag, kind, metrics in zip(tags_list, kinds, metrics_list):
         t = dict(tag)
         # Se for bobina, nunca aplica NOT
-        if not tag.get("is_coil", False) and is_nf:
+        if not tag.get("is_coil", False) and kind == "NF":
             t["text"] = f"NOT({tag['text']})"
+        elif kind in ("P", "N"):
+            t["text"] = f"{kind}({tag['text']})"
+        elif kind == "edge_memory":
+            t["edge_memory"] = metrics["edge"]
         out.append(t)
     return out
 
 # Escreve arquivos de saída: JSON de debug consolidado e JSON de TAGs transformadas
-def save_outputs(base_stem, image_path, is_nf_list, metrics_list, vis_path, tags_with_nf):
+def save_outputs(base_stem, image_path, kinds, metrics_list, vis_path, tags_with_nf):
     tags_out_dir = Path(TAGS_OUT_DIR)
     tags_out_dir.mkdir(parents=True, exist_ok=True)
     
@@ -125,56 +354,69 @@ def save_outputs(base_stem, image_path, is_nf_list, metrics_list, vis_path, tags
     nf_json_path = tags_out_dir / f"{base_stem}_nf.json"
     nf_json = {
         "image": str(image_path),
-        "per_occurrence_is_nf": is_nf_list,
+        "per_occurrence_is_nf": [k == "NF" for k in kinds],
+        "per_occurrence_kind": kinds,
         "per_occurrence_metrics": metrics_list,
         "vis": vis_path
     }
     nf_json_path.write_text(json.dumps(nf_json, ensure_ascii=False, indent=2), encoding="utf-8")
     
-    # tags_with_nf.json (lista simples)
+    # tags_with_nf (banco de artefatos + JSON de depuração com a lista simples)
+    get_store().put_tags(base_stem, TAGS_NF, tags_with_nf)
     out_path = tags_out_dir / f"{base_stem}_tags_with_nf.json"
     out_path.write_text(json.dumps(tags_with_nf, ensure_ascii=False, indent=2), encoding="utf-8")
+    add_file_bytes("save_outputs.json", nf_json_path)
+    add_file_bytes("save_outputs.json", out_path)
     
     return str(nf_json_path), str(out_path)
 
-# Processa um arquivo *_tags_info.json, detecta NF/NA e grava saídas
-def process_tags_info_file(json_path):
-    json_path = Path(json_path)
-    
-    # Carrega JSON
-    data = json.loads(json_path.read_text(encoding="utf-8"))
-    
-    # Extrai lista de TAGs (suporta formatos simples)
+# Lê a lista de TAGs de um *_tags_info.json (suporta formatos simples)
+def load_tags_info_json(json_path):
+    data = json.loads(Path(json_path).read_text(encoding="utf-8"))
     if isinstance(data, list):
-        tags_list = data
-    elif isinstance(data, dict):
+        return data
+    if isinstance(data, dict):
         tags_list = data.get("tags_left") or data.get("tags_left_objs") or data.get("tags") or []
         if isinstance(tags_list, dict) and "items" in tags_list:
             tags_list = tags_list["items"]
-    else:
-        raise ValueError(f"Formato não reconhecido: {json_path.name}")
+        return tags_list
+    raise ValueError(f"Formato não reconhecido: {Path(json_path).name}")
+
+# Processa um arquivo *_tags_info.json, detecta NF/NA e grava saídas.
+# prefer_json: o arquivo prevalece sobre o banco de artefatos (arquivo pedido na linha de comando)
+@profiled
+def process_tags_info_file(json_path, method=DETECT_METHOD, prefer_json=False):
+    json_path = Path(json_path)
+    base_stem = json_path.stem.replace("_tags_info", "")
+    
+    # TAGs do banco de artefatos; o JSON é usado se pedido ou se a Network não estiver no banco
+    tags_list = None if prefer_json else get_store().tags(base_stem, TAGS_INFO)
+    if tags_list is None:
+        tags_list = load_tags_info_json(json_path)
+    elif json_path.exists() and load_tags_info_json(json_path) != tags_list:
+        print(f"[AVISO] {json_path.name} difere do banco de artefatos; usando o banco "
+              f"(--prefer_json ou --tags para usar o arquivo)")
     
     # Encontra imagem correspondente
-    base_stem = json_path.stem.replace("_tags_info", "")
     input_figs_dir = Path(INPUT_FIGS_DIR)
     image_path = None
     for ext in [".png", ".jpg", ".jpeg"]:
         candidate = input_figs_dir / f"{base_stem}{ext}"
-        if candidate.exists():
+        if candidate.exists() or crop_view(candidate) is not None:
             image_path = candidate
             break
     
     if not image_path:
         raise FileNotFoundError(f"Imagem não encontrada para {json_path.name}")
     
-    # Detecta NF/NA
-    is_nf_list, metrics_list, vis_path = detect_nf_and_generate_debug(image_path, tags_list)
+    # Detecta NA/NF/P/N
+    kinds, metrics_list, vis_path = detect_nf_and_generate_debug(image_path, tags_list, method)
     
-    # Aplica NOT()
-    tags_with_nf = apply_not_to_nf_tags(tags_list, is_nf_list)
+    # Aplica NOT() / P() / N()
+    tags_with_nf = apply_contact_kinds(tags_list, kinds, metrics_list)
     
     # Salva saídas
-    nf_json, tags_json = save_outputs(base_stem, image_path, is_nf_list, metrics_list, vis_path, tags_with_nf)
+    nf_json, tags_json = save_outputs(base_stem, image_path, kinds, metrics_list, vis_path, tags_with_nf)
     
     print(f"[OK] {json_path.name}")
     print(f"     NF debug: {nf_json}")
@@ -185,9 +427,13 @@ def process_tags_info_file(json_path):
 
 def main():
     import argparse
-    ap = argparse.ArgumentParser(description="Detecta contatos NF/NA e aplica NOT() em NF")
+    ap = argparse.ArgumentParser(description="Detecta contatos NA/NF/P/N e aplica NOT() em NF e P()/N() nas bordas")
     ap.add_argument("--tags", "-t", help="Arquivo *_tags_info.json específico")
     ap.add_argument("--tags_dir", help="Diretório com *_tags_info.json (padrão: TAGS_OUT_DIR)")
+    ap.add_argument("--method", choices=["symbol", "pixel"], default=DETECT_METHOD,
+                    help="symbol: biblioteca de símbolos (uma passada por imagem); pixel: caixa abaixo de cada TAG")
+    ap.add_argument("--prefer_json", action="store_true",
+                    help="Lê as TAGs dos *_tags_info.json mesmo quando a Network está no banco de artefatos")
     args = ap.parse_args()
     
     tags_dir = Path(args.tags_dir) if args.tags_dir else Path(TAGS_OUT_DIR)
@@ -197,7 +443,8 @@ def main():
         json_path = Path(args.tags)
         if not json_path.exists():
             raise FileNotFoundError(json_path)
-        process_tags_info_file(json_path)
+        with get_journal().step(network_key(json_path), JOURNAL_STAGE):
+            process_tags_info_file(json_path, args.method, prefer_json=True)
         return
     
     files = sorted(tags_dir.glob("*_tags_info.json"))
@@ -205,9 +452,18 @@ def main():
         print(f"Nenhum *_tags_info.json encontrado em {tags_dir}")
         return
     
-    for f in files:
+    # Com retomada (PIPELINE_RESUME=1), pula Networks já concluídas no diário
+    journal = get_journal()
+    by_network = {network_key(f): f for f in files}
+    pending = journal.pending(by_network, JOURNAL_STAGE)
+    if len(pending) < len(by_network):
+        print(f"[RESUME] {len(by_network) - len(pending)} arquivo(s) já processado(s)")
+
+    for network in pending:
+        f = by_network[network]
         try:
-            process_tags_info_file(f)
+            with journal.step(network, JOURNAL_STAGE):
+                process_tags_info_file(f, args.method, args.prefer_json)
         except Exception as e:
             print(f"[ERRO] {f.name}: {e}")
 
@@ -1,8 +1,15 @@
 # 1_detect_tags.py
-# Detecta as TAGs utilizando OCR
+# Detecta as TAGs utilizando OCR (modelos de glifos, com tesseract como fallback, ou só tesseract)
 
 from PIL import Image, ImageOps, ImageEnhance, ImageFilter, ImageDraw, ImageFont
-import re, os, json, pytesseract 
+import re, os, json, time, pytesseract 
+import numpy as np
+import glyph_ocr
+from pipeline_profiling import profiled, add_file_bytes
+from pipeline_journal import get_journal, network_key
+from artifact_store import get_store, TAGS_INFO, TAGS_TEXT
+from crop_store import crop_view, crop_image_paths
+from plc_symbols import parse_address
 
 # ---- DIRETÓRIOS ----
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,6 +21,15 @@ DEBUG_DIR = os.path.join(BASE_DIR, "99_debug")
 DEFAULT_REMOVE_TOL_X = 6
 DEFAULT_REMOVE_TOL_Y = 6
 COIL_X_MARGIN = 50  
+TEXT_LAYER_SUFFIX = "_text_layer.json"   # Gerado pelo 0_pdf_extractor quando o PDF tem camada de texto
+OCR_BACKEND = "tesseract"                # "tesseract" (multi-pass) ou "glyph" (glyph_ocr + tesseract nas palavras duvidosas)
+OCR_BATCH_SIZE = 8                       # Networks por chamada do tesseract (mosaico); 1 = uma chamada por imagem
+MOSAIC_GUTTER = 24                       # Faixa branca (px) entre as imagens do mosaico
+OCR_UPSCALE = "auto"                     # Upscale do OCR: "auto" (pela altura medida do texto) ou fator fixo
+OCR_MIN_TEXT_PX = 20                     # Altura de maiúsculas/dígitos a partir da qual o tesseract lê bem
+UPSCALE_STEPS = (1, 1.5, 2, 3, 4)        # Fatores possíveis no modo "auto" (o menor que atinge OCR_MIN_TEXT_PX)
+DEFAULT_UPSCALE = 2                      # Usado quando não há texto para medir
+JOURNAL_STAGE = "1_detect_tags"
 
 # Garante que os diretórios de entrada/saída existem
 for d in [INPUT_DIR, TAGS_OUT_DIR, DEBUG_DIR]:
@@ -64,7 +80,24 @@ def corrigir_erros_ocr(s: str) -> str:
 def upscale_image(img, factor=2):
     if factor <= 1:
         return img
-    return img.resize((img.width * factor, img.height * factor), Image.LANCZOS)
+    return img.resize((int(round(img.width * factor)), int(round(img.height * factor))), Image.LANCZOS)
+
+# Menor fator de UPSCALE_STEPS que leva a altura do texto a OCR_MIN_TEXT_PX (texto já grande: 1)
+def choose_upscale(text_h):
+    if not text_h:
+        return DEFAULT_UPSCALE
+    for factor in UPSCALE_STEPS:
+        if text_h * factor >= OCR_MIN_TEXT_PX:
+            return factor
+    return UPSCALE_STEPS[-1]
+
+# Fator de upscale de uma imagem: fixo, ou ("auto") o escolhido pela altura de texto medida nela.
+# Devolve (fator, altura medida)
+def resolve_upscale(img, upscale_factor):
+    if upscale_factor != "auto":
+        return float(upscale_factor), None
+    text_h = glyph_ocr.text_height(np.asarray(img.convert('L')))
+    return choose_upscale(text_h), text_h
 
 # Aplica pré-processamentos (cinza, contraste, nitidez, binarização, dilatação) e gera variações
 def preprocess_image(img, upscale_factor=2):
@@ -76,19 +109,56 @@ def preprocess_image(img, upscale_factor=2):
     bw_dilated = bw.filter(ImageFilter.MaxFilter(7))
     return {"up": img_up, "gray": gray, "bw": bw, "bw_dilated": bw_dilated}
 
+# Empilha as imagens em um mosaico vertical, com faixas brancas entre elas e nas bordas.
+# As imagens já vão pré-processadas: o mosaico não altera os pixels de nenhuma delas.
+# Devolve o mosaico e a origem (x, y) de cada imagem nele
+def build_mosaic(imgs, gutter=MOSAIC_GUTTER):
+    W = max(im.width for im in imgs) + 2 * gutter
+    H = sum(im.height for im in imgs) + gutter * (len(imgs) + 1)
+    mosaic = Image.new(imgs[0].mode, (W, H), "white")
+    origins, y = [], gutter
+    for im in imgs:
+        mosaic.paste(im, (gutter, y))
+        origins.append((gutter, y))
+        y += im.height + gutter
+    return mosaic, origins
+
+# Índice da imagem do mosaico que contém o ponto (x, y); None se cair em uma faixa
+def mosaic_owner(imgs, origins, x, y):
+    for k, (im, (ox, oy)) in enumerate(zip(imgs, origins)):
+        if ox <= x < ox + im.width and oy <= y < oy + im.height:
+            return k
+    return None
+
 # Executa OCR em múltiplas variações e unifica resultados mantendo maior confiança
-def ocr_multi_pass(img, langs="por+eng", upscale_factor=2):
-    variants = preprocess_image(img, upscale_factor=upscale_factor)
-    results = {}
+@profiled
+def ocr_multi_pass(img, langs="por+eng", upscale_factor=OCR_UPSCALE, name=None):
+    return ocr_multi_pass_batch([img], langs=langs, upscale_factor=upscale_factor, gutter=0,
+                                names=[name] if name else None)[0]
+
+# OCR multi-pass de várias imagens com uma chamada do tesseract por passagem: cada imagem é
+# ampliada e pré-processada sozinha (upscale e contraste não dependem das vizinhas), as variações vão
+# em um mosaico e as caixas voltam para a imagem de origem (pelo centro), com coordenadas corrigidas.
+# Com 'names', registra por imagem a altura do texto, o upscale escolhido e o tempo do OCR
+@profiled
+def ocr_multi_pass_batch(imgs, langs="por+eng", upscale_factor=OCR_UPSCALE, gutter=MOSAIC_GUTTER, names=None):
+    if not imgs:
+        return []
+    t0 = time.perf_counter()
+    scales = [resolve_upscale(im, upscale_factor) for im in imgs]
+    variants = [preprocess_image(im, upscale_factor=f) for im, (f, _) in zip(imgs, scales)]
+    results = [{} for _ in imgs]
     passes = [
-        (variants['gray'], f"--psm 6 -l {langs}"),
-        (variants['bw'],   f"--psm 6 -l {langs}"),
-        (variants['up'],   f"--psm 6 -l {langs}")
+        ('gray', f"--psm 6 -l {langs}"),
+        ('bw',   f"--psm 6 -l {langs}"),
+        ('up',   f"--psm 6 -l {langs}")
     ]
     
-    for img_pass, cfg in passes:
+    for variant, cfg in passes:
+        pass_imgs = [v[variant] for v in variants]
+        mosaic, origins = build_mosaic(pass_imgs, gutter=gutter)
         try:
-            data = pytesseract.image_to_data(img_pass, output_type=pytesseract.Output.DICT, config=cfg)
+            data = pytesseract.image_to_data(mosaic, output_type=pytesseract.Output.DICT, config=cfg)
         except Exception:
             continue
         
@@ -110,19 +180,68 @@ def ocr_multi_pass(img, langs="por+eng", upscale_factor=2):
             except Exception:
                 continue
             
-            # Desfaz o upscale das coordenadas
-            l = int(l / upscale_factor)
-            t = int(t / upscale_factor)
-            w = int(max(1, w / upscale_factor))
-            h = int(max(1, h / upscale_factor))
+            # Imagem de origem no mosaico (caixas nas faixas entre imagens são descartadas)
+            k = mosaic_owner(pass_imgs, origins, l + w / 2, t + h / 2)
+            if k is None:
+                continue
+
+            # Desfaz o deslocamento no mosaico e o upscale da imagem de origem
+            factor = scales[k][0]
+            l = int((l - origins[k][0]) / factor)
+            t = int((t - origins[k][1]) / factor)
+            w = int(max(1, w / factor))
+            h = int(max(1, h / factor))
             
             # Cria chave texto@posição discretizada para mesclar duplicatas entre passagens
             key = f"{txt}@{l//4},{t//4}"
-            prev = results.get(key)
+            prev = results[k].get(key)
             if prev is None or conf > prev['conf']:
-                results[key] = {'text': txt, 'x': l, 'y': t, 'w': w, 'h': h, 'conf': conf}
+                results[k][key] = {'text': txt, 'x': l, 'y': t, 'w': w, 'h': h, 'conf': conf}
+
+    if names:
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        batch = f", lote de {len(imgs)}" if len(imgs) > 1 else ""
+        for name, (factor, text_h) in zip(names, scales):
+            measured = f"texto ~{text_h:.0f}px -> " if text_h else ""
+            print(f"[OCR] {name}: {measured}upscale x{factor:g} ({elapsed_ms:.0f} ms{batch})")
     
-    return list(results.values())
+    return [list(r.values()) for r in results]
+
+# OCR de palavras isoladas (fallback do backend glyph) em uma única chamada do tesseract: os recortes,
+# cada um ampliado pelo próprio fator, vão em um mosaico, uma palavra por linha.
+# Devolve (texto, conf) ou None para cada recorte
+def ocr_words(crops, langs="por+eng", upscale_factor=OCR_UPSCALE, gutter=MOSAIC_GUTTER):
+    if not crops:
+        return []
+    imgs = []
+    for c in crops:
+        im = Image.fromarray(np.ascontiguousarray(c))
+        imgs.append(upscale_image(im, factor=resolve_upscale(im, upscale_factor)[0]))
+    mosaic, origins = build_mosaic(imgs, gutter=gutter)
+    try:
+        data = pytesseract.image_to_data(mosaic, output_type=pytesseract.Output.DICT, config=f"--psm 6 -l {langs}")
+    except Exception:
+        return [None] * len(crops)
+    parts = [[] for _ in crops]
+    for i, raw in enumerate(data.get('text', [])):
+        raw = (raw or "").strip()
+        if not raw:
+            continue
+        l, t, w, h = data['left'][i], data['top'][i], data['width'][i], data['height'][i]
+        k = mosaic_owner(imgs, origins, l + w / 2, t + h / 2)
+        if k is not None:
+            parts[k].append((l, raw, float(data['conf'][i] or 0)))
+    out = []
+    for p in parts:
+        p.sort()
+        out.append(("".join(t for _, t, _ in p), min(c for _, _, c in p)) if p else None)
+    return out
+
+# OCR pelos modelos de glifos (glyph_ocr); palavras com glifos duvidosos vão juntas para o tesseract
+@profiled
+def ocr_glyphs(img, langs="por+eng", upscale_factor=OCR_UPSCALE):
+    gray = np.asarray(img.convert('L'))
+    return glyph_ocr.recognize(gray, fallback=lambda crops: ocr_words(crops, langs=langs, upscale_factor=upscale_factor))
 
 # Normaliza e filtra TAGs detectadas; mescla por posição e confiança
 def normalize_tags(elems, tol_x=12, tol_y=8):
@@ -202,15 +321,53 @@ def mark_coils_by_max_x(tags, x_margin=COIL_X_MARGIN):
     
     return tags, x_threshold
 
-# Orquestra o pipeline: OCR multi-pass, normaliza, deduplica, marca bobinas e salva artefatos
-def detect_tags(image_path, langs='por+eng', upscale_factor=2, save_vis=True, save_json=True):
+# Abre a figura: recorte do contêiner crops.u8 (sem decodificar PNG) ou o arquivo de imagem
+def open_image(image_path):
+    gray = crop_view(image_path)
+    if gray is not None:
+        return Image.fromarray(gray, mode='L').convert('RGB')
+    return Image.open(image_path).convert('RGB')
+
+# Palavra que pode virar TAG (mesmo critério de normalize_tags: '%' seguido de um endereço válido)
+def is_address_word(text):
+    s = str(text or "").replace(',', '.').strip().strip('.')
+    return s.startswith('%') and parse_address(s) is not None
+
+# Palavras da camada de texto do PDF para a imagem (em pixels do recorte); None se não houver
+# (PDF só com imagem ou figura que não veio do 0_pdf_extractor) ou se nenhuma palavra for um
+# endereço (só título/comentários): nesses casos a Network vai para o OCR
+def load_text_layer_words(base):
+    words = get_store().tags(base, TAGS_TEXT)
+    if words is None:
+        path = os.path.join(TAGS_OUT_DIR, f"{base}{TEXT_LAYER_SUFFIX}")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            words = json.load(f).get("words", [])
+    if not any(is_address_word(w.get("text")) for w in words):
+        return None
+    return words
+
+# Orquestra o pipeline: TAGs da camada de texto do PDF (ou OCR como alternativa: modelos de glifos
+# ou multi-pass do tesseract, conforme 'backend'), normaliza, deduplica, marca bobinas e salva artefatos
+@profiled
+def detect_tags(image_path, langs='por+eng', upscale_factor=OCR_UPSCALE, save_vis=True, save_json=True, use_text_layer=True,
+                backend=OCR_BACKEND, ocr_raw=None):
     base = os.path.splitext(os.path.basename(image_path))[0]
-    img = Image.open(image_path).convert('RGB')
+    img = open_image(image_path)
     
     W, H = img.size
 
-    # OCR multi-pass
-    ocr_raw = ocr_multi_pass(img, langs=langs, upscale_factor=upscale_factor)
+    # Camada de texto do PDF; OCR apenas se a Network não tiver texto extraído.
+    # 'ocr_raw' já preenchido: OCR feito em lote pelo chamador (ocr_multi_pass_batch)
+    if ocr_raw is None:
+        words = load_text_layer_words(base) if use_text_layer else None
+        if words is not None:
+            ocr_raw = [dict(w) for w in words]
+        elif backend == "glyph":
+            ocr_raw = ocr_glyphs(img, langs=langs, upscale_factor=upscale_factor)
+        else:
+            ocr_raw = ocr_multi_pass(img, langs=langs, upscale_factor=upscale_factor, name=base)
 
     # Normalização das TAGs
     tags_objs = normalize_tags(ocr_raw)
@@ -243,32 +400,84 @@ def detect_tags(image_path, langs='por+eng', upscale_factor=2, save_vis=True, sa
 
         vis_path = os.path.join(DEBUG_DIR, f"{base}_tags_vis.png")
         vis.save(vis_path)
+        add_file_bytes("detect_tags.vis_png", vis_path)
 
-    # Salva JSON
+    # Salva no banco de artefatos e o JSON de depuração
     json_path = None
     if save_json:
+        get_store().put_tags(base, TAGS_INFO, tags_final)
         json_path = os.path.join(TAGS_OUT_DIR, f"{base}_tags_info.json")
         with open(json_path, "w", encoding="utf-8") as f:
             json.dump(tags_final, f, ensure_ascii=False, indent=2)
+        add_file_bytes("detect_tags.json", json_path)
 
     return tags_final, vis_path, json_path
 
 # ---- MAIN ----
 
 def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Detecta as TAGs das Networks (camada de texto do PDF ou OCR)")
+    ap.add_argument("--ocr", action="store_true",
+                    help="Ignora a camada de texto do PDF e usa sempre o OCR")
+    ap.add_argument("--backend", choices=["glyph", "tesseract"], default=OCR_BACKEND,
+                    help="OCR: modelos de glifos com fallback no tesseract (glyph) ou só o tesseract multi-pass")
+    ap.add_argument("--batch-size", type=int, default=OCR_BATCH_SIZE,
+                    help="Networks por chamada do tesseract no backend tesseract (mosaico); 1 = uma chamada por imagem")
+    ap.add_argument("--upscale", default=OCR_UPSCALE,
+                    help="Upscale do tesseract: 'auto' (pela altura do texto) ou um fator fixo (ex.: 2)")
+    args = ap.parse_args()
+    upscale = args.upscale if args.upscale == "auto" else float(args.upscale)
+
     images = [
         os.path.join(INPUT_DIR, f)
         for f in os.listdir(INPUT_DIR)
         if f.lower().endswith((".png", ".jpg", ".jpeg", ".tif", ".tiff"))
     ]
+    # Recortes gravados só no contêiner (0_pdf_extractor --no-png)
+    images += [p for p in crop_image_paths(INPUT_DIR) if p not in images]
     
     if not images:
         print(f"No images found in: {INPUT_DIR}")
         return
 
-    print(f"Processing {len(images)} images...\n")
-    for img_path in images:
-        tags, vis, jpath = detect_tags(img_path, langs="por+eng", upscale_factor=2, save_vis=True, save_json=True)
+    # Com retomada (PIPELINE_RESUME=1), pula imagens já concluídas no diário
+    journal = get_journal()
+    by_network = {network_key(p): p for p in images}
+    pending = journal.pending(by_network, JOURNAL_STAGE)
+    if len(pending) < len(by_network):
+        print(f"[RESUME] {len(by_network) - len(pending)} image(s) already processed")
+
+    # Backend tesseract: as Networks sem camada de texto vão em lotes de --batch-size (um mosaico por lote).
+    # Falha de um lote é registrada no diário para cada Network dele, que então faz o OCR sozinha no seu passo
+    batched = {}
+    if args.backend == "tesseract" and args.batch_size > 1:
+        need = [n for n in pending
+                if args.ocr or load_text_layer_words(os.path.splitext(os.path.basename(by_network[n]))[0]) is None]
+        for i in range(0, len(need), args.batch_size):
+            chunk = need[i:i + args.batch_size]
+            try:
+                outs = ocr_multi_pass_batch([open_image(by_network[n]) for n in chunk], langs="por+eng",
+                                            upscale_factor=upscale, names=chunk)
+            except Exception as e:
+                print(f"[ERRO] Lote {i // args.batch_size + 1}: {e} (OCR por imagem)")
+                for n in chunk:
+                    journal.record_failure(n, JOURNAL_STAGE, f"OCR em lote: {e}")
+                continue
+            batched.update(zip(chunk, outs))
+            print(f"[OCR] Lote {i // args.batch_size + 1}: {len(chunk)} imagem(ns) em um mosaico")
+
+    print(f"Processing {len(pending)} images...\n")
+    for network in pending:
+        img_path = by_network[network]
+        try:
+            with journal.step(network, JOURNAL_STAGE):
+                tags, vis, jpath = detect_tags(img_path, langs="por+eng", upscale_factor=upscale, save_vis=True,
+                                               save_json=True, use_text_layer=not args.ocr, backend=args.backend,
+                                               ocr_raw=batched.get(network))
+        except Exception as e:
+            print(f"[ERRO] {os.path.basename(img_path)}: {e}")
+            continue
         print(f"- {os.path.basename(img_path)}: {len(tags)} tags (coils marked) -> vis: {os.path.basename(vis) if vis else 'none'}")
 
 if __name__ == "__main__":
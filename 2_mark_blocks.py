@@ -1,9 +1,19 @@
 # 2_mark_blocks.py
 # Marca e fragmenta linhas em diagramas Ladder a partir de imagens, recorta a coluna de bobinas (margem direita),
 # gera retângulos a partir de horizontais fragmentadas e exporta verticais válidas. Preserva imagens de depuração.
+# Com os segmentos vetoriais do PDF (*_vector.json, gerado pelo 0_pdf_extractor), faz o mesmo diretamente sobre
+# os segmentos, sem processar pixels; --raster força o caminho por imagem (entradas digitalizadas).
+# Modo coarse-to-fine (--coarse 2|4): as linhas candidatas saem da imagem reduzida e só faixas estreitas
+# em volta delas são binarizadas, abertas e filtradas na resolução cheia.
+# Motor RLE (--engine rle): as linhas saem das sequências de pixels de tinta de cada linha/coluna da imagem
+# binária, como segmentos, e seguem pelo mesmo caminho dos segmentos vetoriais (máscaras só para depuração).
 
 import os, glob, cv2, csv, json
 import numpy as np
+from pipeline_profiling import profiled, span, add_file_bytes
+from pipeline_journal import get_journal, network_key
+from artifact_store import get_store
+from crop_store import crop_view, crop_image_paths
 
 # ---- DIRETORIOS ----
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -42,6 +52,25 @@ TRIM_BOTTOM = 16  # Corta 16 px da base após construir a caixa
 ENABLE_RECT_MERGE = False
 MERGE_IOU_THRESH = 0.05  # Limite de interseção p/ mesclar
 
+# ---- PARAMETROS DO CAMINHO VETORIAL ----
+VECTOR_SUFFIX = "_vector.json"
+VECTOR_POS_TOL_PX = 2   # Tolerância de alinhamento ao juntar segmentos colineares
+VECTOR_LINE_HALF_W = 2  # Meia largura de uma vertical na máscara raster (linha + dilatação)
+
+# ---- PARAMETROS DO MODO COARSE-TO-FINE ----
+COARSE_FACTOR = 1          # 1 = resolução cheia; 2 ou 4 = candidatos na imagem reduzida, refinados em faixas
+COARSE_BAND_PAD = 6        # Folga (px, resolução cheia) em volta de cada candidato, além de 2 x fator
+COARSE_CONTEXT_PX = 16     # Contexto extra da faixa para a binarização adaptativa (bloco de 31 px)
+COARSE_MATCH_TOL_PX = 2    # Tolerância ao comparar verticais/retângulos com a resolução cheia
+
+# ---- PARAMETROS DO MOTOR RLE ----
+LINE_ENGINE = "morph"      # "morph" = abertura morfológica + componentes conectados; "rle" = sequências por linha/coluna
+RLE_POS_GAP_PX = 3         # Sequências em linhas/colunas a até 3 px uma da outra formam o mesmo traço (dilatação 3x5 do morph)
+RLE_JOIN_PX = 5            # ... desde que se sobreponham ou estejam a até 5 px no comprimento
+RLE_EXTEND_PX = 2          # Extensão de cada ponta do traço (meio comprimento da dilatação 3x5 do morph)
+
+JOURNAL_STAGE = "2_mark_blocks"
+
 # ---- FUNÇÕES UTILITÁRIAS ----
 
 # Carrega imagens de um diretório com extensões comuns
@@ -50,29 +79,41 @@ def load_images(img_dir):
     files = []
     for e in exts:
         files.extend(glob.glob(os.path.join(img_dir, e)))
+    # Recortes gravados só no contêiner crops.u8 (0_pdf_extractor --no-png)
+    files.extend(p for p in crop_image_paths(img_dir) if p not in files)
     return sorted(files)
 
+# Lê a figura em BGR: recorte do contêiner crops.u8 (sem decodificar PNG) ou o arquivo de imagem
+def read_image(path):
+    gray = crop_view(path)
+    if gray is not None:
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    return cv2.imread(path)
+
 # Binariza imagem em tons de cinza com limiar adaptativo
-def binarize(img_gray):
+def binarize(img_gray, block=31):
     return cv2.adaptiveThreshold(
         img_gray, 255,
         cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV,
-        31, 10
+        block, 10
     )
 
-# Extrai linhas verticais a partir da imagem binária
-def extract_vertical(binary):
-    h, w = binary.shape
-    klen = max(10, h // 60)
+# Comprimentos dos elementos de abertura (vertical, horizontal) para uma imagem h x w
+def line_kernel_lengths(shape):
+    h, w = shape[:2]
+    return max(10, h // 60), max(10, w // 60)
+
+# Extrai linhas verticais a partir da imagem binária ('klen' fixo quando a imagem é uma faixa)
+def extract_vertical(binary, klen=None):
+    klen = klen or line_kernel_lengths(binary.shape)[0]
     k = cv2.getStructuringElement(cv2.MORPH_RECT, (1, klen))
     opened = cv2.morphologyEx(binary, cv2.MORPH_OPEN, k, iterations=1)
     dil = cv2.dilate(opened, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 5)), iterations=1)
     return dil
 
-# Extrai linhas horizontais a partir da imagem binária
-def extract_horizontal(binary):
-    h, w = binary.shape
-    klen = max(10, w // 60)
+# Extrai linhas horizontais a partir da imagem binária ('klen' fixo quando a imagem é uma faixa)
+def extract_horizontal(binary, klen=None):
+    klen = klen or line_kernel_lengths(binary.shape)[1]
     k = cv2.getStructuringElement(cv2.MORPH_RECT, (klen, 1))
     opened = cv2.morphologyEx(binary, cv2.MORPH_OPEN, k, iterations=1)
     dil = cv2.dilate(opened, cv2.getStructuringElement(cv2.MORPH_RECT, (5, 3)), iterations=1)
@@ -94,6 +135,106 @@ def filter_by_length(mask, orientation="horizontal", min_len=None, max_len=None)
         out[labels == i] = 255
     return out
 
+# ---- COARSE-TO-FINE ----
+
+# Caixas (x1, y1, x2, y2, resolução cheia) das linhas candidatas, detectadas na imagem reduzida por 'factor'.
+# Os elementos de abertura ficam um pouco menores que os da resolução cheia (superconjunto dos candidatos)
+def coarse_candidates(gray, factor, pad=0):
+    h, w = gray.shape
+    # Redução pelo mínimo de cada bloco fator x fator: traços finos (1-2 px) continuam pretos e ligados,
+    # o que a média (INTER_AREA) não garante, e o conjunto de candidatos continua contendo o da resolução cheia
+    hs, ws = max(1, h // factor), max(1, w // factor)
+    small = np.ascontiguousarray(gray[:hs * factor, :ws * factor].reshape(hs, factor, ws, factor).min(axis=(1, 3)))
+    small_bin = binarize(small, block=max(3, (31 // factor) | 1))
+    klen_v, klen_h = line_kernel_lengths(gray.shape)
+    boxes = {}
+    for orientation, ksize in (("vertical", (1, max(2, klen_v // factor - 1))),
+                               ("horizontal", (max(2, klen_h // factor - 1), 1))):
+        opened = cv2.morphologyEx(small_bin, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, ksize))
+        num, _labels, stats, _ = cv2.connectedComponentsWithStats(opened, connectivity=8)
+        out = []
+        for x, y, bw, bh, _area in stats[1:num]:
+            # Vertical que nem com a folga da faixa chega ao comprimento mínimo é descartada já aqui
+            if orientation == "vertical" and bh * factor + 2 * pad < V_MIN_PX:
+                continue
+            out.append((int(x * factor), int(y * factor), int((x + bw) * factor - 1), int((y + bh) * factor - 1)))
+        boxes[orientation] = out
+    return boxes, small_bin
+
+# Refina um candidato na resolução cheia: binariza a faixa (com contexto), abre com o mesmo elemento da
+# imagem inteira e filtra por comprimento. Componentes que tocam a borda interna da faixa pertencem a
+# outro candidato e são descartados. Retorna (x1, y1, máscara da faixa)
+def refine_band(gray, box, orientation, klen, pad, min_len=None, max_len=None):
+    H, W = gray.shape
+    x1, y1 = max(0, box[0] - pad), max(0, box[1] - pad)
+    x2, y2 = min(W - 1, box[2] + pad), min(H - 1, box[3] + pad)
+    cx1, cy1 = max(0, x1 - COARSE_CONTEXT_PX), max(0, y1 - COARSE_CONTEXT_PX)
+    cx2, cy2 = min(W - 1, x2 + COARSE_CONTEXT_PX), min(H - 1, y2 + COARSE_CONTEXT_PX)
+    crop_bin = binarize(np.ascontiguousarray(gray[cy1:cy2 + 1, cx1:cx2 + 1]))
+    extract = extract_vertical if orientation == "vertical" else extract_horizontal
+    band = extract(crop_bin, klen)[y1 - cy1:y2 - cy1 + 1, x1 - cx1:x2 - cx1 + 1]
+    if band.max() == 0:
+        return x1, y1, band
+    out = np.zeros_like(band)
+    bh, bw = band.shape
+    num, labels, stats, _ = cv2.connectedComponentsWithStats(band, connectivity=8)
+    for i in range(1, num):
+        x, y, w, h, _area = stats[i]
+        length = w if orientation == "horizontal" else h
+        if min_len is not None and length < min_len:
+            continue
+        if max_len is not None and length > max_len:
+            continue
+        if (x == 0 and x1 > 0) or (y == 0 and y1 > 0) or (x + w == bw and x2 < W - 1) or (y + h == bh and y2 < H - 1):
+            continue
+        out[labels == i] = 255
+    return x1, y1, out
+
+# Máscaras de verticais e horizontais já filtradas por comprimento (equivalentes a extract_* + filter_by_length
+# na resolução cheia), processando na resolução cheia só as faixas dos candidatos da imagem reduzida
+@profiled
+def extract_lines_coarse_to_fine(gray, factor):
+    pad = 2 * factor + COARSE_BAND_PAD
+    boxes, small_bin = coarse_candidates(gray, factor, pad)
+    klen_v, klen_h = line_kernel_lengths(gray.shape)
+    vert = np.zeros(gray.shape, np.uint8)
+    horiz = np.zeros(gray.shape, np.uint8)
+    for box in boxes["vertical"]:
+        x1, y1, band = refine_band(gray, box, "vertical", klen_v, pad, min_len=V_MIN_PX)
+        view = vert[y1:y1 + band.shape[0], x1:x1 + band.shape[1]]
+        np.maximum(view, band, out=view)
+    for box in boxes["horizontal"]:
+        x1, y1, band = refine_band(gray, box, "horizontal", klen_h, pad, max_len=H_MAX_PX)
+        view = horiz[y1:y1 + band.shape[0], x1:x1 + band.shape[1]]
+        np.maximum(view, band, out=view)
+    return vert, horiz, small_bin
+
+# Compara dois resultados do estágio (ex.: resolução cheia x coarse-to-fine): pares de verticais e de
+# retângulos com todas as coordenadas a até 'tol' px. Retorna contagens e a maior diferença encontrada
+def compare_line_results(verticals_a, rects_a, verticals_b, rects_b, tol=COARSE_MATCH_TOL_PX):
+    def match(items_a, items_b):
+        used = set()
+        matched, worst = 0, 0
+        for a in items_a:
+            best = None
+            for j, b in enumerate(items_b):
+                if j in used:
+                    continue
+                d = max(abs(p - q) for p, q in zip(a, b))
+                if d <= tol and (best is None or d < best[0]):
+                    best = (d, j)
+            if best is not None:
+                used.add(best[1])
+                matched += 1
+                worst = max(worst, best[0])
+        return {"matched": matched, "a": len(items_a), "b": len(items_b), "max_diff_px": worst}
+
+    key = lambda v: (v["x"], v["y1"], v["y2"])
+    result = {"verticals": match([key(v) for v in verticals_a], [key(v) for v in verticals_b]),
+              "rects": match([tuple(r) for r in rects_a], [tuple(r) for r in rects_b])}
+    result["equivalent"] = all(r["matched"] == r["a"] == r["b"] for r in result.values())
+    return result
+
 # Fecha pequenos gaps em linhas horizontais ao longo de múltiplas iterações
 def close_horizontal_gaps(mask, gap_max=35, iters=2):
     if mask.max() == 0:
@@ -194,17 +335,32 @@ def overlay_lines(rgb, vert_mask, horiz_mask):
 
 # ---- INJEÇÃO DE COLUNA DE CORTE NA MARGEM DIREITA ----
 
+# Posição x da coluna de corte: margem direita fixa ou a partir do x das bobinas (TAGs)
+def coil_boundary_x(image_width, right_margin_px=RIGHT_MARGIN_PIXELS):
+    return max(0, image_width - int(right_margin_px))
+
+# Margem direita da área de bobinas de uma imagem
+def coil_right_margin(base_name, image_width):
+    coil_x = load_coil_x_from_json(base_name)
+    if coil_x is not None:
+        return max(0, image_width - coil_x + OFFSET_LEFT)
+    return RIGHT_MARGIN_PIXELS
+
 # Injeta uma coluna branca na posição x = W - RIGHT_MARGIN_PIXELS para forçar corte na área de bobina
 def inject_coil_boundary_cut(vert_mask, image_width, right_margin_px=RIGHT_MARGIN_PIXELS):
     h, w = vert_mask.shape
-    x_thr = max(0, image_width - int(right_margin_px))
-    x_thr = min(w - 1, x_thr)
+    x_thr = min(w - 1, coil_boundary_x(image_width, right_margin_px))
     out = vert_mask.copy()
     out[:, x_thr:x_thr+1] = 255
     return out, x_thr
 
 # Função para carregar o valor "x" das bobinas do JSON correspondente
 def load_coil_x_from_json(base_name):
+    # Consulta indexada no banco de artefatos (menor x entre as bobinas)
+    coil_x = get_store().coil_x(base_name)
+    if coil_x is not None:
+        return coil_x
+
     # Ajusta nome para buscar JSON correspondente
     json_pattern = os.path.join(TAGS_DIR, f"{base_name}*_tags_with_nf.json")
     json_files = glob.glob(json_pattern)
@@ -227,6 +383,19 @@ def load_coil_x_from_json(base_name):
 
 # ---- RETÂNGULOS A PARTIR DE HORIZONTAIS FRAGMENTADAS ----
 
+# Retângulo expandido (cobre as TAGs acima do fio) a partir de um trecho horizontal [x_start, x_end] na altura cy
+def span_to_rect(x_start, x_end, cy, w, h, pad_x, pad_y, center_offset_y, trim_top, trim_bottom):
+    cy = int(np.clip(cy + center_offset_y, 0, h - 1))
+
+    x1 = max(0, x_start - pad_x)
+    x2 = min(w - 1, x_end + pad_x)
+    y1 = max(0, cy - pad_y)
+    y2 = min(h - 1, cy + pad_y)
+
+    y1 = min(y1 + int(max(0, trim_top)), y2)
+    y2 = max(y2 - int(max(0, trim_bottom)), y1)
+    return [int(x1), int(y1), int(x2), int(y2)]
+
 # Converte componentes horizontais fragmentados em retângulos expandidos
 def horizontals_to_rectangles(
     horiz_mask,
@@ -250,19 +419,10 @@ def horizontals_to_rectangles(
         if bw < min_width:
             continue
 
-        cy = y + bh // 2
-        cy = int(np.clip(cy + center_offset_y, 0, h - 1))
-
-        x1 = max(0, x - pad_x)
-        x2 = min(w - 1, x + bw - 1 + pad_x)
-        y1 = max(0, cy - pad_y)
-        y2 = min(h - 1, cy + pad_y)
-
-        y1 = min(y1 + int(max(0, trim_top)), y2)
-        y2 = max(y2 - int(max(0, trim_bottom)), y1)
-
+        x1, y1, x2, y2 = span_to_rect(x, x + bw - 1, y + bh // 2, w, h, pad_x, pad_y,
+                                      center_offset_y, trim_top, trim_bottom)
         rect_mask[y1:y2+1, x1:x2+1] = 255
-        rects.append([int(x1), int(y1), int(x2), int(y2)])
+        rects.append([x1, y1, x2, y2])
 
     return rect_mask, rects
 
@@ -313,8 +473,6 @@ def draw_rectangles_on_image(img_bgr, rects, color=(255, 255, 0), thickness=2):
 
 # Exporta verticais válidas (sem a coluna de corte) em JSON com IDs e gera PNG auxiliar com IDs
 def export_verticals_with_ids(base_name, img_shape, vert_mask_no_cut, out_dir=DEBUG_DIR):
-    H, W = img_shape[:2]
-
     # Seleciona verticais válidas (sem a coluna de corte)
     vert_true, boxes = select_true_verticals(vert_mask_no_cut)
     verticals = []
@@ -323,8 +481,12 @@ def export_verticals_with_ids(base_name, img_shape, vert_mask_no_cut, out_dir=DE
         y1 = int(y)
         y2 = int(y + h - 1)
         verticals.append({"id": idx, "x": cx, "y1": y1, "y2": y2})
+    return save_verticals(base_name, img_shape, verticals, out_dir)
 
-    # Salva JSON
+# Salva as verticais (banco de artefatos + JSON de depuração) e o PNG auxiliar com IDs
+def save_verticals(base_name, img_shape, verticals, out_dir=DEBUG_DIR):
+    H, W = img_shape[:2]
+    get_store().put_verticals(base_name, verticals)
     out_json = os.path.join(out_dir, f"{base_name}__04_vert_lenFiltered.json")
     with open(out_json, "w", encoding="utf-8") as f:
         json.dump({"verticals": verticals}, f, ensure_ascii=False, indent=2)
@@ -344,95 +506,120 @@ def export_verticals_with_ids(base_name, img_shape, vert_mask_no_cut, out_dir=DE
 
 # ---- PIPELINE POR IMAGEM ----
 
+# Salva uma imagem de depuração e contabiliza os bytes gravados (instrumentação opcional)
+def save_debug_image(path, img):
+    ok = cv2.imwrite(path, img)
+    add_file_bytes("process_image.debug_png", path)
+    return ok
+
 # Executa o pipeline completo para uma única imagem e salva artefatos de depuração
-def process_image(path):
+# 'coarse' > 1: linhas candidatas na imagem reduzida, refinadas em faixas na resolução cheia
+@profiled
+def process_image(path, coarse=COARSE_FACTOR):
     name = os.path.splitext(os.path.basename(path))[0]
-    img = cv2.imread(path)
+    img = read_image(path)
     if img is None:
         print(f"[WARN] Failed to open: {path}")
-        return
-
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__00_original.png"), img)
+        return False
 
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    bin_img = binarize(gray)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__01_binary.png"), bin_img)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__00_original.png"), img)
 
-    # Extração de linhas
-    vert_raw = extract_vertical(bin_img)
-    horiz_raw = extract_horizontal(bin_img)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__02_vert_raw.png"), vert_raw)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__03_horiz_raw.png"), horiz_raw)
-
-    # Filtro por comprimento
-    vert_len = filter_by_length(vert_raw, "vertical", min_len=V_MIN_PX, max_len=None)
-    horiz_len = filter_by_length(horiz_raw, "horizontal", min_len=None, max_len=H_MAX_PX)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__04_vert_lenFiltered.png"), vert_len)
+    if coarse > 1:
+        # Binarização, extração e filtro por comprimento só nas faixas dos candidatos
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        with span("process_image.coarse_to_fine"):
+            vert_len, horiz_len, coarse_bin = extract_lines_coarse_to_fine(gray, coarse)
+        save_debug_image(os.path.join(DEBUG_DIR, f"{name}__01_binary_coarse.png"), coarse_bin)
+    else:
+        with span("process_image.binarize"):
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            bin_img = binarize(gray)
+        save_debug_image(os.path.join(DEBUG_DIR, f"{name}__01_binary.png"), bin_img)
+
+        # Extração de linhas
+        with span("process_image.extract_lines"):
+            vert_raw = extract_vertical(bin_img)
+            horiz_raw = extract_horizontal(bin_img)
+        save_debug_image(os.path.join(DEBUG_DIR, f"{name}__02_vert_raw.png"), vert_raw)
+        save_debug_image(os.path.join(DEBUG_DIR, f"{name}__03_horiz_raw.png"), horiz_raw)
+
+        # Filtro por comprimento
+        with span("process_image.filter_by_length"):
+            vert_len = filter_by_length(vert_raw, "vertical", min_len=V_MIN_PX, max_len=None)
+            horiz_len = filter_by_length(horiz_raw, "horizontal", min_len=None, max_len=H_MAX_PX)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__04_vert_lenFiltered.png"), vert_len)
 
     # Exporta verticais válidas (sem o corte), com IDs, antes de injetar a coluna
-    export_verticals_with_ids(base_name=name, img_shape=img.shape, vert_mask_no_cut=vert_len, out_dir=DEBUG_DIR)
+    with span("process_image.export_verticals"):
+        export_verticals_with_ids(base_name=name, img_shape=img.shape, vert_mask_no_cut=vert_len, out_dir=DEBUG_DIR)
 
     # Injeta a coluna de corte na margem direita e salva
     H_img, W_img = img.shape[:2]
     # Carrega valor dinâmico de x das bobinas do JSON
-    coil_x = load_coil_x_from_json(name)
-    if coil_x is not None:
-        right_margin_px = max(0, W_img - coil_x + OFFSET_LEFT)
-    else:
-        right_margin_px = RIGHT_MARGIN_PIXELS
+    right_margin_px = coil_right_margin(name, W_img)
     vert_len_with_cut, x_thr = inject_coil_boundary_cut(vert_len, W_img, right_margin_px=right_margin_px)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__05_vert_lenFiltered_with_coil_cut.png"), vert_len_with_cut)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__05_vert_lenFiltered_with_coil_cut.png"), vert_len_with_cut)
 
     # Para referência, salva horizontais filtradas por comprimento
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__05_horiz_lenFiltered.png"), horiz_len)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__05_horiz_lenFiltered.png"), horiz_len)
 
     # Completa horizontais (fecha gaps)
-    horiz_completed = close_horizontal_gaps(horiz_len, gap_max=GAP_MAX_PX, iters=ITER_CLOSE)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__06_horiz_completed.png"), horiz_completed)
+    with span("process_image.close_horizontal_gaps"):
+        horiz_completed = close_horizontal_gaps(horiz_len, gap_max=GAP_MAX_PX, iters=ITER_CLOSE)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__06_horiz_completed.png"), horiz_completed)
 
     # Fragmenta horizontais usando exatamente as verticais com corte
-    horiz_fragmented, vert_true = fragment_horizontals_by_vertical_bboxes(
-        horiz_mask=horiz_completed,
-        vert_mask=vert_len_with_cut,   # chave: usa a máscara com a coluna de corte
-        cut_margin_x=CUT_MARGIN_X,
-        cut_margin_y=CUT_MARGIN_Y
-    )
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__07_horiz_fragmented_base.png"), horiz_fragmented)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__08_vert_trueOnly.png"), vert_true)
+    with span("process_image.fragment_horizontals"):
+        horiz_fragmented, vert_true = fragment_horizontals_by_vertical_bboxes(
+            horiz_mask=horiz_completed,
+            vert_mask=vert_len_with_cut,   # chave: usa a máscara com a coluna de corte
+            cut_margin_x=CUT_MARGIN_X,
+            cut_margin_y=CUT_MARGIN_Y
+        )
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__07_horiz_fragmented_base.png"), horiz_fragmented)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__08_vert_trueOnly.png"), vert_true)
 
     # Estica componentes (visualização)
     vert_final = stretch_components(vert_true, orientation="vertical", thickness=3)
     horiz_final = stretch_components(horiz_fragmented, orientation="horizontal", thickness=3)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__09_vert_stretched.png"), vert_final)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__10_horiz_stretched.png"), horiz_final)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__09_vert_stretched.png"), vert_final)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__10_horiz_stretched.png"), horiz_final)
 
     annotated = overlay_lines(img, vert_final, horiz_final)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__11_annotated_fragmented.png"), annotated)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__11_annotated_fragmented.png"), annotated)
 
     # ---- RETÂNGULOS A PARTIR DAS HORIZONTAIS FRAGMENTADAS ----
-    rect_mask, rects = horizontals_to_rectangles(
-        horiz_mask=horiz_fragmented,
-        pad_x=RECT_PAD_X,
-        pad_y=RECT_PAD_Y,
-        min_width=RECT_MIN_WIDTH,
-        center_offset_y=CENTER_OFFSET_Y,
-        trim_top=TRIM_TOP,
-        trim_bottom=TRIM_BOTTOM
-    )
+    with span("process_image.rectangles"):
+        rect_mask, rects = horizontals_to_rectangles(
+            horiz_mask=horiz_fragmented,
+            pad_x=RECT_PAD_X,
+            pad_y=RECT_PAD_Y,
+            min_width=RECT_MIN_WIDTH,
+            center_offset_y=CENTER_OFFSET_Y,
+            trim_top=TRIM_TOP,
+            trim_bottom=TRIM_BOTTOM
+        )
 
     if ENABLE_RECT_MERGE:
         rects = merge_rectangles(rects, iou_thresh=MERGE_IOU_THRESH)
 
     # Máscara e anotação
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__12_horiz_rect_mask.png"), rect_mask)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__12_horiz_rect_mask.png"), rect_mask)
     img_rects = draw_rectangles_on_image(img, rects, color=(255, 255, 0), thickness=2)
 
     # Desenha a margem direita (mesmo x_thr do corte) na anotação final
     out13 = img_rects.copy()
     cv2.rectangle(out13, (x_thr, 0), (W_img - 1, H_img - 1), (255, 200, 0), 2)
-    cv2.imwrite(os.path.join(DEBUG_DIR, f"{name}__13_horiz_rects_on_original.png"), out13)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__13_horiz_rects_on_original.png"), out13)
+
+    save_rects(name, rects)
+
+    print(f"[OK] Processed: {name} | Rectangles (fragments): {len(rects)}")
+    return True
 
-    # Exporta retângulos (CSV/JSON)
+# Exporta retângulos (banco de artefatos + CSV/JSON de depuração)
+def save_rects(name, rects):
+    get_store().put_rects(name, rects)
     csv_path = os.path.join(DEBUG_DIR, f"{name}__13_horiz_rects.csv")
     with open(csv_path, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
@@ -447,18 +634,226 @@ def process_image(path):
              for (x1, y1, x2, y2) in rects],
             f, ensure_ascii=False, indent=2
         )
+    add_file_bytes("process_image.rects", csv_path)
+    add_file_bytes("process_image.rects", json_path)
+
+# ---- PIPELINE POR SEGMENTOS VETORIAIS ----
+
+# Segmentos vetoriais da imagem (banco de artefatos; senão *_vector.json ao lado da imagem); None se não houver
+def load_vector_segments(name, img_dir=INPUT_FIGS_DIR):
+    segments = get_store().segments(name)
+    if segments is not None:
+        return segments
+    path = os.path.join(img_dir, f"{name}{VECTOR_SUFFIX}")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {"horizontal": data.get("horizontal", []), "vertical": data.get("vertical", [])}
 
-    print(f"[OK] Processed: {name} | Rectangles (fragments): {len(rects)}")
+# Junta intervalos colineares [(pos, a, b)] separados por até gap_max px (equivale ao fechamento de gaps)
+def merge_segments(segs, gap_max, pos_tol=VECTOR_POS_TOL_PX):
+    merged = []
+    for pos, a, b in sorted(segs, key=lambda s: (s[1], s[0])):
+        for m in merged:
+            if abs(m[0] - pos) <= pos_tol and a - m[2] - 1 <= gap_max and b >= m[1] - gap_max:
+                m[1], m[2] = min(m[1], a), max(m[2], b)
+                break
+        else:
+            merged.append([pos, a, b])
+    return merged
+
+# Verticais válidas a partir dos segmentos (mesmo critério de comprimento de select_true_verticals)
+def vector_verticals(vertical_segs):
+    min_len = max(V_MIN_PX, VERT_MIN_HEIGHT)
+    merged = merge_segments([(x, y1, y2) for x, y1, y2 in vertical_segs], gap_max=1)
+    kept = sorted((m for m in merged if m[2] - m[1] + 1 >= min_len), key=lambda m: (m[1], m[0]))
+    return [{"id": idx, "x": int(x), "y1": int(y1), "y2": int(y2)} for idx, (x, y1, y2) in enumerate(kept)]
+
+# Remove de cada horizontal o trecho que cruza uma vertical (com margens), como no caminho raster
+def cut_horizontals_at_verticals(horizontals, verticals, cut_margin_x=CUT_MARGIN_X, cut_margin_y=CUT_MARGIN_Y):
+    out = []
+    for y, a, b in horizontals:
+        cuts = sorted(
+            (v["x"] - VECTOR_LINE_HALF_W - cut_margin_x, v["x"] + VECTOR_LINE_HALF_W + cut_margin_x)
+            for v in verticals
+            if v["y1"] - cut_margin_y <= y <= v["y2"] + cut_margin_y and a <= v["x"] <= b
+        )
+        start = a
+        for c1, c2 in cuts:
+            if c1 > start:
+                out.append((y, start, c1 - 1))
+            start = max(start, c2 + 1)
+        if start <= b:
+            out.append((y, start, b))
+    return out
+
+# Executa o pipeline sobre os segmentos vetoriais do PDF e salva os mesmos artefatos do caminho raster
+@profiled
+def process_vector(path, segments):
+    name = os.path.splitext(os.path.basename(path))[0]
+    img = read_image(path)
+    if img is None:
+        print(f"[WARN] Failed to open: {path}")
+        return False
+    return process_segments(name, img, segments, source="vector")
+
+# Verticais, fragmentos e retângulos a partir de segmentos {"horizontal": [[x1, y, x2]], "vertical": [[x, y1, y2]]}
+# (do PDF ou do motor RLE); salva os mesmos artefatos do caminho raster
+def process_segments(name, img, segments, source="vector"):
+    H_img, W_img = img.shape[:2]
+
+    # Verticais válidas (sem o corte)
+    with span("process_segments.verticals"):
+        verticals = vector_verticals(segments.get("vertical", []))
+    save_verticals(name, img.shape, verticals, out_dir=DEBUG_DIR)
+
+    # Coluna de corte na margem direita (área das bobinas), como uma vertical de altura total
+    x_thr = min(W_img - 1, coil_boundary_x(W_img, coil_right_margin(name, W_img)))
+    cut_verticals = verticals + [{"id": -1, "x": x_thr, "y1": 0, "y2": H_img - 1}]
+
+    # Horizontais: filtro por comprimento, fechamento de gaps e fragmentação nas verticais
+    with span("process_segments.horizontals"):
+        horiz = [(y, x1, x2) for x1, y, x2 in segments.get("horizontal", []) if x2 - x1 + 1 <= H_MAX_PX]
+        horiz = merge_segments(horiz, gap_max=GAP_MAX_PX)
+        fragments = cut_horizontals_at_verticals(horiz, cut_verticals)
+
+    # Retângulos a partir dos fragmentos (mesmos parâmetros do caminho raster)
+    with span("process_segments.rectangles"):
+        rects = [
+            span_to_rect(a, b, y, W_img, H_img, RECT_PAD_X, RECT_PAD_Y, CENTER_OFFSET_Y, TRIM_TOP, TRIM_BOTTOM)
+            for y, a, b in sorted(fragments) if b - a + 1 >= RECT_MIN_WIDTH
+        ]
+    if ENABLE_RECT_MERGE:
+        rects = merge_rectangles(rects, iou_thresh=MERGE_IOU_THRESH)
+
+    # Anotação final: segmentos fragmentados, retângulos e margem direita
+    out13 = draw_rectangles_on_image(img, rects, color=(255, 255, 0), thickness=2)
+    for v in verticals:
+        cv2.line(out13, (v["x"], v["y1"]), (v["x"], v["y2"]), (0, 0, 255), 1)
+    for y, a, b in fragments:
+        cv2.line(out13, (a, y), (b, y), (0, 255, 0), 1)
+    cv2.rectangle(out13, (x_thr, 0), (W_img - 1, H_img - 1), (255, 200, 0), 2)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__13_horiz_rects_on_original.png"), out13)
+
+    save_rects(name, rects)
+
+    print(f"[OK] Processed ({source}): {name} | Rectangles (fragments): {len(rects)}")
+    return True
+
+# ---- MOTOR RLE (SEQUÊNCIAS POR LINHA/COLUNA) ----
+
+# Sequências de tinta com pelo menos 'min_len' px em cada linha ('horizontal') ou coluna ('vertical') da imagem
+# binária: arrays (pos, a, b), pos = linha/coluna e [a, b] inclusivo. Equivale à abertura com um elemento 1 x min_len
+def line_runs(binary, orientation, min_len):
+    ink = (binary > 0).astype(np.int8)
+    if orientation == "vertical":
+        ink = ink.T
+    edges = np.diff(np.pad(ink, ((0, 0), (1, 1))), axis=1)
+    pos, starts = np.nonzero(edges == 1)
+    _pos, ends = np.nonzero(edges == -1)
+    keep = ends - starts >= min_len
+    return pos[keep], starts[keep], ends[keep] - 1
+
+# Agrupa sequências de linhas/colunas próximas (a até 'pos_gap' px) que se sobrepõem (a até 'join' px) em
+# traços e devolve um segmento (pos central, a, b, espessura) por traço, com as pontas estendidas em 'extend' px
+def runs_to_segments(pos, starts, ends, pos_gap=RLE_POS_GAP_PX, join=RLE_JOIN_PX, extend=RLE_EXTEND_PX):
+    done, active = [], []   # traço: [primeira pos, última pos, a, b]
+    for p, a, b in zip(pos.tolist(), starts.tolist(), ends.tolist()):
+        still = []
+        for st in active:
+            (still if st[1] >= p - pos_gap else done).append(st)
+        active = still
+        hit = None
+        for st in active:
+            if a <= st[3] + join and b >= st[2] - join:
+                if hit is None:
+                    hit = st
+                    st[1], st[2], st[3] = p, min(st[2], a), max(st[3], b)
+                else:
+                    # A sequência liga dois traços: junta o segundo ao primeiro
+                    hit[0], hit[2], hit[3] = min(hit[0], st[0]), min(hit[2], st[2]), max(hit[3], st[3])
+                    st[0] = None
+        active = [st for st in active if st[0] is not None]
+        if hit is None:
+            active.append([p, p, a, b])
+    return [((p1 + p2) // 2, a - extend, b + extend, p2 - p1 + 1) for p1, p2, a, b in done + active]
+
+# Segmentos da imagem em tons de cinza no formato do *_vector.json, a partir das sequências da imagem binária
+@profiled
+def extract_segments_rle(gray):
+    binary = binarize(gray)
+    klen_v, klen_h = line_kernel_lengths(gray.shape)
+    H, W = gray.shape
+    horiz = runs_to_segments(*line_runs(binary, "horizontal", klen_h))
+    vert = runs_to_segments(*line_runs(binary, "vertical", klen_v))
+    # Mesma razão de aspecto de select_true_verticals (largura do traço + dilatação lateral de 1 px por lado)
+    vert = [v for v in vert if (v[2] - v[1] + 1) / (v[3] + 2) >= VERT_MIN_ASPECT]
+    return {
+        "horizontal": [[max(0, a), y, min(W - 1, b)] for y, a, b, _t in horiz],
+        "vertical": [[x, max(0, a), min(H - 1, b)] for x, a, b, _t in vert],
+    }, binary
+
+# Máscara de depuração com os segmentos desenhados (linhas de 3 px)
+def rasterize_segments(shape, segments, thickness=3):
+    mask = np.zeros(shape[:2], np.uint8)
+    for x1, y, x2 in segments.get("horizontal", []):
+        cv2.line(mask, (x1, y), (x2, y), 255, thickness)
+    for x, y1, y2 in segments.get("vertical", []):
+        cv2.line(mask, (x, y1), (x, y2), 255, thickness)
+    return mask
+
+# Executa o pipeline por imagem com o motor RLE: segmentos das sequências e depois o caminho dos segmentos
+@profiled
+def process_image_rle(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    img = read_image(path)
+    if img is None:
+        print(f"[WARN] Failed to open: {path}")
+        return False
+    with span("process_image_rle.segments"):
+        segments, bin_img = extract_segments_rle(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__01_binary.png"), bin_img)
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__02_vert_rle.png"),
+                     rasterize_segments(img.shape, {"vertical": segments["vertical"]}))
+    save_debug_image(os.path.join(DEBUG_DIR, f"{name}__03_horiz_rle.png"),
+                     rasterize_segments(img.shape, {"horizontal": segments["horizontal"]}))
+    return process_segments(name, img, segments, source="rle")
 
 # ---- MAIN ----
 
 def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Marca linhas e blocos das Networks (segmentos do PDF ou imagem)")
+    ap.add_argument("--raster", action="store_true",
+                    help="Ignora os segmentos vetoriais do PDF e processa sempre a imagem")
+    ap.add_argument("--coarse", type=int, choices=[1, 2, 4], default=COARSE_FACTOR,
+                    help="Caminho por imagem: detecta candidatos na imagem reduzida 2x/4x e refina em faixas (1 = desligado)")
+    ap.add_argument("--engine", choices=["morph", "rle"], default=LINE_ENGINE,
+                    help="Caminho por imagem: abertura morfológica (morph) ou sequências por linha/coluna (rle)")
+    args = ap.parse_args()
+
     files = load_images(INPUT_FIGS_DIR)
     if not files:
         print(f"No images found in: {INPUT_FIGS_DIR}")
         return
-    for f in files:
-        process_image(f)
+    # Com retomada (PIPELINE_RESUME=1), pula imagens já concluídas no diário
+    journal = get_journal()
+    by_network = {network_key(f): f for f in files}
+    pending = journal.pending(by_network, JOURNAL_STAGE)
+    if len(pending) < len(by_network):
+        print(f"[RESUME] {len(by_network) - len(pending)} image(s) already processed")
+    for network in pending:
+        with journal.step(network, JOURNAL_STAGE) as outcome:
+            segments = None if args.raster else load_vector_segments(network)
+            if segments is not None:
+                ok = process_vector(by_network[network], segments)
+            elif args.engine == "rle":
+                ok = process_image_rle(by_network[network])
+            else:
+                ok = process_image(by_network[network], coarse=args.coarse)
+            if not ok:
+                outcome.error = "failed to open image"
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,6 +3,10 @@
 # e gera uma saída legível (TXT) mostrando quais tags foram "aglomeradas" em quais blocos.
 
 import os, json, glob, re
+from plc_symbols import load_symbol_table, split_negation, SYMBOLS_PATH
+from pipeline_profiling import profiled, add_file_bytes
+from pipeline_journal import get_journal
+from artifact_store import get_store, TAGS_NF, GROUPS_AND
 
 # ---- DIRETORIOS ----
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -13,9 +17,10 @@ DEBUG_DIR      = os.path.join(BASE_DIR, "99_debug")
 
 # ---- PARAMETROS ----
 RECTS_SUFFIX_JSON = "__13_horiz_rects.json"   
-TAGS_SUFFIX_JSON  = "__tags_with_nf.json"    
+TAGS_SUFFIX_JSON  = "_tags_with_nf.json"    
 
 MIN_IOU_FOR_INTERSECT = 0.01
+JOURNAL_STAGE = "3_associate_tags_with_blocks"
 
 def load_json(path):
     if not os.path.exists(path):
@@ -87,7 +92,8 @@ def build_and_expression(tags):
 
 def normalize_tags_list(tags_json):
     """
-    Seus arquivos são uma lista direta de tags. Mantemos apenas não-coils.
+    Seus arquivos são uma lista direta de tags. Mantemos apenas contatos
+    (sem bobinas nem bits de memória de borda marcados pelo 1.5_detect_NF).
     """
     if isinstance(tags_json, list):
         tags = tags_json
@@ -96,11 +102,11 @@ def normalize_tags_list(tags_json):
     else:
         tags = []
 
-    # filtra coils
+    # filtra coils e bits de memória de borda
     filtered = []
     for t in tags:
         is_coil = bool(t.get("is_coil", False))
-        if is_coil:
+        if is_coil or t.get("edge_memory"):
             continue
         if all(k in t for k in ("text", "x", "y", "w", "h")):
             filtered.append(t)
@@ -134,30 +140,61 @@ def find_tags_file_for_base(image_base_name):
 
     return None
 
-def associate_tags_and_rects(image_base_name):
-    # Retângulos
+# Anota cada TAG com o ID do endereço na tabela de símbolos do projeto e com a negação (NF)
+def annotate_symbol_ids(tags, symbols):
+    for t in tags:
+        symbol_id = symbols.intern(t.get("text", ""))
+        if symbol_id is not None:
+            t["tag_id"] = symbol_id
+            t["negated"] = split_negation(t.get("text", ""))[1]
+    return tags
+
+# Avisa quando o banco de artefatos e o JSON da mesma Network existem e diferem
+def warn_if_json_differs(label, path, stored, from_json):
+    if from_json is not None and from_json != stored:
+        print(f"[AVISO] {label} de {path} diferem do banco de artefatos; usando o banco "
+              f"(--prefer_json para usar o arquivo)")
+
+# prefer_json: os arquivos JSON prevalecem sobre o banco de artefatos (edições manuais)
+@profiled
+def associate_tags_and_rects(image_base_name, symbols=None, prefer_json=False):
+    store = get_store()
+
+    # Retângulos (banco de artefatos; JSON se pedido ou se a Network não estiver no banco)
     rect_path = os.path.join(DEBUG_DIR, f"{image_base_name}{RECTS_SUFFIX_JSON}")
     rect_json = load_json(rect_path)
-    if rect_json is None:
-        print(f"[AVISO] Retângulos não encontrados: {rect_path}")
-        return None
-
-    # Tags
+    rects = None if prefer_json else store.rects(image_base_name)
+    if rects is None:
+        if rect_json is None:
+            print(f"[AVISO] Retângulos não encontrados: {rect_path}")
+            return None
+        rects = rect_list_from_rect_json(rect_json)
+    elif rect_json is not None:
+        warn_if_json_differs("Retângulos", rect_path, rects, rect_list_from_rect_json(rect_json))
+
+    # Tags (busca exata pela Network no banco; senão, localiza o arquivo JSON)
     tags_path = find_tags_file_for_base(image_base_name)
-    if tags_path is None:
-        print(f"[AVISO] TAGs não encontradas para base '{image_base_name}' em {TAGS_OUT_DIR}")
-        return None
-
-    tags_json = load_json(tags_path)
+    tags_json = None if prefer_json else store.tags(image_base_name, TAGS_NF)
     if tags_json is None:
-        print(f"[AVISO] Falha ao carregar arquivo de TAGs: {tags_path}")
-        return None
+        if tags_path is None:
+            print(f"[AVISO] TAGs não encontradas para base '{image_base_name}' em {TAGS_OUT_DIR}")
+            return None
+
+        tags_json = load_json(tags_path)
+        if tags_json is None:
+            print(f"[AVISO] Falha ao carregar arquivo de TAGs: {tags_path}")
+            return None
+
+        # Log do arquivo de tags efetivo
+        print(f"[INFO] Usando TAGs de: {tags_path}")
+    elif tags_path is not None:
+        from_json = load_json(tags_path)
+        warn_if_json_differs("TAGs", tags_path, normalize_tags_list(tags_json),
+                             None if from_json is None else normalize_tags_list(from_json))
 
-    # Log do arquivo de tags efetivo
-    print(f"[INFO] Usando TAGs de: {tags_path}")
-
-    rects = rect_list_from_rect_json(rect_json)
     tags = normalize_tags_list(tags_json)
+    if symbols is not None:
+        annotate_symbol_ids(tags, symbols)
 
     groups = [{"rect": r, "tags": []} for r in rects]
 
@@ -215,33 +252,55 @@ def write_readable_txt(image_base_name, groups):
         f.write("\n".join(lines))
     return out_path
 
+# Grava os grupos AND (banco de artefatos + JSON de depuração) e o texto legível de uma Network
+def write_groups_outputs(base, groups):
+    get_store().put_groups(base, GROUPS_AND, groups)
+    out_json = os.path.join(DEBUG_DIR, f"{base}__14_groups_AND.json")
+    with open(out_json, "w", encoding="utf-8") as f:
+        json.dump({
+            "image_base": base,
+            "logic": "AND within same rectangle",
+            "groups": groups
+        }, f, ensure_ascii=False, indent=2)
+    add_file_bytes("associate_tags_and_rects.json", out_json)
+
+    out_txt = write_readable_txt(base, groups)
+
+    print(f"[OK] {base}:")
+    print(f"    - grupos JSON: {out_json}")
+    print(f"    - leitura fácil: {out_txt}")
+
 # ---- MAIN ----
 
 def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Associa TAGs aos retângulos e gera as expressões AND por bloco")
+    ap.add_argument("--prefer_json", action="store_true",
+                    help="Lê retângulos e TAGs dos JSON mesmo quando a Network está no banco de artefatos")
+    args = ap.parse_args()
+
     rect_files = glob.glob(os.path.join(DEBUG_DIR, f"*{RECTS_SUFFIX_JSON}"))
     if not rect_files:
         print(f"[ERRO] Nenhum arquivo {RECTS_SUFFIX_JSON} encontrado em {DEBUG_DIR}")
         return
 
-    for rfile in sorted(rect_files):
-        base = os.path.basename(rfile)[:-len(RECTS_SUFFIX_JSON)]
-        groups = associate_tags_and_rects(base)
-        if groups is None:
-            continue
-
-        out_json = os.path.join(DEBUG_DIR, f"{base}__14_groups_AND.json")
-        with open(out_json, "w", encoding="utf-8") as f:
-            json.dump({
-                "image_base": base,
-                "logic": "AND within same rectangle",
-                "groups": groups
-            }, f, ensure_ascii=False, indent=2)
-
-        out_txt = write_readable_txt(base, groups)
-
-        print(f"[OK] {base}:")
-        print(f"    - grupos JSON: {out_json}")
-        print(f"    - leitura fácil: {out_txt}")
+    symbols = load_symbol_table(SYMBOLS_PATH)
+    # Com retomada (PIPELINE_RESUME=1), pula Networks já concluídas no diário
+    journal = get_journal()
+    bases = [os.path.basename(r)[:-len(RECTS_SUFFIX_JSON)] for r in sorted(rect_files)]
+    pending = journal.pending(bases, JOURNAL_STAGE)
+    if len(pending) < len(bases):
+        print(f"[RESUME] {len(bases) - len(pending)} Network(s) já associada(s)")
+    for base in pending:
+        with journal.step(base, JOURNAL_STAGE) as outcome:
+            groups = associate_tags_and_rects(base, symbols, args.prefer_json)
+            if groups is None:
+                outcome.error = "retângulos ou TAGs não encontrados"
+            else:
+                write_groups_outputs(base, groups)
+
+    symbols.save(SYMBOLS_PATH)
+    print(f"[OK] Tabela de símbolos: {len(symbols)} endereços -> {SYMBOLS_PATH}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
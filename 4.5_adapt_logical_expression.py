@@ -1,8 +1,14 @@
 # 4.5_adapt_logical_expression.py
 # Converte expressões lógicas (OR/AND/NOT) de arquivos finais em expressões Python válidas.
 # Lê arquivos TXT com expressões, faz parsing para AST e gera código Python equivalente.
+# Contatos de borda P(x)/N(x) viram comparações com o bit de memória x__prev (valor do scan anterior).
 
 import os, json, re
+import ast as py_ast
+from plc_symbols import load_symbol_table, edge_prev_name, tag_var_name, SYMBOLS_PATH
+from pipeline_profiling import profiled, add_file_bytes
+from pipeline_journal import get_journal, network_key
+from artifact_store import get_store
 
 # ---- DIRETORIOS ----
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -11,118 +17,580 @@ OUTPUT_DIR = os.path.join(BASE_DIR, "03_tags", "13_pseudo_final")
 
 # ---- PARAMETROS ----
 DEBUG = True  # Define como False para silenciar saída de debug
+JOURNAL_STAGE = "4.5_adapt_logical_expression"
+SIMPLIFY = True            # Aplica simplificação booleana entre o parsing e a emissão
+HASH_CONS_PROJECT = True   # Compartilha subárvores idênticas entre todos os rungs do projeto
+VERIFY_SIMPLIFY = False    # Confere cada rung simplificado por tabela-verdade (--verify); as regras são cobertas por --selftest
+VERIFY_MAX_VARS = 10       # Verifica equivalência por tabela-verdade até este número de TAGs
+EDGE_OPS = ('P', 'N')      # Contatos de borda positiva/negativa (operando: uma única TAG)
+CONSTANT_VARS = {"True_": True, "False_": False}   # Constantes de expressões Python lidas de volta (python_to_ast)
 
 # Imprime mensagens de debug apenas se DEBUG=True
 def dbg(*args):
     if DEBUG:
         print(" ".join(str(a) for a in args))
 
-# ---- PARSER RECURSIVO ----
+# ---- PARSER ITERATIVO ----
 
-# Constrói uma AST (Abstract Syntax Tree) a partir de uma string como: OR(AND(%A, NOT(%B)), %C)
-def parse_to_ast(s):
-    s = s.replace(" ", "")
+# Quebra a expressão em tokens (tipo, texto, posição na string original).
+# Espaços são ignorados em qualquer ponto (inclusive dentro de nomes), como no parser anterior.
+def tokenize(s):
+    tokens = []
     idx = 0
     L = len(s)
-
-    # Função auxiliar recursiva para fazer parsing de tokens da expressão
-    def parse_token():
-        nonlocal idx
-        if idx >= L:
-            raise ValueError("Unexpected end of expression")
-
-        # Operador (letras) ou variável (%...)
-        if s[idx].isalpha():  # nome de operador: AND, OR, NOT
+    while idx < L:
+        ch = s[idx]
+        if ch == ' ':
+            idx += 1
+            continue
+        if ch.isalpha():  # nome de operador (AND, OR, NOT) ou variável de texto
             start = idx
-            while idx < L and s[idx].isalpha():
+            chars = []
+            while idx < L and (s[idx].isalpha() or s[idx] == ' '):
+                if s[idx] != ' ':
+                    chars.append(s[idx])
                 idx += 1
-            name = s[start:idx]
-            if idx < L and s[idx] == '(':
-                idx += 1  # pula '('
-                args = []
-                # faz parsing de argumentos separados por vírgula até encontrar ')'
-                while True:
-                    if idx >= L:
-                        raise ValueError("Unclosed '(' after operator " + name)
-                    args.append(parse_token())
-                    # após um token, espera ',' ou ')'
-                    if idx < L and s[idx] == ',':
-                        idx += 1  # pula vírgula e continua
-                        continue
-                    elif idx < L and s[idx] == ')':
-                        idx += 1  # pula ')'
-                        break
-                    else:
-                        raise ValueError(f"Expected ',' or ')' at pos {idx} in {s}")
-                return ('OP', name.upper(), args)
-            else:
-                # isolado (sem parênteses) - trata como variável de texto
-                return ('VAR', name)
-        elif s[idx] == '%':  # variável começando com %
+            tokens.append(('NAME', ''.join(chars), start))
+        elif ch == '%':  # variável começando com %: aceita dígitos, letras, pontos, underscores
             start = idx
+            chars = ['%']
             idx += 1
-            # aceita dígitos, letras, pontos, underscores
-            while idx < L and (s[idx].isalnum() or s[idx] in "._"):
+            while idx < L and (s[idx].isalnum() or s[idx] in "._ "):
+                if s[idx] != ' ':
+                    chars.append(s[idx])
                 idx += 1
-            token = s[start:idx]
-            return ('VAR', token)
-        elif s[idx] == '(':
-            # expressão entre parênteses (aninhamento extra)
-            idx += 1
-            node = parse_token()
-            if idx >= L or s[idx] != ')':
-                raise ValueError("Missing closing ')' for parentheses group")
+            tokens.append(('VAR', ''.join(chars), start))
+        elif ch in "(),":
+            tokens.append((ch, ch, idx))
             idx += 1
-            return node
         else:
-            raise ValueError(f"Unexpected character '{s[idx]}' at position {idx}")
+            raise ValueError(f"Unexpected character '{ch}' at position {idx}")
+    tokens.append(('END', '', L))
+    return tokens
 
-    node = parse_token()
-    if idx != L:
-        # se algo sobrou, pode haver um problema (ex: caracteres extras)
-        raise ValueError(f"Extra characters after parse at pos {idx}: {s[idx:]}")
-    return node
+# Constrói uma AST (Abstract Syntax Tree) a partir de uma string como: OR(AND(%A, NOT(%B)), %C)
+# Usa pilha explícita (sem recursão), então o aninhamento não é limitado pelo recursionlimit.
+# Nós: ('VAR', nome) e ('OP', NOME_MAIUSCULO, [argumentos])
+def parse_to_ast(s):
+    tokens = tokenize(s)
+    pos = 0
+    stack = []  # quadros: ['OP', nome, args, posição] ou ['GROUP', posição]
 
-# ---- CONVERSÃO DE AST PARA EXPRESSÃO PYTHON ----
+    while True:
+        # 1) Espera um operando
+        kind, text, at = tokens[pos]
+        if kind == 'NAME' and tokens[pos + 1][0] == '(':
+            stack.append(['OP', text, [], at])
+            pos += 2
+            if tokens[pos][0] == 'END':
+                raise ValueError(f"Unclosed '(' after operator {text} at position {at}")
+            continue
+        if kind == 'NAME' or kind == 'VAR':
+            # nome isolado (sem parênteses) é tratado como variável de texto
+            value = ('VAR', text)
+            pos += 1
+        elif kind == '(':
+            # expressão entre parênteses (aninhamento extra)
+            stack.append(['GROUP', at])
+            pos += 1
+            continue
+        elif kind == 'END':
+            raise ValueError(f"Unexpected end of expression at position {at}")
+        else:
+            raise ValueError(f"Unexpected character '{text}' at position {at}")
+
+        # 2) Reduz quadros completos com o valor obtido
+        while True:
+            if not stack:
+                kind, text, at = tokens[pos]
+                if kind != 'END':
+                    raise ValueError(f"Extra characters after parse at position {at}: {s[at:]}")
+                return value
+            frame = stack[-1]
+            kind, text, at = tokens[pos]
+            if frame[0] == 'GROUP':
+                if kind != ')':
+                    raise ValueError(f"Missing closing ')' for parentheses group opened at position {frame[1]} (found at position {at})")
+                stack.pop()
+                pos += 1
+                continue
+            frame[2].append(value)
+            if kind == ',':
+                pos += 1
+                if tokens[pos][0] == 'END':
+                    raise ValueError(f"Unclosed '(' after operator {frame[1]} at position {frame[3]}")
+                break
+            if kind == ')':
+                stack.pop()
+                pos += 1
+                value = ('OP', frame[1].upper(), frame[2])
+                continue
+            if kind == 'END':
+                raise ValueError(f"Unclosed '(' after operator {frame[1]} at position {frame[3]}")
+            raise ValueError(f"Expected ',' or ')' at position {at} in {s}")
+
+# Faz o parsing de várias expressões em uma única chamada.
+# Retorna lista de (ast, erro) na mesma ordem; erro é None quando o parsing teve sucesso.
+@profiled
+def parse_many(exprs):
+    results = []
+    for expr in exprs:
+        try:
+            results.append((parse_to_ast(expr), None))
+        except ValueError as e:
+            results.append((None, e))
+    return results
 
-# Transforma '%I8.7' -> 'I8_7', '%M1.2' -> 'M1_2' (mantém letras/dígitos/underscore)
-def sanitize_var(var_token):
-    # remove '%' inicial se existir
-    if var_token.startswith('%'):
-        var_token = var_token[1:]
-    # substitui pontos por underscores
-    var_token = var_token.replace('.', '_')
-    # remove caracteres indesejados (por segurança)
-    var_token = re.sub(r'[^0-9A-Za-z_]', '_', var_token)
-    # garante que não comece com dígito (prefixo se necessário)
-    if re.match(r'^\d', var_token):
-        var_token = 'v_' + var_token
-    return var_token
+# ---- CONVERSÃO DE AST PARA EXPRESSÃO PYTHON ----
 
 # Converte AST (retornada por parse_to_ast) para string Python
+# Percorre a árvore em pós-ordem com pilha explícita (sem recursão)
 def ast_to_python(node):
-    ntype = node[0]
-    if ntype == 'VAR':
-        return sanitize_var(node[1])
-    elif ntype == 'OP':
-        op_name = node[1]
-        children = node[2]
+    out = []
+    stack = [(node, False)]
+    while stack:
+        n, visited = stack.pop()
+        ntype = n[0]
+        if ntype == 'VAR':
+            out.append(tag_var_name(n[1]))
+        elif ntype == 'OP':
+            op_name = n[1]
+            children = n[2]
+            if not visited:
+                if op_name == 'NOT' and len(children) != 1:
+                    raise ValueError("NOT must have exactly 1 argument")
+                if op_name in EDGE_OPS and (len(children) != 1 or children[0][0] != 'VAR'):
+                    raise ValueError(f"{op_name} must have exactly 1 tag argument")
+                if op_name not in ('NOT', 'AND', 'OR') + EDGE_OPS:
+                    # operador desconhecido - IMNOTSURE sobre operadores extras
+                    raise ValueError(f"Unknown operator: {op_name}")
+                stack.append((n, True))
+                for c in reversed(children):
+                    stack.append((c, False))
+                continue
+            parts = out[len(out) - len(children):]
+            del out[len(out) - len(children):]
+            if op_name == 'NOT':
+                out.append(f"(not {parts[0]})")
+            elif op_name == 'P':
+                out.append(f"({parts[0]} and (not {edge_prev_name(parts[0])}))")
+            elif op_name == 'N':
+                out.append(f"((not {parts[0]}) and {edge_prev_name(parts[0])})")
+            elif op_name == 'AND':
+                out.append("(" + " and ".join(parts) + ")")
+            else:
+                out.append("(" + " or ".join(parts) + ")")
+        else:
+            raise ValueError("Invalid AST node: " + str(n))
+    return out[0]
+
+# ---- SIMPLIFICAÇÃO BOOLEANA ----
+
+# Registro de hash-consing: chave -> (nó, id, chave, entradas dos filhos). A chave usa os ids inteiros dos
+# filhos, ('VAR', nome) ou ('OP', NOME, (id, ...)), então é montada uma única vez e não é aninhada
+def _intern(node, kids, table):
+    key = node if node[0] == 'VAR' else ('OP', node[1], tuple(k[1] for k in kids))
+    entry = table.get(key)
+    if entry is None:
+        entry = (node, len(table), key, kids)
+        table[key] = entry
+    return entry
+
+# Entrada de um novo nó OP a partir das entradas dos filhos
+def _intern_op(op_name, kids, table):
+    return _intern(('OP', op_name, [k[0] for k in kids]), kids, table)
+
+# Argumentos de um AND/OR com as cadeias do mesmo operador já achatadas: AND(x, AND(y, z)) -> [x, y, z]
+def _flat_args(node):
+    out = []
+    stack = list(reversed(node[2]))
+    while stack:
+        c = stack.pop()
+        if c[0] == 'OP' and c[1] == node[1]:
+            stack.extend(reversed(c[2]))
+        else:
+            out.append(c)
+    return out
+
+# Simplifica um nó OP a partir das entradas dos filhos já simplificados
+def _simplify_op(op_name, kids, table):
+    if op_name == 'NOT':
+        child = kids[0]
+        if len(kids) == 1 and child[0][0] == 'OP' and child[0][1] == 'NOT' and len(child[3]) == 1:
+            return child[3][0]
+        return _intern_op('NOT', kids, table)
+
+    if op_name not in ('AND', 'OR'):
+        return _intern_op(op_name, kids, table)
+
+    # Achata o que a simplificação dos filhos produziu com o mesmo operador e remove duplicatas
+    # preservando a ordem da primeira ocorrência
+    seen = set()
+    args = []
+    for k in kids:
+        for c in (k[3] if k[0][0] == 'OP' and k[0][1] == op_name else (k,)):
+            if c[1] not in seen:
+                seen.add(c[1])
+                args.append(c)
+
+    # Absorção: descarta argumentos cujo conjunto de operandos contém o de outro argumento
+    # Ex.: em um OR, o argumento AND(a, b) tem operandos {a, b}; qualquer outro argumento x tem {x}
+    inner_op = 'AND' if op_name == 'OR' else 'OR'
+    operand_sets = [frozenset(k[2][2]) if k[0][0] == 'OP' and k[0][1] == inner_op else frozenset([k[1]])
+                    for k in args]
+    kept = []
+    for i, c in enumerate(args):
+        absorbed = False
+        # Um conjunto unitário só conteria outro igual (duplicata, já removida)
+        if len(operand_sets[i]) > 1:
+            for j in range(len(args)):
+                if i == j:
+                    continue
+                if operand_sets[j] < operand_sets[i] or (operand_sets[j] == operand_sets[i] and j < i):
+                    absorbed = True
+                    break
+        if not absorbed:
+            kept.append(c)
+
+    if len(kept) == 1:
+        return kept[0]
+    return _intern_op(op_name, kept, table)
+
+# Simplifica a AST: achata AND/OR associativos, remove operandos duplicados, aplica absorção
+# (A OR (A AND B) -> A; A AND (A OR B) -> A) e dupla negação (NOT(NOT(A)) -> A).
+# Percorre a árvore em pós-ordem com pilha explícita; a chave de cada nó é montada uma vez a partir
+# dos ids dos filhos. Se 'table' for informado, subárvores idênticas são compartilhadas (hash-consing).
+def simplify_ast(node, table=None):
+    if table is None:
+        table = {}
+    out = []   # entradas dos filhos já simplificados
+    stack = [(node, None)]
+    while stack:
+        n, args = stack.pop()
+        if n[0] == 'VAR':
+            out.append(_intern(n, (), table))
+            continue
+        if args is None:
+            args = _flat_args(n) if n[1] in ('AND', 'OR') else n[2]
+            stack.append((n, args))
+            stack.extend((c, None) for c in reversed(args))
+            continue
+        children = out[len(out) - len(args):]
+        del out[len(out) - len(args):]
+        out.append(_simplify_op(n[1], children, table))
+    return out[0][0]
+
+# Avalia a AST diretamente para um mapeamento de estado (nome_sanitizado -> bool)
+# Pós-ordem com pilha explícita (sem recursão), como ast_to_python
+def eval_ast(node, state):
+    values = []
+    stack = [(node, False)]
+    while stack:
+        n, visited = stack.pop()
+        if n[0] == 'VAR':
+            name = tag_var_name(n[1])
+            values.append(CONSTANT_VARS[name] if name in CONSTANT_VARS else bool(state[name]))
+            continue
+        op_name = n[1]
+        if op_name in EDGE_OPS:
+            name = tag_var_name(n[2][0][1])
+            now, prev = bool(state[name]), bool(state[edge_prev_name(name)])
+            values.append((now and not prev) if op_name == 'P' else (prev and not now))
+            continue
+        if op_name not in ('NOT', 'AND', 'OR'):
+            raise ValueError(f"Unknown operator: {op_name}")
+        if not visited:
+            stack.append((n, True))
+            stack.extend((c, False) for c in reversed(n[2]))
+            continue
+        args = values[len(values) - len(n[2]):]
+        del values[len(values) - len(n[2]):]
         if op_name == 'NOT':
-            if len(children) != 1:
-                raise ValueError("NOT must have exactly 1 argument")
-            child_py = ast_to_python(children[0])
-            return f"(not {child_py})"
-        elif op_name == 'AND':
-            parts = [ast_to_python(c) for c in children]
-            return "(" + " and ".join(parts) + ")"
-        elif op_name == 'OR':
-            parts = [ast_to_python(c) for c in children]
-            return "(" + " or ".join(parts) + ")"
+            values.append(not args[0])
+        else:
+            values.append(all(args) if op_name == 'AND' else any(args))
+    return values[0]
+
+# Resumo da AST para o log: (número de nós, profundidade), sem percorrer por recursão
+def ast_summary(node):
+    count, depth = 0, 0
+    stack = [(node, 1)]
+    while stack:
+        n, d = stack.pop()
+        count += 1
+        depth = max(depth, d)
+        if n[0] == 'OP':
+            stack.extend((c, d + 1) for c in n[2])
+    return count, depth
+
+# Lista os nomes sanitizados das variáveis de uma AST (ordem de primeira ocorrência)
+def ast_variables(node):
+    out = []
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if n[0] == 'VAR':
+            name = tag_var_name(n[1])
+            if name not in out and name not in CONSTANT_VARS:
+                out.append(name)
+        else:
+            stack.extend(reversed(n[2]))
+    return out
+
+# Lista os bits de memória (x__prev) lidos pelos contatos de borda de uma AST
+def ast_edge_memories(node):
+    out = []
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if n[0] == 'VAR':
+            continue
+        if n[1] in EDGE_OPS:
+            name = edge_prev_name(tag_var_name(n[2][0][1]))
+            if name not in out:
+                out.append(name)
         else:
-            # operador desconhecido - IMNOTSURE sobre operadores extras
+            stack.extend(reversed(n[2]))
+    return out
+
+# Prova equivalência de duas ASTs por tabela-verdade completa
+# Retorna None se houver mais de max_vars variáveis (verificação não realizada)
+def truth_table_equal(a, b, max_vars=VERIFY_MAX_VARS):
+    names = ast_variables(a)
+    for n in ast_variables(b) + ast_edge_memories(a) + ast_edge_memories(b):
+        if n not in names:
+            names.append(n)
+    if len(names) > max_vars:
+        return None
+    for bits in range(1 << len(names)):
+        state = {name: bool((bits >> i) & 1) for i, name in enumerate(names)}
+        if eval_ast(a, state) != eval_ast(b, state):
+            return False
+    return True
+
+# ---- COMPILAÇÃO PARA CODE OBJECTS / CLOSURES ----
+
+# AST (formato do parse_to_ast) de uma expressão Python gerada por ast_to_python: "(I0_0 and (not M1_2))".
+# Contatos de borda já expandidos voltam como AND/NOT sobre o bit de memória x__prev; True/False viram
+# as constantes True_/False_. Pós-ordem com pilha explícita (sem recursão)
+def python_to_ast(py_expr):
+    out = []
+    stack = [(py_ast.parse(py_expr.strip(), mode="eval").body, False)]
+    while stack:
+        n, visited = stack.pop()
+        if isinstance(n, py_ast.Name):
+            out.append(('VAR', n.id))
+            continue
+        if isinstance(n, py_ast.Constant) and isinstance(n.value, bool):
+            out.append(('VAR', "True_" if n.value else "False_"))
+            continue
+        if isinstance(n, py_ast.BoolOp):
+            children = n.values
+        elif isinstance(n, py_ast.UnaryOp) and isinstance(n.op, py_ast.Not):
+            children = [n.operand]
+        else:
+            raise ValueError(f"Unsupported construct in rung expression: {py_ast.dump(n)}")
+        if not visited:
+            stack.append((n, True))
+            stack.extend((c, False) for c in reversed(children))
+            continue
+        args = out[len(out) - len(children):]
+        del out[len(out) - len(children):]
+        if isinstance(n, py_ast.UnaryOp):
+            out.append(('OP', 'NOT', args))
+        else:
+            out.append(('OP', 'AND' if isinstance(n.op, py_ast.And) else 'OR', args))
+    return out[0]
+
+# Entrada de hash-consing de uma AST sem simplificá-la (mesmas chaves de simplify_ast)
+def intern_ast(node, table):
+    out = []
+    stack = [(node, False)]
+    while stack:
+        n, visited = stack.pop()
+        if n[0] == 'VAR':
+            out.append(_intern(n, (), table))
+            continue
+        if not visited:
+            stack.append((n, True))
+            stack.extend((c, False) for c in reversed(n[2]))
+            continue
+        kids = out[len(out) - len(n[2]):]
+        del out[len(out) - len(n[2]):]
+        out.append(_intern(n, kids, table))
+    return out[0]
+
+# TAGs lidas por cada entrada (id -> frozenset de nomes sanitizados), incluindo x__prev das bordas
+def _entry_vars(roots, memo):
+    stack = [(e, False) for e in roots]
+    while stack:
+        e, visited = stack.pop()
+        if e[1] in memo:
+            continue
+        node = e[0]
+        if node[0] == 'VAR':
+            name = tag_var_name(node[1])
+            memo[e[1]] = frozenset() if name in CONSTANT_VARS else frozenset([name])
+        elif node[1] in EDGE_OPS:
+            name = tag_var_name(node[2][0][1])
+            memo[e[1]] = frozenset([name, edge_prev_name(name)])
+        elif not visited:
+            stack.append((e, True))
+            stack.extend((k, False) for k in e[3])
+        else:
+            memo[e[1]] = frozenset().union(*(memo[k[1]] for k in e[3]))
+    return memo
+
+# Quantas vezes cada nó OP é usado no programa; uma subárvore repetida conta uma vez para os seus filhos
+def _entry_counts(roots):
+    counts = {}
+    stack = list(roots)
+    while stack:
+        e = stack.pop()
+        if e[0][0] == 'VAR':
+            continue
+        counts[e[1]] = counts.get(e[1], 0) + 1
+        if counts[e[1]] == 1:
+            stack.extend(e[3])
+    return counts
+
+# Expressão de uma entrada; subárvores usadas mais de uma vez vão para uma temporária (_t<id>) em 'lines'
+def _emit_entry(root, counts, valid, lines, ref, mode):
+    AND, OR, NOT = (" and ", " or ", "not ") if mode == "scalar" else (" & ", " | ", "~")
+    out = []
+    stack = [(root, False)]
+    while stack:
+        e, visited = stack.pop()
+        node = e[0]
+        if node[0] == 'VAR':
+            name = tag_var_name(node[1])
+            out.append(str(CONSTANT_VARS[name]) if name in CONSTANT_VARS and mode == "scalar" else ref.format(name))
+            continue
+        if e[1] in valid:
+            out.append(valid[e[1]])
+            continue
+        op_name = node[1]
+        if op_name in EDGE_OPS:
+            name = tag_var_name(node[2][0][1])
+            now, prev = ref.format(name), ref.format(edge_prev_name(name))
+            expr = f"({now}{AND}({NOT}{prev}))" if op_name == 'P' else f"(({NOT}{now}){AND}{prev})"
+        elif op_name not in ('NOT', 'AND', 'OR'):
             raise ValueError(f"Unknown operator: {op_name}")
-    else:
-        raise ValueError("Invalid AST node: " + str(node))
+        elif not visited:
+            stack.append((e, True))
+            stack.extend((k, False) for k in reversed(e[3]))
+            continue
+        else:
+            parts = out[len(out) - len(e[3]):]
+            del out[len(out) - len(e[3]):]
+            if op_name == 'NOT':
+                expr = f"({NOT}{parts[0]})"
+            else:
+                expr = "(" + (AND if op_name == 'AND' else OR).join(parts) + ")"
+        if counts.get(e[1], 0) > 1:
+            temp = f"_t{e[1]}"
+            lines.append(f"{temp} = {expr}")
+            valid[e[1]] = temp
+            expr = temp
+        out.append(expr)
+    return out[0]
+
+# Gera o código de uma sequência de rungs [(ast, bobinas)] na ordem do scan. As ASTs passam pelo
+# hash-consing ('table'): uma subárvore que aparece mais de uma vez no programa é calculada uma vez em
+# uma temporária e reutilizada enquanto nenhum rung escrever uma TAG que ela lê. 'ref' formata o acesso
+# a uma TAG ("s[{!r}]": mapeamento; "s.{}": atributos; "{}": nome simples). mode "vector" usa & | ~
+# (arrays NumPy; as constantes são lidas de s como True_/False_). Retorna uma lista de linhas por rung
+def program_lines(rungs, ref="s[{!r}]", table=None, mode="scalar", result="c"):
+    if table is None:
+        table = {}
+    roots = [intern_ast(node, table) for node, _coils in rungs]
+    counts = _entry_counts(roots)
+    var_sets = _entry_vars(roots, {})
+    valid = {}
+    out = []
+    for root, (_node, coils) in zip(roots, rungs):
+        lines = []
+        expr = _emit_entry(root, counts, valid, lines, ref, mode)
+        lines.append(f"{result} = bool({expr})" if mode == "scalar" else f"{result} = {expr}")
+        lines += [f"{ref.format(c)} = {result}" for c in coils]
+        if coils:
+            written = set(coils)
+            for i in [i for i in valid if var_sets[i] & written]:
+                del valid[i]
+        out.append(lines)
+    return out
+
+# Executa o código gerado e devolve a função 'name' (um único compile() por programa/condição)
+def _build_function(name, body, returns=None):
+    src = f"def {name}(s):\n" + "".join(f"    {line}\n" for line in body or ["pass"])
+    if returns:
+        src += f"    return {returns}\n"
+    namespace = {"__builtins__": {}, "bool": bool}
+    exec(compile(src, "<ladder>", "exec"), namespace)
+    return namespace[name]
+
+# Closure state -> valor da condição de uma AST (state: mapeamento nome_sanitizado -> bool, ou arrays
+# NumPy com mode="vector")
+def compile_condition(node, table=None, mode="scalar"):
+    body = program_lines([(node, ())], table=table, mode=mode)[0]
+    return _build_function("condition", body, returns="c")
+
+# Closure scan(state) que avalia os rungs [(ast, bobinas)] em ordem, uma vez cada, e grava o resultado
+# em todas as bobinas do próprio mapeamento; subárvores repetidas entre rungs são calculadas uma vez
+def compile_program(rungs, table=None):
+    return _build_function("scan", [line for lines in program_lines(rungs, table=table) for line in lines])
+
+# ---- AUTOTESTE (TABELAS-VERDADE EM ENTRADAS PEQUENAS) ----
+
+# Casos de simplify_ast: (expressão, Python esperado). Cada um é provado equivalente ao original por
+# tabela-verdade completa (bits x__prev incluídos)
+SELFTEST_CASES = [
+    # achatamento
+    ("AND(AND(%I0.0, %I0.1), %I0.2)", "(I0_0 and I0_1 and I0_2)"),
+    ("OR(%I0.0, OR(%I0.1, OR(%I0.2, %I0.3)))", "(I0_0 or I0_1 or I0_2 or I0_3)"),
+    # duplicatas
+    ("OR(%I0.0, %I0.1, %I0.0)", "(I0_0 or I0_1)"),
+    ("AND(%I0.0, NOT(%I0.1), NOT(%I0.1))", "(I0_0 and (not I0_1))"),
+    # absorção
+    ("OR(%I0.0, AND(%I0.0, %I0.1))", "I0_0"),
+    ("AND(%I0.0, OR(%I0.0, %I0.1))", "I0_0"),
+    ("OR(AND(%I0.0, %I0.1), AND(%I0.1, %I0.0, %I0.2))", "(I0_0 and I0_1)"),
+    # dupla negação
+    ("NOT(NOT(%I0.0))", "I0_0"),
+    ("NOT(NOT(NOT(%I0.0)))", "(not I0_0)"),
+    ("AND(NOT(NOT(%I0.0)), OR(%I0.0, %I0.1))", "I0_0"),
+    # contatos de borda P/N
+    ("AND(P(%I0.0), P(%I0.0), %I0.1)", "((I0_0 and (not I0_0__prev)) and I0_1)"),
+    ("OR(N(%I0.0), AND(N(%I0.0), %I0.1))", "((not I0_0) and I0_0__prev)"),
+    ("AND(P(%I0.0), N(%I0.0))", "((I0_0 and (not I0_0__prev)) and ((not I0_0) and I0_0__prev))"),
+    ("OR(P(%I0.0), NOT(NOT(P(%I0.0))))", "(I0_0 and (not I0_0__prev))"),
+]
+
+# Pares que a tabela-verdade deve distinguir (confere o próprio verificador)
+SELFTEST_DIFFERENT = [
+    ("OR(%I0.0, %I0.1)", "AND(%I0.0, %I0.1)"),
+    ("P(%I0.0)", "%I0.0"),
+    ("P(%I0.0)", "N(%I0.0)"),
+]
+
+# Roda os casos com uma tabela de hash-consing por caso e com uma única tabela compartilhada
+# (como no projeto). Retorna a lista de falhas (vazia se tudo passou)
+def run_selftest():
+    failures = []
+    shared = {}
+    for table in (None, shared):
+        for expr, expected in SELFTEST_CASES:
+            ast = parse_to_ast(expr)
+            simplified = simplify_ast(ast, {} if table is None else table)
+            got = ast_to_python(simplified)
+            if truth_table_equal(ast, simplified) is not True:
+                failures.append(f"{expr}: truth table changed ({got})")
+            elif got != expected:
+                failures.append(f"{expr}: {got} != {expected}")
+    for a, b in SELFTEST_DIFFERENT:
+        if truth_table_equal(parse_to_ast(a), parse_to_ast(b)) is not False:
+            failures.append(f"{a} vs {b}: truth table did not tell them apart")
+    return failures
 
 # ---- EXTRAÇÃO DE EXPRESSÃO DE ARQUIVO ----
 
@@ -138,18 +606,29 @@ def extract_expr_from_text_file(path):
 
 # ---- PROCESSAMENTO DE ARQUIVO ----
 
-# Processa um único arquivo, convertendo sua expressão lógica para Python
-def process_file(path, output_dir):
-    dbg("[*] File:", os.path.basename(path))
-    expr = extract_expr_from_text_file(path)
-    if not expr:
-        dbg("[!] expr not found")
-        return
-    dbg("[>] expr:", expr)
+# Simplifica e converte a AST de um arquivo e grava o *_converted.json correspondente
+# 'parse_error' vem do parser (em lote ou individual); nesse caso grava o JSON de erro
+# 'symbols' (tabela do projeto) adiciona os IDs inteiros das TAGs lidas pela expressão
+# Retorna None em caso de sucesso ou a mensagem de erro (também gravada no JSON de saída)
+@profiled
+def write_converted(path, expr, ast, parse_error, output_dir, intern_table=None, symbols=None):
+    out_name = os.path.basename(path).replace('_readable.txt', '_converted.json')
+    out_path = os.path.join(output_dir, out_name)
     try:
-        ast = parse_to_ast(expr)
-        dbg("[>] AST:", ast)
-        py_expr = ast_to_python(ast)
+        if parse_error is not None:
+            raise parse_error
+        if DEBUG:
+            n_nodes, depth = ast_summary(ast)
+            dbg(f"[>] AST: {n_nodes} nodes, depth {depth}")
+        raw_py_expr = ast_to_python(ast)
+        py_expr = raw_py_expr
+        if SIMPLIFY:
+            simplified = simplify_ast(ast, intern_table)
+            if VERIFY_SIMPLIFY and truth_table_equal(ast, simplified) is False:
+                dbg("[WARN] simplification changed the truth table; keeping original AST")
+            else:
+                ast = simplified
+                py_expr = ast_to_python(ast)
         dbg("[=] python:", py_expr)
     except Exception as e:
         dbg("[ERROR] parser:", e)
@@ -158,27 +637,64 @@ def process_file(path, output_dir):
             "original_expression": expr,
             "error": str(e)
         }
-        out_name = os.path.basename(path).replace('_readable.txt', '_converted.json')
-        out_path = os.path.join(output_dir, out_name)
+        get_store().put_expression(network_key(path), out_data)
         with open(out_path, 'w', encoding='utf-8') as fo:
             json.dump(out_data, fo, indent=2, ensure_ascii=False)
         dbg("[->] saved (with error):", out_path)
-        return
+        return str(e)
 
     # Salva JSON com original + convertido
     out_data = {
         "original_expression": expr,
         "python_expression": py_expr
     }
-    out_name = os.path.basename(path).replace('_readable.txt', '_converted.json')
-    out_path = os.path.join(output_dir, out_name)
+    if py_expr != raw_py_expr:
+        out_data["python_expression_unsimplified"] = raw_py_expr
+    if symbols is not None:
+        ids = {symbols.intern(name) for name in ast_variables(ast)}
+        out_data["tag_ids"] = sorted(i for i in ids if i is not None)
+    get_store().put_expression(network_key(path), out_data)
     with open(out_path, 'w', encoding='utf-8') as fo:
         json.dump(out_data, fo, indent=2, ensure_ascii=False)
+    add_file_bytes("write_converted.json", out_path)
     dbg("[->] saved:", out_path)
+    return None
+
+# Processa um único arquivo, convertendo sua expressão lógica para Python
+# 'intern_table' permite compartilhar subárvores entre todos os arquivos do projeto
+def process_file(path, output_dir, intern_table=None, symbols=None):
+    dbg("[*] File:", os.path.basename(path))
+    expr = extract_expr_from_text_file(path)
+    if not expr:
+        dbg("[!] expr not found")
+        return
+    dbg("[>] expr:", expr)
+    ast, err = parse_many([expr])[0]
+    return write_converted(path, expr, ast, err, output_dir, intern_table, symbols)
 
 # ---- MAIN ----
 
 def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Converte as expressões OR/AND/NOT das Networks em expressões Python")
+    ap.add_argument("--verify", action="store_true",
+                    help="Confere cada rung simplificado por tabela-verdade (até VERIFY_MAX_VARS TAGs)")
+    ap.add_argument("--selftest", action="store_true",
+                    help="Roda as tabelas-verdade das regras de simplificação e sai")
+    args = ap.parse_args()
+
+    if args.selftest:
+        failures = run_selftest()
+        for f in failures:
+            print("[FAIL]", f)
+        n_cases = 2 * len(SELFTEST_CASES) + len(SELFTEST_DIFFERENT)
+        print(f"[SELFTEST] {n_cases - len(failures)}/{n_cases} ok")
+        raise SystemExit(1 if failures else 0)
+
+    global VERIFY_SIMPLIFY
+    if args.verify:
+        VERIFY_SIMPLIFY = True
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     dbg("Input directory:", INPUT_DIR)
     dbg("Output directory:", OUTPUT_DIR)
@@ -186,12 +702,48 @@ def main():
     if not files:
         dbg("[!] No '*_readable.txt' files found")
         return
+
+    # Com retomada (PIPELINE_RESUME=1), pula Networks já concluídas no diário
+    journal = get_journal()
+    by_network = {network_key(fn): fn for fn in files}
+    pending = journal.pending(by_network, JOURNAL_STAGE)
+    if len(pending) < len(by_network):
+        dbg("[RESUME]", len(by_network) - len(pending), "file(s) already converted")
+    files = [by_network[n] for n in pending]
+
+    # Lê todas as expressões e faz o parsing em lote
+    entries = []
     for fn in files:
         path = os.path.join(INPUT_DIR, fn)
         try:
-            process_file(path, OUTPUT_DIR)
+            expr = extract_expr_from_text_file(path)
         except Exception as e:
             dbg("[ERROR] processing file", fn, ":", e)
+            journal.record_failure(network_key(fn), JOURNAL_STAGE, f"{type(e).__name__}: {e}")
+            continue
+        if not expr:
+            dbg("[*] File:", fn)
+            dbg("[!] expr not found")
+            journal.record_failure(network_key(fn), JOURNAL_STAGE, "expr not found")
+            continue
+        entries.append((path, expr))
+    parsed = parse_many([expr for _, expr in entries])
+
+    intern_table = {} if HASH_CONS_PROJECT else None
+    symbols = load_symbol_table(SYMBOLS_PATH)
+    for (path, expr), (ast, err) in zip(entries, parsed):
+        dbg("[*] File:", os.path.basename(path))
+        dbg("[>] expr:", expr)
+        try:
+            with journal.step(network_key(path), JOURNAL_STAGE) as outcome:
+                outcome.error = write_converted(path, expr, ast, err, output_dir=OUTPUT_DIR,
+                                                intern_table=intern_table, symbols=symbols)
+        except Exception as e:
+            dbg("[ERROR] processing file", os.path.basename(path), ":", e)
+    if intern_table is not None:
+        dbg("Unique subtrees in project:", len(intern_table))
+    symbols.save(SYMBOLS_PATH)
+    dbg("Symbol table:", len(symbols), "addresses ->", SYMBOLS_PATH)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
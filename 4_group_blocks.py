@@ -3,10 +3,15 @@
 # Remove blocos vazios após algumas iterações. OR agrupa pilhas no mesmo ramal (largura similar,
 # sobreposição X, mesma vertical). AND pareia blocos próximos com âncora por vertical comum.
 
-import os, json, glob, math
+import os, json, glob, math, argparse, tempfile, time
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Any, Tuple, Optional
 
+from pipeline_profiling import profiled, add_bytes
+from pipeline_journal import get_journal
+from artifact_store import get_store, GROUPS_AND, GROUPS_FINAL
+
 # ---- DIRETORIOS ----
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DEBUG_DIR = os.path.join(BASE_DIR, "99_debug")
@@ -16,6 +21,7 @@ FINAL_DIR = os.path.join(DEBUG_DIR, "17_final")
 # ---- PARAMETROS ----
 AND_GROUPS_SUFFIX_JSON = "__14_groups_AND.json"
 VERTICALS_SUFFIX_JSON = "__04_vert_lenFiltered.json"
+JOURNAL_STAGE = "4_group_blocks"
 
 MAX_ALTERNATING_ITERS = 20    # Máximo de iterações OR/AND
 REMOVE_EMPTY_AFTER_K = 2      # Remove blocos vazios após K operações
@@ -56,15 +62,34 @@ def load_json(path):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
+# Permissão de um arquivo novo criado com open(..., "w") (0666 menos a umask do processo)
+def default_file_mode() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+# Escreve texto de forma atômica (arquivo temporário no mesmo diretório + os.replace)
+# mkstemp cria o temporário com 0600; a permissão é ajustada antes do replace
+def atomic_write_text(path, text: str):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp_", suffix=".part")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.chmod(tmp_path, default_file_mode())
+        os.replace(tmp_path, path)
+        add_bytes("atomic_write_text", len(text.encode("utf-8")))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
 # Salva objeto em arquivo JSON
 def save_json(path, obj):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+    atomic_write_text(path, json.dumps(obj, ensure_ascii=False, indent=2))
 
 # Salva lista de strings em arquivo TXT
 def save_txt(path, lines: List[str]):
-    with open(path, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
+    atomic_write_text(path, "\n".join(lines))
 
 # Retorna largura de um retângulo [x1,y1,x2,y2]
 def rect_width(r):
@@ -164,8 +189,11 @@ def compute_branch_signature(b, bins=PROFILE_BINS):
 
 # ---- FUNÇÕES DE VERTICAIS ----
 
-# Carrega verticais de um arquivo JSON para uma imagem-base
+# Carrega verticais de uma imagem-base (banco de artefatos; JSON se a Network não estiver no banco)
 def load_verticals_for_base(base: str) -> List[Dict[str, int]]:
+    verticals = get_store().verticals(base)
+    if verticals is not None:
+        return verticals
     data = load_json(os.path.join(DEBUG_DIR, f"{base}{VERTICALS_SUFFIX_JSON}"))
     if not data or "verticals" not in data:
         return []
@@ -237,8 +265,31 @@ def or_group_rect_adjusted(g: List[Dict[str, Any]]) -> Tuple[List[int], List[int
     y2 = y1 + h_top - 1
     return union_rect_full, [x1, y1, x2, y2]
 
+# Chave de um bloco para o cache de pares OR (o teste depende apenas do retângulo e do toque direito)
+def or_pair_key(b):
+    return (tuple(b["rect"]), bool(b.get("touches_right_bus", False)))
+
+# Consulta o cache de pares OR antes de avaliar can_or_together; atualiza contadores
+def can_or_together_cached(A, B, verticals, pair_cache=None, stats=None):
+    if pair_cache is None:
+        if stats is not None:
+            stats["or_pair_checks"] += 1
+        return can_or_together(A, B, verticals)
+    key = (or_pair_key(A), or_pair_key(B))
+    ok = pair_cache.get(key)
+    if ok is None:
+        ok = can_or_together(A, B, verticals)
+        pair_cache[key] = ok
+        if stats is not None:
+            stats["or_pair_checks"] += 1
+    elif stats is not None:
+        stats["or_pair_cache_hits"] += 1
+    return ok
+
 # Agrupa blocos por OR usando componentes conectados (BFS)
-def group_by_OR_with_intersections(blocks, verticals):
+# Com pair_cache, só pares envolvendo blocos novos (ex.: criados pelo último AND) são reavaliados
+@profiled
+def group_by_OR_with_intersections(blocks, verticals, pair_cache=None, stats=None):
     n = len(blocks)
     used = [False] * n
     groups = []
@@ -253,7 +304,7 @@ def group_by_OR_with_intersections(blocks, verticals):
             for v in range(n):
                 if used[v]:
                     continue
-                if can_or_together(blocks[u], blocks[v], verticals):
+                if can_or_together_cached(blocks[u], blocks[v], verticals, pair_cache, stats):
                     used[v] = True
                     group_idx.append(v)
                     q.append(v)
@@ -333,7 +384,8 @@ def vertical_gap_along_common(A, B, verticals) -> Optional[int]:
     return min(gaps) if gaps else None
 
 # Pareia blocos por AND (proximidade + vertical comum com gap curto)
-def pair_blocks_AND(blocks, verticals):
+@profiled
+def pair_blocks_AND(blocks, verticals, stats=None):
     if not blocks:
         return [], []
     ord_list = []
@@ -357,6 +409,8 @@ def pair_blocks_AND(blocks, verticals):
                 continue
             bj = ord_list[j][3]
             rj = bj["rect"]
+            if stats is not None:
+                stats["and_pair_checks"] += 1
             ov_ratio = v_overlap_ratio(ri, rj)
             if (not has_expr(bi) or not has_expr(bj)) and ov_ratio < MIN_V_OVERLAP_RATIO_FOR_EMPTY:
                 continue
@@ -478,107 +532,215 @@ def write_iter_outputs(base, iter_idx, phase, subpass, blocks, debug_info):
         lines.append(f"  #{i:03d} rect=[{x1},{y1},{x2},{y2}] width={w} touchR={bool(b.get('touches_right_bus', False))} cy={get_cy(b):.1f} expr: {(b.get('expression','') or '(vazio)')}")
     save_txt(txt_path, lines)
 
-# Variável global para armazenar verticais (usada em logging/AND)
-verticals_global: List[Dict[str, int]] = []
-
-# ---- MAIN ----
-
-def main():
-    ensure_logs_dir()
-    ensure_final_dir()
-    files = sorted(glob.glob(os.path.join(DEBUG_DIR, f"*{AND_GROUPS_SUFFIX_JSON}")))
-    if not files:
-        print(f"[ERRO] Nenhum arquivo {AND_GROUPS_SUFFIX_JSON} em {DEBUG_DIR}")
-        return
-
-    global verticals_global
-    for f in files:
-        base = os.path.basename(f)[:-len(AND_GROUPS_SUFFIX_JSON)]
-        data = load_json(f)
-        if not data or "groups" not in data:
-            print(f"[AVISO] Estrutura inesperada em {f}")
-            continue
-
-        verticals_global = load_verticals_for_base(base)
-        raw_blocks = data["groups"]
-        blocks = []
-        for b in raw_blocks:
-            blocks.append({
-                "rect": b.get("rect", [0, 0, 0, 0]),
-                "tags": b.get("tags", []),
-                "expression": (b.get("expression") or "").strip(),
-                "touches_right_bus": bool(b.get("touches_right_bus", False)),
-                "cy": get_cy(b)
-            })
-
-        iter_idx = 0
-        op_count = 0
-        changed = True
-
-        while changed and iter_idx < MAX_ALTERNATING_ITERS:
-            changed = False
-            iter_idx += 1
-
-            # 1) OR (pilhas) — repetir até estabilizar
-            subpass = 0
-            while True:
-                subpass += 1
-                op_count += 1
-                new_blocks, debug_or = group_by_OR_with_intersections(blocks, verticals_global)
-                write_iter_outputs(base, iter_idx, "OR", subpass, new_blocks, debug_or)
-
-                # Limpeza de vazios após algumas operações
-                if op_count >= REMOVE_EMPTY_AFTER_K:
-                    before = len(new_blocks)
-                    new_blocks = [b for b in new_blocks if has_expr(b)]
-                    if len(new_blocks) != before:
-                        pass
-
-                if len(new_blocks) < len(blocks):
-                    blocks = new_blocks
-                    changed = True
-                    if len(blocks) <= 1:
-                        break
-                    continue
-                else:
-                    blocks = new_blocks
-                    break
+# ---- AGRUPAMENTO POR NETWORK ----
+
+# Converte os grupos AND do estágio 3 em blocos de trabalho
+def blocks_from_groups(raw_blocks) -> List[Dict[str, Any]]:
+    blocks = []
+    for b in raw_blocks:
+        blocks.append({
+            "rect": b.get("rect", [0, 0, 0, 0]),
+            "tags": b.get("tags", []),
+            "expression": (b.get("expression") or "").strip(),
+            "touches_right_bus": bool(b.get("touches_right_bus", False)),
+            "cy": get_cy(b)
+        })
+    return blocks
 
-            if len(blocks) <= 1:
-                break
+# Cria os contadores de desempenho do agrupamento de uma Network
+def new_grouping_stats() -> Dict[str, Any]:
+    return {
+        "rounds": 0,              # Rodadas OR/AND executadas
+        "rounds_skipped": 0,      # Rodadas com entrada já vista (resultado reaproveitado)
+        "or_pair_checks": 0,      # Pares OR avaliados
+        "or_pair_cache_hits": 0,  # Pares OR resolvidos pelo cache
+        "and_pair_checks": 0,     # Pares AND avaliados
+        "t_or_s": 0.0,            # Tempo gasto em OR (s)
+        "t_and_s": 0.0,           # Tempo gasto em AND (s)
+    }
 
-            # 2) AND — tentar pareamento
-            subpass_and = 1
+# Assinatura do conjunto de entrada de uma rodada (tudo o que OR/AND leem de cada bloco)
+def blocks_signature(blocks) -> Tuple:
+    return tuple(
+        (tuple(b["rect"]), (b.get("expression") or "").strip(), build_block_expr(b),
+         bool(b.get("touches_right_bus", False)), get_cy(b))
+        for b in blocks
+    )
+
+# Executa uma rodada OR, reaproveitando o resultado se a mesma entrada já foi agrupada
+def run_or_round(blocks, verticals, memo, pair_cache, stats):
+    stats["rounds"] += 1
+    key = ("OR", blocks_signature(blocks))
+    if key in memo:
+        stats["rounds_skipped"] += 1
+        return memo[key]
+    t0 = time.perf_counter()
+    result = group_by_OR_with_intersections(blocks, verticals, pair_cache, stats)
+    stats["t_or_s"] += time.perf_counter() - t0
+    memo[key] = result
+    return result
+
+# Executa uma rodada AND, reaproveitando o resultado se a mesma entrada já foi pareada
+# Blocos avulsos são guardados por índice para devolver os próprios objetos de entrada
+def run_and_round(blocks, verticals, memo, stats):
+    stats["rounds"] += 1
+    key = ("AND", blocks_signature(blocks))
+    if key in memo:
+        stats["rounds_skipped"] += 1
+        template, debug_and = memo[key]
+        if template is None:
+            return None, debug_and
+        return [blocks[t] if isinstance(t, int) else t for t in template], debug_and
+    t0 = time.perf_counter()
+    new_blocks, debug_and = pair_blocks_AND(blocks, verticals, stats)
+    stats["t_and_s"] += time.perf_counter() - t0
+    if new_blocks is None:
+        memo[key] = (None, debug_and)
+    else:
+        pos = {id(b): i for i, b in enumerate(blocks)}
+        memo[key] = ([pos.get(id(nb), nb) for nb in new_blocks], debug_and)
+    return new_blocks, debug_and
+
+# Executa o laço alternado OR/AND de uma Network; as verticais são passadas explicitamente
+# Retorna (blocos finais, contadores de desempenho)
+@profiled
+def group_network(base: str, blocks: List[Dict[str, Any]], verticals: List[Dict[str, int]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    stats = new_grouping_stats()
+    round_memo: Dict[Tuple, Any] = {}
+    or_pair_cache: Dict[Tuple, bool] = {}
+    iter_idx = 0
+    op_count = 0
+    changed = True
+
+    while changed and iter_idx < MAX_ALTERNATING_ITERS:
+        changed = False
+        iter_idx += 1
+
+        # 1) OR (pilhas) — repetir até estabilizar
+        subpass = 0
+        while True:
+            subpass += 1
             op_count += 1
-            new_blocks, debug_and = pair_blocks_AND(blocks, verticals_global)
+            new_blocks, debug_or = run_or_round(blocks, verticals, round_memo, or_pair_cache, stats)
+            write_iter_outputs(base, iter_idx, "OR", subpass, new_blocks, debug_or)
 
             # Limpeza de vazios após algumas operações
-            if op_count >= REMOVE_EMPTY_AFTER_K and new_blocks:
+            if op_count >= REMOVE_EMPTY_AFTER_K:
                 before = len(new_blocks)
                 new_blocks = [b for b in new_blocks if has_expr(b)]
+                if len(new_blocks) != before:
+                    pass
 
-            if new_blocks is not None and len(new_blocks) < len(blocks):
+            if len(new_blocks) < len(blocks):
                 blocks = new_blocks
-                write_iter_outputs(base, iter_idx, "AND", subpass_and, blocks, debug_and)
                 changed = True
+                if len(blocks) <= 1:
+                    break
+                continue
             else:
-                write_iter_outputs(base, iter_idx, "AND", subpass_and, blocks, debug_and)
-
-            if len(blocks) <= 1:
+                blocks = new_blocks
                 break
 
-        # Resultado final (sem colapso artificial)
-        ensure_final_dir()
-        final_json = os.path.join(FINAL_DIR, f"{base}__17_final.json")
-        final_txt = os.path.join(FINAL_DIR, f"{base}__17_final_readable.txt")
-        save_json(final_json, {"image_base": base, "final_blocks": blocks})
-        lines = [f"Imagem base: {base}", f"Blocos finais: {len(blocks)}", ""]
-        for i, b in enumerate(blocks, start=1):
-            x1, y1, x2, y2 = b["rect"]
-            w = x2 - x1 + 1
-            lines.append(f"  #{i:03d} rect=[{x1},{y1},{x2},{y2}] width={w} touchR={bool(b.get('touches_right_bus', False))} cy={get_cy(b):.1f} expr: {(b.get('expression','') or '(vazio)')}")
-        save_txt(final_txt, lines)
+        if len(blocks) <= 1:
+            break
+
+        # 2) AND — tentar pareamento
+        subpass_and = 1
+        op_count += 1
+        new_blocks, debug_and = run_and_round(blocks, verticals, round_memo, stats)
+
+        # Limpeza de vazios após algumas operações
+        if op_count >= REMOVE_EMPTY_AFTER_K and new_blocks:
+            before = len(new_blocks)
+            new_blocks = [b for b in new_blocks if has_expr(b)]
+
+        if new_blocks is not None and len(new_blocks) < len(blocks):
+            blocks = new_blocks
+            write_iter_outputs(base, iter_idx, "AND", subpass_and, blocks, debug_and)
+            changed = True
+        else:
+            write_iter_outputs(base, iter_idx, "AND", subpass_and, blocks, debug_and)
+
+        if len(blocks) <= 1:
+            break
+
+    return blocks, stats
+
+# Formata os contadores de desempenho para o log
+def format_grouping_stats(stats: Dict[str, Any]) -> str:
+    return (f"rounds={stats['rounds']} (skipped={stats['rounds_skipped']}) "
+            f"or_pairs={stats['or_pair_checks']} (cache={stats['or_pair_cache_hits']}) "
+            f"and_pairs={stats['and_pair_checks']} "
+            f"t_or={stats['t_or_s'] * 1000:.1f}ms t_and={stats['t_and_s'] * 1000:.1f}ms")
+
+# Salva o resultado final (JSON + TXT) de uma Network
+def write_final_outputs(base: str, blocks: List[Dict[str, Any]]):
+    ensure_final_dir()
+    final_json = os.path.join(FINAL_DIR, f"{base}__17_final.json")
+    final_txt = os.path.join(FINAL_DIR, f"{base}__17_final_readable.txt")
+    get_store().put_groups(base, GROUPS_FINAL, blocks)
+    save_json(final_json, {"image_base": base, "final_blocks": blocks})
+    lines = [f"Imagem base: {base}", f"Blocos finais: {len(blocks)}", ""]
+    for i, b in enumerate(blocks, start=1):
+        x1, y1, x2, y2 = b["rect"]
+        w = x2 - x1 + 1
+        lines.append(f"  #{i:03d} rect=[{x1},{y1},{x2},{y2}] width={w} touchR={bool(b.get('touches_right_bus', False))} cy={get_cy(b):.1f} expr: {(b.get('expression','') or '(vazio)')}")
+    save_txt(final_txt, lines)
+
+# Processa um arquivo __14_groups_AND.json de forma isolada (unidade de trabalho do pool)
+# Retorna (base, número de blocos finais, contadores) ou (base, None, None) se o arquivo for inválido
+# O andamento é registrado no diário do pipeline (cada processo do pool usa sua própria conexão)
+def process_groups_file(path: str) -> Tuple[str, Optional[int], Optional[Dict[str, Any]]]:
+    base = os.path.basename(path)[:-len(AND_GROUPS_SUFFIX_JSON)]
+    with get_journal().step(base, JOURNAL_STAGE) as outcome:
+        groups = get_store().groups(base, GROUPS_AND)
+        data = {"groups": groups} if groups is not None else load_json(path)
+        if not data or "groups" not in data:
+            print(f"[AVISO] Estrutura inesperada em {path}")
+            outcome.error = "estrutura inesperada"
+            return base, None, None
+
+        verticals = load_verticals_for_base(base)
+        blocks, stats = group_network(base, blocks_from_groups(data["groups"]), verticals)
+        write_final_outputs(base, blocks)
+    return base, len(blocks), stats
+
+# Imprime o resultado de uma Network assim que ela termina
+def report_result(base: str, n_blocks: Optional[int], stats: Optional[Dict[str, Any]]):
+    if n_blocks is not None:
         print(f"[DONE] {base}: Final salvo em {FINAL_DIR} (sem colapso artificial).")
+        print(f"[STATS] {base}: {format_grouping_stats(stats)}")
+
+# ---- MAIN ----
+
+def main():
+    ap = argparse.ArgumentParser(description="Agrupa blocos alternando OR/AND por Network")
+    ap.add_argument("--workers", "-w", type=int, default=1,
+                    help="Número de processos em paralelo (1 = execução serial)")
+    args = ap.parse_args()
+
+    ensure_logs_dir()
+    ensure_final_dir()
+    files = sorted(glob.glob(os.path.join(DEBUG_DIR, f"*{AND_GROUPS_SUFFIX_JSON}")))
+    if not files:
+        print(f"[ERRO] Nenhum arquivo {AND_GROUPS_SUFFIX_JSON} em {DEBUG_DIR}")
+        return
+
+    # Com retomada (PIPELINE_RESUME=1), pula Networks já concluídas no diário
+    by_base = {os.path.basename(f)[:-len(AND_GROUPS_SUFFIX_JSON)]: f for f in files}
+    pending = get_journal().pending(by_base, JOURNAL_STAGE)
+    if len(pending) < len(by_base):
+        print(f"[RESUME] {len(by_base) - len(pending)} Network(s) já agrupada(s)")
+    files = [by_base[b] for b in pending]
+
+    if args.workers <= 1:
+        for f in files:
+            report_result(*process_groups_file(f))
+    else:
+        # Cada Network roda isolada em um processo; resultados retornam na ordem dos arquivos
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            for result in ex.map(process_groups_file, files):
+                report_result(*result)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
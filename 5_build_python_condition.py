@@ -4,9 +4,13 @@
 # Lê *_converted.json em CONVERTED_DIR e procura *__tags_info.json em TAGS_OUT_DIR.
 # Gera arquivos .py em FINAL_DIR.
 
-import os, json, re, argparse
+import os, json, re, argparse, hashlib, importlib.util, py_compile, tempfile, time
 from pathlib import Path
 from typing import List, Optional
+from plc_symbols import load_symbol_table, edge_base_name, tag_var_name, PY_NAME_RE, SYMBOLS_PATH
+from pipeline_profiling import profiled, add_file_bytes
+from pipeline_journal import get_journal, network_key
+from plc_xref import load_stage
 
 # ---- DIRETORIOS ----
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -16,10 +20,15 @@ FINAL_DIR     = os.path.join(BASE_DIR, "04_final")
 
 # ---- PARAMETROS ----
 CONVERTED_SUFFIX = "_converted.json"
+JOURNAL_STAGE = "5_build_python_condition"
 TAGS_INFO_SUFFIX = "__tags_info.json"
+PROJECT_MODULE_NAME = "plc_program.py"   # Módulo único do projeto (--project)
 
 DEBUG = True
 
+# Parser/compilador de condições (4.5): AST das expressões e código dos rungs com subárvores compartilhadas
+logic = load_stage("4.5_adapt_logical_expression.py")
+
 # Imprime mensagens de debug apenas se DEBUG=True
 def dbg(*args):
     if DEBUG:
@@ -27,24 +36,14 @@ def dbg(*args):
 
 # ---- UTILITÁRIOS DE NOME DE TAG ----
 
-def clean_tag_name(raw: str) -> str:
-    s = str(raw).strip()
-    if s.startswith('%'):
-        s = s[1:]
-    s = s.replace('.', '_')
-    s = re.sub(r'[^0-9A-Za-z_]', '_', s)
-    if re.match(r'^\d', s):
-        s = 'v_' + s
-    return s
-
 def extract_tags_from_expr(expr: str) -> List[str]:
     tags = set()
     if not expr:
         return []
     for t in re.findall(r'%[A-Za-z]\d+(?:\.\d+)?', expr):
-        tags.add(clean_tag_name(t))
+        tags.add(tag_var_name(t))
     for t in re.findall(r'\b[IQM]\d+_\d+\b', expr, flags=re.I):
-        tags.add(clean_tag_name(t))
+        tags.add(tag_var_name(t))
     return sorted(tags)
 
 def common_prefix_len(a: str, b: str) -> int:
@@ -54,10 +53,35 @@ def common_prefix_len(a: str, b: str) -> int:
         i += 1
     return i
 
-def find_tags_info(tags_dir: Path, converted_stem: str) -> Optional[Path]:
-    candidates = list(tags_dir.glob(f"*{TAGS_INFO_SUFFIX}"))
+# Reduz o nome de um artefato ao nome-base da Network
+# ('<base>__17_final_converted' e '<base>__tags_info' -> '<base>')
+def network_base_name(stem: str) -> str:
+    for suffix in ("_converted", "__17_final", "_tags_info"):
+        if stem.endswith(suffix):
+            stem = stem[:-len(suffix)]
+    return stem.rstrip("_")
+
+# Constrói, uma vez por execução, o índice de *__tags_info.json do diretório:
+# lista de candidatos (ordenada) e mapa nome-base da Network -> arquivo
+def build_tags_info_index(tags_dir: Path) -> dict:
+    candidates = sorted(tags_dir.glob(f"*{TAGS_INFO_SUFFIX}"))
+    by_base = {}
+    for c in candidates:
+        by_base.setdefault(network_base_name(c.stem), c)
+    return {"candidates": candidates, "by_base": by_base}
+
+# Localiza o *__tags_info.json de um *_converted.json.
+# Com índice: busca direta pelo nome-base; sem correspondência exata, usa o mesmo fallback
+# (substring, maior prefixo comum >= 8, candidato único) sobre a lista já carregada.
+def find_tags_info(tags_dir: Path, converted_stem: str, index: Optional[dict] = None) -> Optional[Path]:
+    if index is None:
+        index = build_tags_info_index(tags_dir)
+    candidates = index["candidates"]
     if not candidates:
         return None
+    direct = index["by_base"].get(network_base_name(converted_stem))
+    if direct is not None:
+        return direct
     for c in candidates:
         name_no_ext = c.stem
         if name_no_ext in converted_stem or converted_stem in name_no_ext:
@@ -76,7 +100,16 @@ def find_tags_info(tags_dir: Path, converted_stem: str) -> Optional[Path]:
         return candidates[0]
     return None
 
+# Cache de bobinas por arquivo (cada *__tags_info.json é lido uma única vez por execução)
+_COILS_CACHE = {}
+
 def load_coils_from_tags_info(json_path: Path) -> List[str]:
+    key = str(json_path)
+    if key not in _COILS_CACHE:
+        _COILS_CACHE[key] = _read_coils_from_tags_info(json_path)
+    return list(_COILS_CACHE[key])
+
+def _read_coils_from_tags_info(json_path: Path) -> List[str]:
     try:
         raw = json_path.read_text(encoding='utf-8')
         data = json.loads(raw)
@@ -100,7 +133,7 @@ def load_coils_from_tags_info(json_path: Path) -> List[str]:
                     coils_raw.append(text)
     else:
         dbg("[WARN] Unexpected format in tags_info JSON (expected list of objects)")
-    coils = [clean_tag_name(x) for x in coils_raw if isinstance(x, str)]
+    coils = [tag_var_name(x) for x in coils_raw if isinstance(x, str)]
     coils = [c for c in coils if re.match(r'^[IQM]\d+_\d+$', c, flags=re.I)]
     return sorted(set(coils))
 
@@ -112,16 +145,16 @@ def build_module_code(base_stem: str,
                       input_tags: List[str],
                       coils: List[str]) -> str:
     header = f"# {original_expr}\n"
-    # Indenta a expressão lógica para usar no if
+    # Indenta a expressão lógica para usar no corpo de main()
     indented_expr = "\n    ".join(python_expr.strip().splitlines())
     coils_code = ""
     if coils:
-        coils_code = ""
-        for coil in coils:
-            coils_code += f"    if {indented_expr}:\n"
-            coils_code += f"        {coil} = True\n"
-            coils_code += f"    else:\n"
-            coils_code += f"        {coil} = False\n\n"
+        # Avalia a condição uma única vez por scan e atribui o resultado a todas as bobinas
+        # (código do compilador de rungs do 4.5: subárvores repetidas calculadas uma vez)
+        rung = [(logic.python_to_ast(python_expr), coils)]
+        for line in logic.program_lines(rung, ref="{}", result="rung_condition")[0]:
+            coils_code += f"    {line}\n"
+        coils_code += "\n"
     else:
         # Se não houver bobinas, só coloca a expressão
         coils_code = f"    # Expressão lógica:\n    {indented_expr}\n"
@@ -133,25 +166,27 @@ def main():
 """
     return module
 
-def process_converted_file(path: Path, tags_dir: Path, out_dir: Path):
+# Gera o módulo Python de uma Network; retorna None em caso de sucesso ou a mensagem de erro
+@profiled
+def process_converted_file(path: Path, tags_dir: Path, out_dir: Path, index: Optional[dict] = None):
     dbg("[*]", path.name)
     try:
         raw = path.read_text(encoding='utf-8')
         data = json.loads(raw)
     except Exception as e:
         dbg("[ERROR] reading converted.json:", path.name, e)
-        return
+        return f"reading converted.json: {e}"
 
     original_expr = data.get("original_expression") or data.get("expression") or ""
     python_expr = data.get("python_expression")
     if not python_expr:
         dbg("[WARN] no python_expression in", path.name)
-        return
+        return data.get("error") or "no python_expression"
 
     input_tags = extract_tags_from_expr(original_expr)
     base_stem = path.stem.replace("_converted", "")
 
-    tags_info_path = find_tags_info(tags_dir, path.stem)
+    tags_info_path = find_tags_info(tags_dir, path.stem, index)
     if tags_info_path:
         coils = load_coils_from_tags_info(tags_info_path)
         dbg("  tags_info:", tags_info_path.name, "-> coils:", coils)
@@ -164,9 +199,176 @@ def process_converted_file(path: Path, tags_dir: Path, out_dir: Path):
     out_disp = out_dir / f"{base_stem}_final_condition_display.txt"
     out_py.write_text(code, encoding='utf-8')
     out_disp.write_text(python_expr + "\n", encoding='utf-8')
+    add_file_bytes("process_converted_file.py", out_py)
+    add_file_bytes("process_converted_file.py", out_disp)
 
     dbg("[OK]", path.name, "->", out_py.name)
     dbg("  tags:", input_tags)
+    return None
+
+# ---- CARGA DO PROJETO (TODOS OS RUNGS EM ORDEM) ----
+
+# Lê todos os *_converted.json (ordem dos nomes de arquivo = ordem dos rungs) e associa as bobinas
+# de cada Network. Retorna lista de dicts: name, original_expression, python_expression, coils
+def load_project_rungs(converted_dir: Path, tags_dir: Path) -> List[dict]:
+    rungs = []
+    index = build_tags_info_index(tags_dir)
+    for path in sorted(converted_dir.glob(f"*{CONVERTED_SUFFIX}")):
+        try:
+            data = json.loads(path.read_text(encoding='utf-8'))
+        except Exception as e:
+            dbg("[ERROR] reading converted.json:", path.name, e)
+            continue
+        python_expr = data.get("python_expression")
+        if not python_expr:
+            dbg("[WARN] no python_expression in", path.name)
+            continue
+        tags_info_path = find_tags_info(tags_dir, path.stem, index)
+        coils = load_coils_from_tags_info(tags_info_path) if tags_info_path else []
+        rungs.append({
+            "name": path.stem.replace("_converted", ""),
+            "original_expression": data.get("original_expression") or data.get("expression") or "",
+            "python_expression": python_expr,
+            "coils": coils,
+        })
+    return rungs
+
+# ---- MÓDULO ÚNICO DO PROJETO ----
+
+# Hash das entradas do gerador (usado para não regenerar o módulo se nada mudou)
+# Inclui a tabela de símbolos: SYMBOL_IDS muda quando a tabela muda, mesmo com os mesmos rungs
+def rungs_source_hash(rungs: List[dict], symbols=None) -> str:
+    payload = json.dumps({
+        "rungs": [[r["name"], r["python_expression"], r["coils"]] for r in rungs],
+        "symbols": symbols.to_json()["symbols"] if symbols is not None else None,
+    }, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+# Gera o código de um único módulo com todos os rungs em ordem:
+# TagState (__slots__, um atributo por TAG) + scan(s) que executa o programa uma vez
+# SYMBOL_IDS acompanha TAGS com o ID de cada TAG na tabela de símbolos (-1 se não registrada)
+def build_project_module_code(rungs: List[dict], symbols=None) -> str:
+    tags = []
+    for r in rungs:
+        for name in extract_tags_from_expr(r["python_expression"]) + r["coils"]:
+            if name not in tags:
+                tags.append(name)
+    # Inclui nomes que não seguem o padrão I/Q/M (ex.: DB) lidos diretamente da expressão
+    for r in rungs:
+        for name in PY_NAME_RE.findall(r["python_expression"]):
+            if name not in tags:
+                tags.append(name)
+
+    lines = [
+        "# plc_program.py",
+        "# Gerado por 5_build_python_condition.py (--project). Não editar manualmente.",
+        f"# {len(rungs)} rungs, {len(tags)} TAGs",
+        "",
+        f"SOURCE_HASH = {rungs_source_hash(rungs, symbols)!r}",
+        "TAGS = (",
+        *[f"    {t!r}," for t in tags],
+        ")",
+        "SYMBOL_IDS = (",
+        *[f"    {-1 if symbols is None or symbols.id_of(t) is None else symbols.id_of(t)}," for t in tags],
+        ")",
+        "RUNGS = (",
+        *[f"    {r['name']!r}," for r in rungs],
+        ")",
+        "",
+        "class TagState:",
+        "    __slots__ = TAGS",
+        "",
+        "    def __init__(self):",
+    ]
+    if tags:
+        lines += [f"        self.{t} = False" for t in tags]
+    else:
+        lines.append("        pass")
+    lines += [
+        "",
+        "# Executa um ciclo de scan completo (rungs na ordem do projeto)",
+        "def scan(s):",
+    ]
+    if not rungs:
+        lines.append("    pass")
+    # Corpo do scan pelo compilador de rungs do 4.5: subárvores repetidas entre rungs são calculadas
+    # uma vez (temporárias _t<id>) enquanto nenhuma TAG lida por elas for escrita
+    rung_lines = logic.program_lines([(logic.python_to_ast(r["python_expression"]), r["coils"]) for r in rungs],
+                                     ref="s.{}")
+    for r, body in zip(rungs, rung_lines):
+        lines.append(f"    # {r['name']}")
+        if r.get("original_expression"):
+            lines.append(f"    # {r['original_expression']}")
+        lines += [f"    {line}" for line in body]
+    edges = [(t, edge_base_name(t)) for t in tags if edge_base_name(t) in tags]
+    if edges:
+        lines.append("    # Bits de memória de borda (contatos P/N): valor da TAG ao fim deste scan")
+        lines += [f"    s.{name} = s.{base}" for name, base in edges]
+    lines.append("")
+    return "\n".join(lines)
+
+# Escreve o módulo único do projeto e o compila para bytecode (__pycache__)
+# Se o módulo existente já corresponde aos mesmos rungs e à mesma tabela de símbolos, não regenera.
+@profiled
+def write_project_module(rungs: List[dict], out_dir: Path, force: bool = False) -> Path:
+    out_py = out_dir / PROJECT_MODULE_NAME
+    symbols = load_symbol_table(SYMBOLS_PATH)
+    source_hash = rungs_source_hash(rungs, symbols)
+    if not force and out_py.exists():
+        head = out_py.read_text(encoding='utf-8').split("\n", 6)[:6]
+        if f"SOURCE_HASH = {source_hash!r}" in head:
+            dbg("[OK] project module up to date:", out_py.name)
+            return out_py
+    out_py.write_text(build_project_module_code(rungs, symbols), encoding='utf-8')
+    py_compile.compile(str(out_py), cfile=importlib.util.cache_from_source(str(out_py)), doraise=True)
+    dbg("[OK] project module:", out_py.name, f"({len(rungs)} rungs)")
+    return out_py
+
+# Importa um arquivo .py como módulo isolado
+def import_module_from_path(path: Path, name: str):
+    spec = importlib.util.spec_from_file_location(name, str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Compara geração + carga do layout por arquivo (um .py por Network) com o módulo único do projeto
+def benchmark_layouts(converted_dir: Path, tags_dir: Path, n_scans: int = 1000) -> dict:
+    global DEBUG
+    debug_prev, DEBUG = DEBUG, False
+    files = sorted(converted_dir.glob(f"*{CONVERTED_SUFFIX}"))
+    result = {"rungs": len(files)}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            per_file_dir = Path(tmp) / "per_file"
+            project_dir = Path(tmp) / "project"
+            per_file_dir.mkdir()
+            project_dir.mkdir()
+
+            t0 = time.perf_counter()
+            index = build_tags_info_index(tags_dir)
+            for f in files:
+                process_converted_file(f, tags_dir, per_file_dir, index)
+            result["per_file_generate_s"] = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            for i, py in enumerate(sorted(per_file_dir.glob("*_final_if_coils.py"))):
+                import_module_from_path(py, f"_bench_rung_{i}")
+            result["per_file_import_s"] = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            rungs = load_project_rungs(converted_dir, tags_dir)
+            out_py = write_project_module(rungs, project_dir, force=True)
+            result["project_generate_s"] = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            program = import_module_from_path(out_py, "_bench_plc_program")
+            result["project_import_s"] = time.perf_counter() - t0
+            state = program.TagState()
+            t0 = time.perf_counter()
+            for _ in range(n_scans):
+                program.scan(state)
+            result["project_scan_us"] = (time.perf_counter() - t0) / max(1, n_scans) * 1e6
+    finally:
+        DEBUG = debug_prev
+    return result
 
 # ---- MAIN ----
 
@@ -178,6 +380,9 @@ def main():
     ap.add_argument("--out_dir", "-o", help="Output directory (Python modules)", default=FINAL_DIR)
     ap.add_argument("--file", "-f", help="Process only a specific _converted.json file")
     ap.add_argument("--no-debug", action="store_true", help="Disable debug output")
+    ap.add_argument("--project", action="store_true", help=f"Generate a single {PROJECT_MODULE_NAME} with all rungs (TagState + scan())")
+    ap.add_argument("--force", action="store_true", help="Regenerate the project module even if it is up to date")
+    ap.add_argument("--bench", action="store_true", help="Benchmark per-file layout vs. single project module")
     args = ap.parse_args()
 
     global DEBUG
@@ -189,6 +394,21 @@ def main():
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
+    if args.bench:
+        r = benchmark_layouts(converted_dir, tags_dir)
+        print(f"Rungs: {r['rungs']}")
+        print(f"Per-file: generate {r['per_file_generate_s']:.3f}s | import {r['per_file_import_s']:.3f}s")
+        print(f"Project:  generate {r['project_generate_s']:.3f}s | import {r['project_import_s']:.3f}s | scan {r['project_scan_us']:.1f}us")
+        return
+
+    if args.project:
+        rungs = load_project_rungs(converted_dir, tags_dir)
+        if not rungs:
+            print("No *_converted.json files found in", converted_dir)
+            return
+        write_project_module(rungs, out_dir, force=args.force)
+        return
+
     if args.file:
         p = Path(args.file)
         if not p.exists():
@@ -201,9 +421,19 @@ def main():
         print("No *_converted.json files found in", converted_dir)
         return
 
-    for f in files:
+    # Com retomada (PIPELINE_RESUME=1), pula Networks já concluídas no diário
+    journal = get_journal()
+    by_network = {network_key(f): f for f in files}
+    pending = journal.pending(by_network, JOURNAL_STAGE)
+    if len(pending) < len(by_network):
+        dbg("[RESUME]", len(by_network) - len(pending), "file(s) already generated")
+
+    index = build_tags_info_index(tags_dir)
+    for network in pending:
+        f = by_network[network]
         try:
-            process_converted_file(f, tags_dir, out_dir)
+            with journal.step(network, JOURNAL_STAGE) as outcome:
+                outcome.error = process_converted_file(f, tags_dir, out_dir, index)
         except Exception as e:
             dbg("[ERROR] processing", f.name, ":", e)
 
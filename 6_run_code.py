@@ -7,6 +7,9 @@ import subprocess
 from datetime import datetime
 from pathlib import Path
 
+import pipeline_journal
+import pipeline_profiling
+
 # Ordem dos scripts conforme seu pipeline
 SCRIPTS_IN_ORDER = [
     "1_detect_tags.py",
@@ -54,15 +57,38 @@ def run_step(script: str, env: dict) -> tuple[int, float, str]:
         print(f"[EXCEÇÃO] {script} em {elapsed:.2f}s -> {e}")
         return -1, elapsed, err
 
-def build_env(overwrite: bool, nf_threshold: float | None) -> dict:
+def build_env(overwrite: bool, nf_threshold: float | None, profile: bool = False, profile_trace: bool = False,
+              resume: bool = False) -> dict:
     """Constrói o ambiente de execução para os scripts."""
     env = os.environ.copy()
+    if resume:
+        env[pipeline_journal.ENV_RESUME] = "1"
     if overwrite:
         env["PIPELINE_OVERWRITE"] = "1"
     if nf_threshold is not None:
         env["NF_THRESHOLD"] = str(nf_threshold)
+    if profile or profile_trace:
+        env[pipeline_profiling.ENV_PROFILE] = "1"
+    if profile_trace:
+        env[pipeline_profiling.ENV_TRACE] = "1"
     return env
 
+def print_profile_report(top: int = 20):
+    """Imprime as funções mais custosas de todas as etapas (relatórios de 99_debug/19_profile)."""
+    reports = pipeline_profiling.load_reports()
+    if not reports:
+        print("Nenhum relatório de profiling encontrado.")
+        return
+    combined = {}
+    for script, functions in reports.items():
+        for name, m in functions.items():
+            combined[f"{script}:{name}"] = m
+    print(f"\n=== Hot path (top {top} por tempo acumulado) ===")
+    print(pipeline_profiling.format_report(combined, top=top))
+    trace_path = pipeline_profiling.merge_traces()
+    if trace_path:
+        print(f"Trace (chrome://tracing): {trace_path}")
+
 def parse_args():
     """Processa os argumentos da linha de comando."""
     parser = argparse.ArgumentParser(
@@ -71,11 +97,26 @@ def parse_args():
     parser.add_argument("--skip", nargs="*", default=[], help="Lista de scripts a pular (nomes exatos).")
     parser.add_argument("--overwrite", action="store_true", help="Se presente, sinaliza para sobrescrever saídas.")
     parser.add_argument("--nf-threshold", type=float, default=None, help="Limiar para detecção de NF.")
+    parser.add_argument("--resume", action="store_true", help="Retoma a execução anterior: refaz só as Networks pendentes ou com falha.")
+    parser.add_argument("--stats", action="store_true", help="Mostra o estado do diário e as estatísticas de falhas, sem executar.")
+    parser.add_argument("--profile", action="store_true", help="Mede as funções principais de cada etapa e imprime o hot path.")
+    parser.add_argument("--profile-trace", action="store_true", help="Como --profile, e grava também um trace do Chrome.")
     return parser.parse_args()
 
 def main():
     args = parse_args()
-    env = build_env(overwrite=args.overwrite, nf_threshold=args.nf_threshold)
+    if args.stats:
+        journal = pipeline_journal.get_journal()
+        print(pipeline_journal.format_journal_report(journal))
+        for network, stage, error, attempts in journal.failed_steps():
+            print(f"  [falha] {network} @ {stage} (tentativas={attempts}): {error}")
+        return
+
+    profile = args.profile or args.profile_trace
+    env = build_env(overwrite=args.overwrite, nf_threshold=args.nf_threshold,
+                    profile=args.profile, profile_trace=args.profile_trace, resume=args.resume)
+    if profile:
+        pipeline_profiling.clear_reports()
 
     print("=== Execução do Pipeline ===")
     print("Scripts na ordem:")
@@ -83,6 +124,8 @@ def main():
         print(f" - {s}")
     if args.skip:
         print("Pulando etapas:", ", ".join(args.skip))
+    if args.resume:
+        print("Retomando: Networks já concluídas em cada etapa serão puladas")
 
     results = []
     total_start = time.time()
@@ -111,5 +154,12 @@ def main():
             print(f"  erro: {err}")
     print(f"Tempo total: {total_elapsed:.2f}s")
 
+    failed = pipeline_journal.get_journal().failed_steps()
+    if failed:
+        print(f"Networks com falha: {len(failed)} (detalhes: --stats; refazer: --resume)")
+
+    if profile:
+        print_profile_report()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,306 @@
+# 7_simulate_scan.py
+# Simula o ciclo de scan do CLP sobre as condições convertidas (*_converted.json) de todo o projeto.
+# Lê um trace de E/S gravado (CSV, uma linha por scan), avalia todos os rungs em ordem e grava as bobinas.
+# Os estados das TAGs são arrays booleanos NumPy: cada rung é avaliado para todos os scans de uma vez.
+# Modo --incremental: orientado a eventos, reavalia só os rungs cujas entradas mudaram.
+# Bits de memória de borda (<TAG>__prev, contatos P/N) valem o valor da TAG ao fim do scan anterior.
+
+import os, csv, heapq, argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+
+from plc_xref import CrossReference, load_stage
+from plc_symbols import edge_base_name, tag_var_name
+
+# ---- DIRETORIOS ----
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONVERTED_DIR = os.path.join(BASE_DIR, "03_tags", "13_pseudo_final")
+TAGS_OUT_DIR  = os.path.join(BASE_DIR, "03_tags")
+SIM_DIR       = os.path.join(BASE_DIR, "04_final", "simulation")
+
+# Compilador de condições (4.5): AST das expressões e closures sobre um mapeamento de estado
+logic = load_stage("4.5_adapt_logical_expression.py")
+
+# ---- MOTOR DE SCAN ----
+
+class ScanEngine:
+    """
+    Carrega todos os rungs do projeto em um único motor de scan.
+    rungs: lista de dicts com 'name', 'python_expression' e 'coils' (ordem = ordem de execução).
+    Semântica por scan: os rungs rodam em ordem; um rung que lê uma bobina escrita por um rung
+    anterior vê o valor do scan atual, e uma bobina escrita apenas depois (ou pelo próprio rung)
+    vê o valor do scan anterior. O bit de memória de borda <TAG>__prev vê o valor da TAG ao fim do
+    scan anterior (False antes do primeiro scan; bobinas: valor inicial).
+    """
+
+    def __init__(self, rungs: List[dict]):
+        self.rungs = []
+        for r in rungs:
+            node = logic.python_to_ast(r["python_expression"])
+            self.rungs.append({
+                "name": r["name"],
+                "python_expression": r["python_expression"],
+                "coils": list(r.get("coils") or []),
+                "ast": node,
+                "inputs": logic.ast_variables(node),
+                # Operações NumPy elemento a elemento (& | ~): o rung é avaliado para todos os scans de uma vez
+                "vec_condition": logic.compile_condition(node, mode="vector"),
+            })
+        # Caminho scan a scan: um único scan(state) para o programa, com subárvores compartilhadas entre rungs
+        self.scan = logic.compile_program([(r["ast"], r["coils"]) for r in self.rungs])
+        self.coils = []
+        for r in self.rungs:
+            for c in r["coils"]:
+                if c not in self.coils:
+                    self.coils.append(c)
+        read = {n for r in self.rungs for n in r["inputs"]}
+        self.edges = {n: edge_base_name(n) for n in sorted(read) if edge_base_name(n) is not None}
+        # Uma borda de entrada lida só como <TAG>__prev ainda precisa da coluna da própria TAG
+        self.inputs = sorted((read | set(self.edges.values())) - set(self.coils) - set(self.edges))
+        self.feedback = self._find_backward_reads()
+
+    # Lista leituras de bobinas escritas só no mesmo rung ou em rungs posteriores (realimentação entre scans)
+    def _find_backward_reads(self):
+        first_writer = {}
+        for idx, r in enumerate(self.rungs):
+            for c in r["coils"]:
+                first_writer.setdefault(c, idx)
+        out = []
+        for idx, r in enumerate(self.rungs):
+            for n in r["inputs"]:
+                if n in first_writer and first_writer[n] >= idx:
+                    out.append((r["name"], n))
+                elif edge_base_name(n) in first_writer:
+                    out.append((r["name"], n))   # borda de bobina: valor final do scan anterior
+        return out
+
+    # Executa n_scans ciclos. 'inputs' mapeia nome sanitizado -> array bool (n_scans,);
+    # TAGs ausentes valem False. 'initial' define o valor das bobinas antes do primeiro scan.
+    # Retorna dict nome -> array bool (n_scans,) com o valor de cada bobina ao fim de cada scan.
+    def run(self, inputs: Dict[str, np.ndarray], n_scans: int, initial: Optional[Dict[str, bool]] = None):
+        initial = initial or {}
+        if self.feedback:
+            return self._run_sequential(inputs, n_scans, initial)
+
+        false_arr = np.zeros(n_scans, dtype=bool)
+        env = {"True_": np.True_, "False_": np.False_}
+        for n in self.inputs:
+            env[n] = np.asarray(inputs.get(n, false_arr), dtype=bool)
+        # Borda de entrada: a mesma coluna deslocada de um scan
+        for n, base in self.edges.items():
+            col = np.asarray(inputs.get(base, false_arr), dtype=bool)
+            env[n] = np.concatenate([[False], col[:-1]]) if n_scans else false_arr
+        for c in self.coils:
+            env[c] = np.full(n_scans, bool(initial.get(c, False)))
+
+        # Sem realimentação: cada rung vê apenas entradas e bobinas já escritas no mesmo scan,
+        # então é avaliado para todos os scans em um único passo vetorizado
+        for r in self.rungs:
+            value = np.asarray(r["vec_condition"](env), dtype=bool)
+            if value.shape != (n_scans,):
+                value = np.broadcast_to(value, (n_scans,)).copy()
+            for c in r["coils"]:
+                env[c] = value
+        return {c: env[c] for c in self.coils}
+
+    # Caminho com realimentação entre scans: avalia scan a scan (valores escalares)
+    def _run_sequential(self, inputs: Dict[str, np.ndarray], n_scans: int, initial: Dict[str, bool]):
+        columns = {n: np.asarray(inputs[n], dtype=bool) for n in self.inputs if n in inputs}
+        state = {n: False for n in self.inputs}
+        state.update({"True_": True, "False_": False})
+        for c in self.coils:
+            state[c] = bool(initial.get(c, False))
+        out = {c: np.zeros(n_scans, dtype=bool) for c in self.coils}
+        for n, base in self.edges.items():
+            state[n] = bool(initial.get(base, False))
+        for t in range(n_scans):
+            for n, base in self.edges.items():
+                state[n] = state.get(base, False)
+            for n, col in columns.items():
+                state[n] = bool(col[t])
+            self.scan(state)
+            for c in self.coils:
+                out[c][t] = state[c]
+        return out
+
+# ---- AVALIAÇÃO INCREMENTAL (ORIENTADA A EVENTOS) ----
+
+class IncrementalEvaluator:
+    """
+    Cada rung é inscrito nas TAGs que lê (referência cruzada). A cada atualização, só os rungs
+    cujas entradas mudaram são reavaliados, e só saídas que mudaram de valor se propagam para os
+    rungs que as leem. O custo por atualização depende das TAGs alteradas, não do tamanho do programa.
+    Mesma semântica do ScanEngine: uma leitura de bobina vê o último rung anterior que a escreve
+    no scan atual; sem escritor anterior, vê o valor final do scan anterior (self.state).
+    """
+
+    def __init__(self, rungs: List[dict], initial: Optional[Dict[str, bool]] = None):
+        self.xref = CrossReference(rungs)
+        n_rungs = len(rungs)
+        self.conditions = [logic.compile_condition(logic.python_to_ast(r["python_expression"])) for r in rungs]
+        self.coils = list(self.xref.writers.keys())
+        self.values = [False] * n_rungs          # última saída calculada de cada rung
+        self.state: Dict[str, bool] = {"True_": True, "False_": False}
+        for names in self.xref.rung_inputs:
+            for n in names:
+                self.state.setdefault(n, False)
+        for c in self.coils:
+            self.state[c] = bool((initial or {}).get(c, False))
+
+        # Para cada leitura: (nome, rung escritor cuja saída é vista) ou (nome, None) -> self.state
+        self.bindings: List[List[tuple]] = []
+        self.subscribers: List[List[int]] = [[] for _ in range(n_rungs)]   # escritor -> leitores no mesmo scan
+        self.next_scan_readers: Dict[str, List[int]] = {}                   # bobina -> leitores do valor final
+        for idx, names in enumerate(self.xref.rung_inputs):
+            binding = []
+            for n in names:
+                earlier = [w for w in self.xref.writers.get(n, []) if w < idx]
+                if earlier:
+                    binding.append((n, earlier[-1]))
+                    self.subscribers[earlier[-1]].append(idx)
+                else:
+                    binding.append((n, None))
+                    if n in self.xref.writers:
+                        self.next_scan_readers.setdefault(n, []).append(idx)
+            self.bindings.append(binding)
+        # Bobina -> rungs que definem seu valor final (último escritor)
+        self.final_coils: List[List[str]] = [[] for _ in range(n_rungs)]
+        for c, writer_idx in self.xref.writers.items():
+            self.final_coils[writer_idx[-1]].append(c)
+
+        # Na primeira atualização todos os rungs são avaliados (equivale ao primeiro scan completo)
+        # e todo resultado é propagado: self.values ainda não reflete as bobinas de 'initial'
+        self.pending = set(range(n_rungs))
+        self.full_pass = True
+        self.evaluations = 0
+
+    def _evaluate(self, idx: int) -> bool:
+        env = {"True_": True, "False_": False}
+        for n, w in self.bindings[idx]:
+            env[n] = self.state[n] if w is None else self.values[w]
+        return self.conditions[idx](env)
+
+    # Aplica as TAGs alteradas (nome sanitizado -> bool) e propaga; retorna as bobinas que mudaram
+    def update(self, changes: Dict[str, bool]) -> Dict[str, bool]:
+        heap = list(self.pending)
+        queued = set(self.pending)
+        self.pending = set()
+        full_pass, self.full_pass = self.full_pass, False
+        for name, value in changes.items():
+            value = bool(value)
+            if self.state.get(name) == value:
+                continue
+            self.state[name] = value
+            for r in self.xref.readers.get(name, []):
+                if r not in queued:
+                    queued.add(r)
+                    heap.append(r)
+        heapq.heapify(heap)
+
+        changed_coils: Dict[str, bool] = {}
+        while heap:
+            idx = heapq.heappop(heap)
+            self.evaluations += 1
+            value = self._evaluate(idx)
+            if value == self.values[idx] and not full_pass:
+                continue
+            self.values[idx] = value
+            for r in self.subscribers[idx]:
+                if r not in queued:
+                    queued.add(r)
+                    heapq.heappush(heap, r)
+            for c in self.final_coils[idx]:
+                if self.state[c] != value:
+                    self.state[c] = value
+                    changed_coils[c] = value
+                    self.pending.update(self.next_scan_readers.get(c, []))
+        return changed_coils
+
+# Executa um trace em modo incremental: a cada scan, aplica só as entradas que mudaram
+# Retorna (dict bobina -> array bool (n_scans,), número total de avaliações de rung)
+def run_incremental(rungs: List[dict], inputs: Dict[str, np.ndarray], n_scans: int):
+    evaluator = IncrementalEvaluator(rungs)
+    edges = [(n, edge_base_name(n)) for n in evaluator.xref.readers if edge_base_name(n) is not None]
+    # TAGs lidas só como <TAG>__prev também são aplicadas: o bit de borda vem de evaluator.state[TAG]
+    bases = {base for _, base in edges}
+    names = [n for n in inputs if n in evaluator.xref.readers or n in bases]
+    out = {c: np.zeros(n_scans, dtype=bool) for c in evaluator.coils}
+    previous = {}
+    for t in range(n_scans):
+        # Bits de memória de borda recebem o valor da TAG ao fim do scan anterior
+        changes = {n: evaluator.state.get(base, False) for n, base in edges}
+        for n in names:
+            v = bool(inputs[n][t])
+            if previous.get(n) != v:
+                changes[n] = v
+                previous[n] = v
+        evaluator.update(changes)
+        for c in evaluator.coils:
+            out[c][t] = evaluator.state[c]
+    return out, evaluator.evaluations
+
+# ---- TRACE DE E/S (CSV) ----
+
+# Lê um trace CSV (cabeçalho com TAGs como %I0.0 ou I0_0; valores 0/1/true/false)
+# Retorna (dict nome_sanitizado -> array bool, número de scans)
+def load_trace_csv(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    names = [tag_var_name(h) for h in header]
+    data = np.zeros((len(rows), len(names)), dtype=bool)
+    for i, row in enumerate(rows):
+        for j, v in enumerate(row[:len(names)]):
+            data[i, j] = v.strip().lower() in ("1", "true", "t", "on", "yes")
+    return {n: data[:, j] for j, n in enumerate(names)}, len(rows)
+
+# Grava o resultado da simulação em CSV (uma linha por scan, uma coluna por bobina)
+def save_trace_csv(path, outputs: Dict[str, np.ndarray], n_scans: int):
+    names = list(outputs.keys())
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["scan"] + names)
+        for t in range(n_scans):
+            writer.writerow([t] + [int(outputs[n][t]) for n in names])
+
+# ---- MAIN ----
+
+def main():
+    ap = argparse.ArgumentParser(description="Simula o scan do CLP sobre as condições convertidas do projeto")
+    ap.add_argument("--trace", required=True, help="CSV com o trace de entradas (uma linha por scan)")
+    ap.add_argument("--converted_dir", "-c", default=CONVERTED_DIR, help="Diretório dos *_converted.json")
+    ap.add_argument("--tags_dir", "-t", default=TAGS_OUT_DIR, help="Diretório dos *__tags_info.json")
+    ap.add_argument("--out", "-o", default=None, help="CSV de saída (padrão: 04_final/simulation/<trace>_out.csv)")
+    ap.add_argument("--incremental", action="store_true", help="Avaliação orientada a eventos (só rungs com entradas alteradas)")
+    args = ap.parse_args()
+
+    stage5 = load_stage("5_build_python_condition.py")
+    stage5.DEBUG = False
+    rungs = stage5.load_project_rungs(Path(args.converted_dir), Path(args.tags_dir))
+    if not rungs:
+        print(f"[ERRO] Nenhum rung encontrado em {args.converted_dir}")
+        return
+
+    engine = ScanEngine(rungs)
+    inputs, n_scans = load_trace_csv(args.trace)
+    print(f"[INFO] Rungs: {len(engine.rungs)} | Entradas: {len(engine.inputs)} | Bobinas: {len(engine.coils)} | Scans: {n_scans}")
+    if args.incremental:
+        outputs, evaluations = run_incremental(rungs, inputs, n_scans)
+        full = len(engine.rungs) * n_scans
+        print(f"[INFO] Avaliações de rung: {evaluations} (scan completo: {full})")
+    else:
+        if engine.feedback:
+            print(f"[INFO] Realimentação entre scans em {len(engine.feedback)} leitura(s); usando avaliação scan a scan")
+        outputs = engine.run(inputs, n_scans)
+
+    out_path = args.out
+    if out_path is None:
+        os.makedirs(SIM_DIR, exist_ok=True)
+        out_path = os.path.join(SIM_DIR, f"{Path(args.trace).stem}_out.csv")
+    save_trace_csv(out_path, outputs, n_scans)
+    print(f"[OK] Saída salva em: {out_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+# artifact_store.py
+# Armazena os artefatos por Network do projeto em um único banco SQLite (99_debug/pipeline_artifacts.sqlite):
+# palavras e segmentos de linha do PDF, TAGs (tags_info / tags_with_nf), verticais, retângulos,
+# grupos (AND e finais) e expressões.
+# Tabelas com chave primária (network, ...) e WITHOUT ROWID: a leitura de uma Network é uma busca
+# indexada, sem varrer diretórios com glob. Os JSON por Network continuam sendo gravados pelas
+# etapas (depuração) e podem ser regenerados do banco com --export.
+
+import os, json, time, sqlite3, argparse
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# ---- DIRETORIOS ----
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEBUG_DIR = os.path.join(BASE_DIR, "99_debug")
+STORE_PATH = os.path.join(DEBUG_DIR, "pipeline_artifacts.sqlite")
+
+# ---- PARAMETROS ----
+BUSY_TIMEOUT_MS = 30000
+TAGS_TEXT = "text"    # *_text_layer.json (0_pdf_extractor, camada de texto do PDF)
+TAGS_INFO = "info"    # *_tags_info.json (1_detect_tags)
+TAGS_NF = "nf"        # *_tags_with_nf.json (1.5_detect_NF)
+GROUPS_AND = "and"    # *__14_groups_AND.json (3_associate_tags_with_blocks)
+GROUPS_FINAL = "final"  # *__17_final.json (4_group_blocks)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tags (
+    network TEXT NOT NULL, kind TEXT NOT NULL, idx INTEGER NOT NULL,
+    text TEXT, x INTEGER, y INTEGER, w INTEGER, h INTEGER, is_coil INTEGER,
+    payload TEXT,
+    PRIMARY KEY (network, kind, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS segments (
+    network TEXT NOT NULL, orientation TEXT NOT NULL, idx INTEGER NOT NULL, pos INTEGER, a INTEGER, b INTEGER,
+    PRIMARY KEY (network, orientation, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS verticals (
+    network TEXT NOT NULL, id INTEGER NOT NULL, x INTEGER, y1 INTEGER, y2 INTEGER,
+    PRIMARY KEY (network, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rects (
+    network TEXT NOT NULL, idx INTEGER NOT NULL, x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
+    PRIMARY KEY (network, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS groups (
+    network TEXT NOT NULL, kind TEXT NOT NULL, idx INTEGER NOT NULL,
+    x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER, expression TEXT, payload TEXT,
+    PRIMARY KEY (network, kind, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS expressions (
+    network TEXT NOT NULL PRIMARY KEY,
+    original_expression TEXT, python_expression TEXT, error TEXT, payload TEXT, updated_at REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS written (
+    network TEXT NOT NULL, what TEXT NOT NULL,
+    PRIMARY KEY (network, what)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_tags_coil ON tags (network, kind, is_coil);
+"""
+
+class ArtifactStore:
+    """
+    Leitura/gravação dos artefatos de cada Network (chave = nome-base da imagem recortada).
+    Gravar substitui todos os registros da Network naquela tabela/tipo. Cada processo abre sua
+    própria conexão (use get_store()); WAL permite leitores concorrentes com um gravador por vez.
+    """
+
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    # ---- TAGs ----
+
+    def put_tags(self, network: str, kind: str, tags: List[dict]):
+        rows = [(network, kind, idx, t.get("text"), t.get("x"), t.get("y"), t.get("w"), t.get("h"),
+                 int(bool(t.get("is_coil", False))),
+                 json.dumps(t, ensure_ascii=False, separators=(",", ":")))
+                for idx, t in enumerate(tags)]
+        with self._transaction():
+            self.conn.execute("DELETE FROM tags WHERE network = ? AND kind = ?", (network, kind))
+            self.conn.executemany("INSERT INTO tags VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._mark(network, f"tags:{kind}")
+
+    # Lista de TAGs no mesmo formato dos JSON; None se nunca gravadas para a Network
+    def tags(self, network: str, kind: str) -> Optional[List[dict]]:
+        if not self._has(network, f"tags:{kind}"):
+            return None
+        rows = self.conn.execute("SELECT payload FROM tags WHERE network = ? AND kind = ? ORDER BY idx",
+                                 (network, kind))
+        return [json.loads(p) for (p,) in rows]
+
+    # Menor x entre as bobinas (mesmo critério de load_coil_x_from_json); None se não houver
+    def coil_x(self, network: str, kind: str = TAGS_NF) -> Optional[int]:
+        row = self.conn.execute("SELECT MIN(x) FROM tags WHERE network = ? AND kind = ? AND is_coil = 1",
+                                (network, kind)).fetchone()
+        return row[0] if row else None
+
+    # ---- SEGMENTOS VETORIAIS (0_pdf_extractor) ----
+
+    # Segmentos em pixels do recorte: horizontais [x1, y, x2] e verticais [x, y1, y2]
+    def put_segments(self, network: str, segments: Dict[str, List[list]]):
+        rows = []
+        for orientation, key in (("h", "horizontal"), ("v", "vertical")):
+            for idx, seg in enumerate(segments.get(key, [])):
+                if orientation == "h":
+                    x1, y, x2 = seg
+                    rows.append((network, orientation, idx, int(y), int(x1), int(x2)))
+                else:
+                    x, y1, y2 = seg
+                    rows.append((network, orientation, idx, int(x), int(y1), int(y2)))
+        with self._transaction():
+            self.conn.execute("DELETE FROM segments WHERE network = ?", (network,))
+            self.conn.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._mark(network, "segments")
+
+    # Segmentos da Network no mesmo formato do *_vector.json; None se nunca gravados
+    def segments(self, network: str) -> Optional[Dict[str, List[list]]]:
+        if not self._has(network, "segments"):
+            return None
+        out = {"horizontal": [], "vertical": []}
+        for orientation, pos, a, b in self.conn.execute(
+                "SELECT orientation, pos, a, b FROM segments WHERE network = ? ORDER BY orientation, idx", (network,)):
+            if orientation == "h":
+                out["horizontal"].append([a, pos, b])
+            else:
+                out["vertical"].append([pos, a, b])
+        return out
+
+    # ---- VERTICAIS / RETÂNGULOS ----
+
+    def put_verticals(self, network: str, verticals: List[dict]):
+        rows = [(network, int(v["id"]), int(v["x"]), int(v["y1"]), int(v["y2"])) for v in verticals]
+        with self._transaction():
+            self.conn.execute("DELETE FROM verticals WHERE network = ?", (network,))
+            self.conn.executemany("INSERT INTO verticals VALUES (?, ?, ?, ?, ?)", rows)
+            self._mark(network, "verticals")
+
+    # Verticais da Network; None se nunca gravadas (lista vazia é um resultado válido)
+    def verticals(self, network: str) -> Optional[List[dict]]:
+        if not self._has(network, "verticals"):
+            return None
+        rows = self.conn.execute("SELECT id, x, y1, y2 FROM verticals WHERE network = ? ORDER BY id", (network,))
+        return [{"id": i, "x": x, "y1": y1, "y2": y2} for i, x, y1, y2 in rows]
+
+    def put_rects(self, network: str, rects: List[list]):
+        rows = [(network, idx, int(r[0]), int(r[1]), int(r[2]), int(r[3])) for idx, r in enumerate(rects)]
+        with self._transaction():
+            self.conn.execute("DELETE FROM rects WHERE network = ?", (network,))
+            self.conn.executemany("INSERT INTO rects VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._mark(network, "rects")
+
+    # Retângulos [x1, y1, x2, y2] da Network; None se nunca gravados
+    def rects(self, network: str) -> Optional[List[list]]:
+        if not self._has(network, "rects"):
+            return None
+        rows = self.conn.execute("SELECT x1, y1, x2, y2 FROM rects WHERE network = ? ORDER BY idx", (network,))
+        return [list(r) for r in rows]
+
+    # ---- GRUPOS / BLOCOS ----
+
+    def put_groups(self, network: str, kind: str, groups: List[dict]):
+        rows = []
+        for idx, g in enumerate(groups):
+            x1, y1, x2, y2 = g.get("rect") or (None, None, None, None)
+            rows.append((network, kind, idx, x1, y1, x2, y2, g.get("expression"),
+                         json.dumps(g, ensure_ascii=False, separators=(",", ":"))))
+        with self._transaction():
+            self.conn.execute("DELETE FROM groups WHERE network = ? AND kind = ?", (network, kind))
+            self.conn.executemany("INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._mark(network, f"groups:{kind}")
+
+    # Grupos (ou blocos finais) da Network na ordem gravada; None se nunca gravados
+    def groups(self, network: str, kind: str) -> Optional[List[dict]]:
+        if not self._has(network, f"groups:{kind}"):
+            return None
+        rows = self.conn.execute("SELECT payload FROM groups WHERE network = ? AND kind = ? ORDER BY idx",
+                                 (network, kind))
+        return [json.loads(p) for (p,) in rows]
+
+    # ---- EXPRESSÕES ----
+
+    # Grava o conteúdo do *__17_final_converted.json (original, python, erro, tag_ids...)
+    def put_expression(self, network: str, data: dict):
+        with self._transaction():
+            self.conn.execute(
+                "INSERT OR REPLACE INTO expressions VALUES (?, ?, ?, ?, ?, ?)",
+                (network, data.get("original_expression"), data.get("python_expression"), data.get("error"),
+                 json.dumps(data, ensure_ascii=False, separators=(",", ":")), time.time()))
+
+    def expression(self, network: str) -> Optional[dict]:
+        row = self.conn.execute("SELECT payload FROM expressions WHERE network = ?", (network,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # ---- CONTROLE ----
+
+    # Marcador de "gravado" (uma Network sem linhas, ex.: imagem sem verticais, também é um resultado);
+    # chamado dentro da transação do put_*
+    def _mark(self, network: str, what: str):
+        self.conn.execute("INSERT OR IGNORE INTO written VALUES (?, ?)", (network, what))
+
+    def _has(self, network: str, what: str) -> bool:
+        row = self.conn.execute("SELECT 1 FROM written WHERE network = ? AND what = ?", (network, what)).fetchone()
+        return row is not None
+
+    # Networks presentes em uma tabela
+    def networks(self, table: str = "tags") -> List[str]:
+        return [r[0] for r in self.conn.execute(f"SELECT DISTINCT network FROM {table} ORDER BY network")]
+
+    # Número de linhas por tabela
+    def counts(self) -> Dict[str, int]:
+        return {t: self.conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                for t in ("tags", "segments", "verticals", "rects", "groups", "expressions")}
+
+_STORES: Dict[int, ArtifactStore] = {}
+
+# Conexão do processo atual (processos de pools abrem a sua própria). STORE_PATH é lido a cada
+# chamada para que ferramentas (ex.: bench_pipeline) possam redirecionar o banco
+def get_store(path: Optional[str] = None) -> ArtifactStore:
+    path = path or STORE_PATH
+    store = _STORES.get(os.getpid())
+    if store is None or store.path != path:
+        store = ArtifactStore(path)
+        _STORES[os.getpid()] = store
+    return store
+
+# ---- EXPORTAÇÃO JSON ----
+
+# Regenera os JSON de depuração de uma Network a partir do banco (mesmos nomes das etapas)
+def export_network_json(store: ArtifactStore, network: str, out_dir: str) -> List[str]:
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+
+    def dump(name, obj):
+        path = os.path.join(out_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+        written.append(path)
+
+    words = store.tags(network, TAGS_TEXT)
+    if words is not None:
+        dump(f"{network}_text_layer.json", {"source": "pdf_text_layer", "words": words})
+    segments = store.segments(network)
+    if segments is not None:
+        dump(f"{network}_vector.json", dict(segments, source="pdf_vector"))
+    tags = store.tags(network, TAGS_INFO)
+    if tags is not None:
+        dump(f"{network}_tags_info.json", tags)
+    tags = store.tags(network, TAGS_NF)
+    if tags is not None:
+        dump(f"{network}_tags_with_nf.json", tags)
+    verticals = store.verticals(network)
+    if verticals is not None:
+        dump(f"{network}__04_vert_lenFiltered.json", {"verticals": verticals})
+    rects = store.rects(network)
+    if rects is not None:
+        dump(f"{network}__13_horiz_rects.json",
+             [{"x1": x1, "y1": y1, "x2": x2, "y2": y2, "width": x2 - x1 + 1, "height": y2 - y1 + 1}
+              for x1, y1, x2, y2 in rects])
+    groups = store.groups(network, GROUPS_AND)
+    if groups is not None:
+        dump(f"{network}__14_groups_AND.json",
+             {"image_base": network, "logic": "AND within same rectangle", "groups": groups})
+    blocks = store.groups(network, GROUPS_FINAL)
+    if blocks is not None:
+        dump(f"{network}__17_final.json", {"image_base": network, "final_blocks": blocks})
+    expr = store.expression(network)
+    if expr is not None:
+        dump(f"{network}__17_final_converted.json", expr)
+    return written
+
+# ---- MAIN ----
+
+def main():
+    ap = argparse.ArgumentParser(description="Consulta/exporta o banco de artefatos do pipeline")
+    ap.add_argument("--db", default=STORE_PATH, help="Arquivo SQLite do banco de artefatos")
+    ap.add_argument("--export", metavar="DIR", help="Regenera os JSON por Network neste diretório")
+    ap.add_argument("--network", "-n", nargs="*", default=None, help="Restringe a estas Networks")
+    args = ap.parse_args()
+
+    store = ArtifactStore(args.db)
+    counts = store.counts()
+    print("[INFO] " + " | ".join(f"{k}: {v}" for k, v in counts.items()))
+    if args.export:
+        networks = args.network or sorted(set(store.networks("tags")) | set(store.networks("rects"))
+                                          | set(store.networks("expressions")))
+        n_files = 0
+        for network in networks:
+            n_files += len(export_network_json(store, network, args.export))
+        print(f"[OK] {n_files} arquivo(s) JSON de {len(networks)} Network(s) -> {args.export}")
+
+if __name__ == "__main__":
+    main()
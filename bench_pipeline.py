@@ -0,0 +1,479 @@
+# bench_pipeline.py
+# Benchmark das etapas do pipeline sobre Networks sintéticas no estilo TIA Portal (geradas com PIL).
+# Cada Network tem contatos em série, um trecho com ramos em paralelo, contatos NF, de borda (P/N) e
+# bobinas, com TAGs e posições conhecidas. Mede tempo, vazão e pico de memória de cada etapa e grava
+# o resultado em 99_debug/18_bench/ (JSON, identificado pela revisão git) para comparar commits.
+
+import os, io, sys, json, time, random, argparse, tempfile, tracemalloc, subprocess
+from contextlib import redirect_stdout
+from datetime import datetime
+from typing import Dict
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+import artifact_store
+from plc_xref import load_stage
+
+# ---- DIRETORIOS ----
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(BASE_DIR, "99_debug", "18_bench")
+
+# ---- PARAMETROS ----
+ROW_SPACING = 90        # Distância vertical entre ramos (px)
+CONTACT_PITCH = 110     # Distância horizontal entre contatos (px)
+CONTACT_GAP = 16        # Abertura entre as barras do contato (px)
+CONTACT_BAR_H = 14      # Altura das barras do contato (px)
+LINE_W = 2              # Espessura das linhas
+LEFT_RAIL_X = 20        # Barramento esquerdo
+COIL_AREA_W = 200       # Largura reservada à bobina na margem direita
+TAG_FONT_SIZE = 14
+NF_RATIO = 0.3          # Fração de contatos NF
+EDGE_RATIO = 0.15       # Fração dos demais contatos desenhados como borda P/N (sorteio próprio)
+EDGE_FONT_SIZE = 11     # Letra P/N dentro do contato
+COARSE_FACTORS = (2, 4)  # Fatores do 2_mark_blocks --coarse comparados com a resolução cheia
+TAG_WIRE_OFFSET = 30    # Mesmo Y_OFFSET do 1.5_detect_NF (texto da TAG acima do fio)
+
+# ---- GERADOR DE NETWORKS SINTÉTICAS ----
+
+def load_tag_font(size=TAG_FONT_SIZE):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+# Gera uma Network sintética: 'size' contatos em série antes e depois de um trecho com 'size' ramos
+# em paralelo, cada um com 'size' contatos, e uma bobina (o mesmo endereço pode ser lido e escrito).
+# Retorna (imagem RGB, verdade) com TAGs (x, y, w, h, is_coil, is_nf, kind) e a expressão esperada.
+# As bordas usam um gerador aleatório separado: as demais escolhas não mudam com EDGE_RATIO.
+def make_ladder_network(size: int, seed: int = 0):
+    rng = random.Random(seed)
+    edge_rng = random.Random(seed + 7919)
+    font = load_tag_font()
+    edge_font = load_tag_font(EDGE_FONT_SIZE)
+    n_series = max(1, size)
+    n_branches = max(2, size)
+    n_parallel = max(1, size)
+
+    n_contacts_main = 2 * n_series + n_parallel
+    W = LEFT_RAIL_X + 40 + n_contacts_main * CONTACT_PITCH + 60 + COIL_AREA_W
+    H = 60 + n_branches * ROW_SPACING + 40
+    img = Image.new("RGB", (W, H), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    black = (0, 0, 0)
+
+    main_y = 60 + TAG_WIRE_OFFSET
+    coil_x = W - COIL_AREA_W + 60
+    draw.line([(LEFT_RAIL_X, 10), (LEFT_RAIL_X, H - 10)], fill=black, width=LINE_W)
+
+    tags = []
+    used = set()
+
+    def new_address():
+        while True:
+            addr = f"%{rng.choice('IM')}{rng.randint(0, 15)}.{rng.randint(0, 7)}"
+            if addr not in used:
+                used.add(addr)
+                return addr
+
+    # Desenha um contato centrado em (cx, y): fio interrompido entre duas barras, diagonal se NF,
+    # letra P/N se borda (com o bit de memória da borda escrito abaixo do contato, como no TIA Portal)
+    def contact(cx, y):
+        is_nf = rng.random() < NF_RATIO
+        edge = edge_rng.choice("PN") if not is_nf and edge_rng.random() < EDGE_RATIO else None
+        half = CONTACT_GAP // 2
+        draw.rectangle([cx - half, y - 3, cx + half, y + 3], fill=(255, 255, 255))
+        for bx in (cx - half, cx + half):
+            draw.line([(bx, y - CONTACT_BAR_H // 2), (bx, y + CONTACT_BAR_H // 2)], fill=black, width=LINE_W)
+        if is_nf:
+            draw.line([(cx - half + 3, y + CONTACT_BAR_H // 2 - 1), (cx + half - 3, y - CONTACT_BAR_H // 2 + 1)],
+                      fill=black, width=LINE_W)
+        if edge:
+            l, t, r, b = draw.textbbox((0, 0), edge, font=edge_font)
+            draw.text((cx - (r - l) // 2 - l, y - (b - t) // 2 - t), edge, fill=black, font=edge_font)
+        text = new_address()
+        label(text, cx, y, "NF" if is_nf else edge or "NA")
+        if edge:
+            label(f"%M{edge_rng.randint(20, 99)}.{edge_rng.randint(0, 7)}", cx, y, "edge_memory")
+            return f"{edge}({text})"
+        return f"NOT({text})" if is_nf else text
+
+    # Escreve a TAG centrada acima do fio, na altura onde o 1.5_detect_NF procura o contato
+    # (o bit de memória de uma borda fica logo abaixo do contato)
+    def label(text, cx, wire_y, kind):
+        l, t, r, b = draw.textbbox((0, 0), text, font=font)
+        w, h = r - l, b - t
+        y = wire_y - TAG_WIRE_OFFSET - int(h * 0.2) - h
+        if kind == "edge_memory":
+            y = wire_y + CONTACT_BAR_H // 2 + 4
+        x = cx - w // 2
+        draw.text((x - l, y - t), text, fill=black, font=font)
+        tags.append({"text": text, "x": x, "y": y, "w": w, "h": h, "conf": 100.0,
+                     "is_coil": kind == "coil", "is_nf": kind == "NF", "kind": kind})
+
+    x = LEFT_RAIL_X + 40
+    draw.line([(LEFT_RAIL_X, main_y), (coil_x - 20, main_y)], fill=black, width=LINE_W)
+    series_a = []
+    for _ in range(n_series):
+        series_a.append(contact(x + CONTACT_PITCH // 2, main_y))
+        x += CONTACT_PITCH
+
+    # Trecho em paralelo: ramo 0 no fio principal, demais abaixo, ligados por verticais
+    par_x1 = x
+    par_x2 = x + n_parallel * CONTACT_PITCH
+    branches = []
+    for b in range(n_branches):
+        y = main_y + b * ROW_SPACING
+        if b > 0:
+            draw.line([(par_x1, y), (par_x2, y)], fill=black, width=LINE_W)
+        terms = [contact(par_x1 + i * CONTACT_PITCH + CONTACT_PITCH // 2, y) for i in range(n_parallel)]
+        branches.append(terms[0] if len(terms) == 1 else f"AND({', '.join(terms)})")
+    last_y = main_y + (n_branches - 1) * ROW_SPACING
+    draw.line([(par_x1, main_y), (par_x1, last_y)], fill=black, width=LINE_W)
+    draw.line([(par_x2, main_y), (par_x2, last_y)], fill=black, width=LINE_W)
+    x = par_x2
+
+    series_b = []
+    for _ in range(n_series):
+        series_b.append(contact(x + CONTACT_PITCH // 2, main_y))
+        x += CONTACT_PITCH
+
+    # Bobina "( )" na área da margem direita
+    draw.arc([coil_x - 20, main_y - 12, coil_x - 4, main_y + 12], 90, 270, fill=black, width=LINE_W)
+    draw.arc([coil_x + 4, main_y - 12, coil_x + 20, main_y + 12], 270, 90, fill=black, width=LINE_W)
+    coil_text = new_address().replace("%I", "%Q")
+    label(coil_text, coil_x, main_y, "coil")
+
+    terms = series_a + [f"OR({', '.join(branches)})"] + series_b
+    truth = {"tags": tags, "expression": f"AND({', '.join(terms)})", "coil": coil_text}
+    return img, truth
+
+# ---- MEDIÇÃO ----
+
+# Mede uma etapa: 'repeat' execuções cronometradas (tracemalloc desligado) e uma execução extra
+# sob tracemalloc para o pico de memória (alocações Python/NumPy; buffers internos do OpenCV não entram)
+def measure(fn, items: int, repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        with redirect_stdout(io.StringIO()):
+            fn()
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    best = min(times)
+    return {
+        "runs": repeat,
+        "items": items,
+        "best_s": best,
+        "mean_s": sum(times) / len(times),
+        "items_per_s": (items / best) if best > 0 else None,
+        "peak_kb": peak / 1024.0,
+    }
+
+# Verifica se o binário do tesseract está disponível para o pytesseract
+def tesseract_available(stage1) -> bool:
+    try:
+        stage1.pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+# Aponta os diretórios de trabalho das etapas 2, 3 e 4 para um diretório temporário
+def redirect_stage_dirs(stages, work_dir):
+    s2, s3, s4 = stages["2"], stages["3"], stages["4"]
+    s2.DEBUG_DIR = s2.TAGS_DIR = work_dir
+    s3.DEBUG_DIR = s3.TAGS_OUT_DIR = work_dir
+    s4.DEBUG_DIR = work_dir
+    s4.LOGS_DIR = os.path.join(work_dir, "16_logs")
+    s4.FINAL_DIR = os.path.join(work_dir, "17_final")
+    s4.ensure_logs_dir()
+    s4.ensure_final_dir()
+    # Banco de artefatos próprio (não mistura Networks sintéticas com as do projeto)
+    artifact_store.STORE_PATH = os.path.join(work_dir, "pipeline_artifacts.sqlite")
+
+# Executa o benchmark de um tamanho: gera as Networks e mede cada etapa sobre todas elas
+def bench_size(stages, size: int, n_networks: int, repeat: int, work_dir: str, run_ocr: bool,
+               save_images: bool = False, ocr_batch_size: int = 8) -> Dict:
+    s1, s15, s2, s3, s4, s45 = (stages[k] for k in ("1", "1.5", "2", "3", "4", "4.5"))
+    redirect_stage_dirs(stages, work_dir)
+
+    networks = []
+    for i in range(n_networks):
+        # Mesmo formato de nome do 0_pdf_extractor (o 3 localiza as TAGs pelo tronco 'pageNNN_networkNN_Network_N')
+        base = f"page{size:03d}_network{i + 1:02d}_Network_{i + 1}_"
+        img, truth = make_ladder_network(size, seed=size * 1000 + i)
+        img_path = os.path.join(work_dir, f"{base}.png")
+        img.save(img_path)
+        if save_images:
+            os.makedirs(BENCH_DIR, exist_ok=True)
+            img.save(os.path.join(BENCH_DIR, f"{base}.png"))
+        # TAGs como sairiam do 1.5_detect_NF (entrada do 2 e do 3)
+        contact_tags = [t for t in truth["tags"] if t["kind"] != "edge_memory"]
+        tags_nf = [{k: t[k] for k in ("text", "x", "y", "w", "h", "conf", "is_coil")} for t in contact_tags]
+        for t, src in zip(tags_nf, contact_tags):
+            if src["kind"] == "NF":
+                t["text"] = f"NOT({t['text']})"
+            elif src["kind"] in ("P", "N"):
+                t["text"] = f"{src['kind']}({t['text']})"
+        with open(os.path.join(work_dir, f"{base}_tags_with_nf.json"), "w", encoding="utf-8") as f:
+            json.dump(tags_nf, f, ensure_ascii=False)
+        artifact_store.get_store().put_tags(base, artifact_store.TAGS_NF, tags_nf)
+        networks.append({"base": base, "img": img, "img_path": img_path, "truth": truth})
+
+    n_tags = sum(len(n["truth"]["tags"]) for n in networks)
+    stages_out = {}
+
+    # 1_detect_tags: modelos de glifos e OCR multi-pass (se houver tesseract)
+    glyph_hits = None
+    if s1 is not None:
+        stages_out["ocr_glyphs"] = measure(lambda: [s1.ocr_glyphs(n["img"]) for n in networks], n_networks, repeat)
+        glyph_hits = 0
+        for n in networks:
+            read = {e["text"] for e in s1.ocr_glyphs(n["img"])}
+            glyph_hits += sum(t["text"] in read for t in n["truth"]["tags"])
+    if run_ocr:
+        # Uma chamada do tesseract por imagem x lotes de 'ocr_batch_size' imagens em um mosaico
+        stages_out["ocr_multi_pass"] = measure(
+            lambda: [s1.ocr_multi_pass(n["img"]) for n in networks], n_networks, repeat)
+        bs = max(1, ocr_batch_size)
+        stages_out["ocr_multi_pass_batch"] = measure(
+            lambda: [s1.ocr_multi_pass_batch([n["img"] for n in networks[i:i + bs]])
+                     for i in range(0, n_networks, bs)], n_networks, repeat)
+
+    # 1.5_detect_NF: análise da caixa do contato para cada TAG (binarização fora da medição)
+    half_w = 1 if s15.USE_STRICT_NARROW_BOX else s15.CONTACT_HALF_W_NARROW
+    contacts = []
+    for n in networks:
+        bw = s15.binarize_image(n["img"])
+        n["bw"] = bw
+        for t in n["truth"]["tags"]:
+            if t["kind"] not in ("coil", "edge_memory"):
+                contacts.append((bw, t))
+
+    def run_contacts():
+        hits = 0
+        for bw, t in contacts:
+            is_nf, _m = s15.analyze_contact_region(
+                bw, int(t["x"] + t["w"] / 2), int(t["y"] + t["h"]),
+                int(s15.Y_OFFSET + max(0, t["h"] * 0.2)),
+                s15.CONTACT_HALF_H, half_w, s15.FRAC_THR, s15.CONSEC_THR)
+            hits += int(is_nf == t["is_nf"])
+        return hits
+
+    stages_out["analyze_contact_region"] = measure(run_contacts, len(contacts), repeat)
+    nf_accuracy = (run_contacts() / len(contacts)) if contacts else None
+
+    # 1.5_detect_NF: biblioteca de símbolos (uma passada por imagem + associação às TAGs)
+    masks = [np.asarray(n["bw"]) < 128 for n in networks]
+    s15.get_symbol_library()
+
+    def run_symbols():
+        hits = 0
+        for n, mask in zip(networks, masks):
+            tags = n["truth"]["tags"]
+            found = s15.detect_contact_symbols(mask)
+            assoc = s15.associate_contacts(tags, found)
+            for t, j in zip(tags, assoc):
+                if t["kind"] == "coil":
+                    continue
+                if j is not None:
+                    kind = found[j]["kind"]
+                else:
+                    kind = "edge_memory" if s15.edge_memory_kind(t, found) else None
+                hits += int(kind == t["kind"])
+        return hits
+
+    n_symbols = sum(t["kind"] != "coil" for n in networks for t in n["truth"]["tags"])
+    stages_out["detect_contact_symbols"] = measure(run_symbols, n_networks, repeat)
+    symbol_accuracy = (run_symbols() / n_symbols) if n_symbols else None
+
+    # 2_mark_blocks: fechamento de gaps isolado e o processamento completo da imagem
+    import cv2
+    horiz_masks = []
+    for n in networks:
+        gray = cv2.cvtColor(cv2.imread(n["img_path"]), cv2.COLOR_BGR2GRAY)
+        horiz = s2.filter_by_length(s2.extract_horizontal(s2.binarize(gray)), "horizontal",
+                                    min_len=None, max_len=s2.H_MAX_PX)
+        horiz_masks.append(horiz)
+    stages_out["close_horizontal_gaps"] = measure(
+        lambda: [s2.close_horizontal_gaps(m, gap_max=s2.GAP_MAX_PX, iters=s2.ITER_CLOSE) for m in horiz_masks],
+        n_networks, repeat)
+    # Variantes (coarse-to-fine 2x/4x e motor RLE) x morfologia em resolução cheia: tempo/memória e
+    # equivalência das saídas
+    store = artifact_store.get_store()
+    variants = {f"process_image_coarse{f}": (lambda path, f=f: s2.process_image(path, coarse=f))
+                for f in COARSE_FACTORS}
+    variants["process_image_rle"] = s2.process_image_rle
+    line_match = {}
+    for name, run in variants.items():
+        stages_out[name] = measure(lambda: [run(n["img_path"]) for n in networks], n_networks, repeat)
+        line_match[name] = {n["base"]: (store.verticals(n["base"]) or [], store.rects(n["base"]) or [])
+                            for n in networks}
+    stages_out["process_image"] = measure(
+        lambda: [s2.process_image(n["img_path"]) for n in networks], n_networks, repeat)
+    for name, outputs in line_match.items():
+        equivalent, worst = 0, 0
+        for n in networks:
+            cmp = s2.compare_line_results(store.verticals(n["base"]) or [], store.rects(n["base"]) or [],
+                                          *outputs[n["base"]])
+            equivalent += int(cmp["equivalent"])
+            worst = max(worst, cmp["verticals"]["max_diff_px"], cmp["rects"]["max_diff_px"])
+        line_match[name] = {"equivalent": equivalent, "networks": n_networks, "max_diff_px": worst}
+
+    # 3_associate_tags_with_blocks
+    groups = {}
+
+    def run_associate():
+        for n in networks:
+            groups[n["base"]] = s3.associate_tags_and_rects(n["base"])
+
+    stages_out["associate_tags_and_rects"] = measure(run_associate, n_networks, repeat)
+    missing = [base for base, g in groups.items() if g is None]
+    if missing:
+        print(f"[AVISO] associate_tags_and_rects sem resultado para: {', '.join(missing)}")
+
+    # 4_group_blocks: OR/AND alternados
+    verticals = {n["base"]: s4.load_verticals_for_base(n["base"]) for n in networks}
+    finals = {}
+
+    def run_grouping():
+        for n in networks:
+            base = n["base"]
+            blocks, _stats = s4.group_network(base, s4.blocks_from_groups(groups[base] or []), verticals[base])
+            finals[base] = blocks
+
+    stages_out["group_network"] = measure(run_grouping, n_networks, repeat)
+
+    # 4.5_adapt_logical_expression: parsing das expressões finais (e da expressão esperada)
+    exprs = []
+    for n in networks:
+        exprs.extend(b.get("expression", "") for b in finals[n["base"]] if b.get("expression"))
+        exprs.append(n["truth"]["expression"])
+    stages_out["parse_many"] = measure(lambda: s45.parse_many(exprs), len(exprs), repeat)
+
+    W, H = networks[0]["img"].size
+    return {
+        "size": size,
+        "networks": n_networks,
+        "image_px": [W, H],
+        "tags": n_tags,
+        "nf_accuracy": nf_accuracy,
+        "symbol_accuracy": symbol_accuracy,
+        "line_match": line_match,
+        "glyph_accuracy": (glyph_hits / n_tags) if n_tags and glyph_hits is not None else None,
+        "stages": stages_out,
+    }
+
+# ---- REVISÃO / COMPARAÇÃO ----
+
+# Revisão git atual (hash curto e se há alterações não commitadas)
+def git_revision():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BASE_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return rev, dirty
+    except Exception:
+        return "unknown", False
+
+# Imprime a razão de tempo (atual / referência) por tamanho e etapa
+def compare_results(current: Dict, reference: Dict):
+    ref_by_size = {r["size"]: r for r in reference.get("results", [])}
+    print(f"\n=== Comparação com {reference.get('revision', '?')} (tempo atual / referência) ===")
+    for r in current["results"]:
+        ref = ref_by_size.get(r["size"])
+        if ref is None:
+            continue
+        for name, m in r["stages"].items():
+            old = ref["stages"].get(name)
+            if not old or not old.get("best_s"):
+                continue
+            ratio = m["best_s"] / old["best_s"]
+            flag = "  <-- regressão" if ratio > 1.10 else ""
+            print(f"  size={r['size']:<3} {name:<26} {ratio:6.2f}x{flag}")
+
+# ---- MAIN ----
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark das etapas do pipeline com Networks sintéticas")
+    ap.add_argument("--sizes", default="1,2,4", help="Complexidades das Networks (lista separada por vírgulas)")
+    ap.add_argument("--networks", "-n", type=int, default=3, help="Networks geradas por tamanho")
+    ap.add_argument("--repeat", "-r", type=int, default=3, help="Execuções cronometradas por etapa")
+    ap.add_argument("--no-ocr", action="store_true", help="Não mede o OCR (tesseract)")
+    ap.add_argument("--batch-size", type=int, default=8,
+                    help="Imagens por mosaico em ocr_multi_pass_batch (comparado com uma chamada por imagem)")
+    ap.add_argument("--save-images", action="store_true", help="Salva as imagens sintéticas em 99_debug/18_bench")
+    ap.add_argument("--out", "-o", default=None, help="JSON de saída (padrão: 99_debug/18_bench/bench_<rev>_<data>.json)")
+    ap.add_argument("--compare", default=None, help="JSON de um benchmark anterior para comparação")
+    args = ap.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    stages = {
+        "1.5": load_stage("1.5_detect_NF.py"),
+        "2": load_stage("2_mark_blocks.py"),
+        "3": load_stage("3_associate_tags_with_blocks.py"),
+        "4": load_stage("4_group_blocks.py"),
+        "4.5": load_stage("4.5_adapt_logical_expression.py"),
+    }
+    stages["4.5"].DEBUG = False
+    run_ocr = False
+    try:
+        stages["1"] = load_stage("1_detect_tags.py")
+    except ImportError as e:
+        stages["1"] = None
+        print(f"[AVISO] 1_detect_tags indisponível: {e}")
+    if stages["1"] is not None and not args.no_ocr:
+        run_ocr = tesseract_available(stages["1"])
+        if not run_ocr:
+            print("[AVISO] tesseract não encontrado; ocr_multi_pass não será medido")
+
+    rev, dirty = git_revision()
+    report = {
+        "revision": rev,
+        "dirty": dirty,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": {"sizes": sizes, "networks": args.networks, "repeat": args.repeat, "ocr": run_ocr,
+                   "ocr_batch_size": args.batch_size},
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as work_dir:
+        for size in sizes:
+            result = bench_size(stages, size, args.networks, args.repeat, work_dir, run_ocr, args.save_images,
+                                args.batch_size)
+            report["results"].append(result)
+            W, H = result["image_px"]
+            nf_ok = f"{result['nf_accuracy']:.0%}" if result["nf_accuracy"] is not None else "-"
+            glyph_ok = f"{result['glyph_accuracy']:.0%}" if result.get("glyph_accuracy") is not None else "-"
+            symbol_ok = f"{result['symbol_accuracy']:.0%}" if result.get("symbol_accuracy") is not None else "-"
+            print(f"\n[size={size}] {args.networks} Network(s) {W}x{H}px | {result['tags']} TAGs | NF ok: {nf_ok} "
+                  f"| símbolos ok: {symbol_ok} | glyph ok: {glyph_ok}")
+            for name, m in result.get("line_match", {}).items():
+                print(f"  {name}: {m['equivalent']}/{m['networks']} Network(s) equivalentes ao process_image "
+                      f"(maior diferença {m['max_diff_px']}px)")
+            for name, m in result["stages"].items():
+                rate = f"{m['items_per_s']:.1f}/s" if m["items_per_s"] else "-"
+                print(f"  {name:<26} best={m['best_s'] * 1000:9.2f}ms  mean={m['mean_s'] * 1000:9.2f}ms  "
+                      f"{rate:>12}  peak={m['peak_kb']:9.1f}KB")
+
+    out_path = args.out
+    if out_path is None:
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        out_path = os.path.join(BENCH_DIR, f"bench_{rev}{'-dirty' if dirty else ''}_{stamp}.json")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n[OK] Resultados salvos em: {out_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare_results(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# crop_store.py
+# Contêiner único dos recortes das Networks (crops.u8 no diretório das figuras, ex.: 02_figures): arrays
+# uint8 em tons de cinza gravados em sequência em um arquivo bruto, com um índice nome -> (offset, altura,
+# largura) em crops.u8.index.json. As etapas abrem o arquivo com np.memmap e recebem views sem cópia,
+# evitando o ciclo codifica/decodifica PNG entre o 0_pdf_extractor e as etapas 1, 1.5 e 2. O PNG por
+# Network passa a ser saída de depuração (0_pdf_extractor --no-png deixa de gravá-lo).
+# Um nome gravado de novo aponta para os bytes novos (os antigos ficam órfãos até o próximo reset()).
+
+import os, json
+from typing import Dict, List, Optional
+import numpy as np
+
+# ---- DIRETORIOS ----
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIGS_DIR = os.path.join(BASE_DIR, "02_figures")
+
+# ---- PARAMETROS ----
+CROPS_FILENAME = "crops.u8"
+INDEX_SUFFIX = ".index.json"
+ALIGN = 64    # Alinhamento (bytes) do início de cada recorte
+
+class CropStore:
+    """
+    Leitura/gravação do contêiner de recortes. Gravação: put() acrescenta ao final e flush() grava o
+    índice (em arquivo temporário + rename). Leitura: get() devolve uma view somente leitura do memmap.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.index: Dict[str, List[int]] = {}
+        self._mm = None
+        self._mm_size = -1
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f).get("crops", {})
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def names(self) -> List[str]:
+        return sorted(self.index)
+
+    # Apaga o contêiner (início de uma nova extração)
+    def reset(self):
+        self._mm = None
+        self.index = {}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        open(self.path, "wb").close()
+        self.flush()
+
+    # Acrescenta um recorte (array 2D uint8, ou RGB convertido para cinza pelo chamador)
+    def put(self, name: str, gray: np.ndarray):
+        gray = np.ascontiguousarray(gray, dtype=np.uint8)
+        if gray.ndim != 2:
+            raise ValueError(f"recorte deve ser 2D (cinza), recebido {gray.shape}")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            pad = (-offset) % ALIGN
+            if pad:
+                f.write(b"\0" * pad)
+                offset += pad
+            f.write(gray.tobytes())
+        self.index[name] = [offset, int(gray.shape[0]), int(gray.shape[1])]
+        self._mm = None
+
+    def flush(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dtype": "uint8", "crops": self.index}, f)
+        os.replace(tmp, self.index_path)
+
+    # View (altura x largura) do recorte, sem cópia; None se o nome não estiver no contêiner
+    def get(self, name: str) -> Optional[np.ndarray]:
+        entry = self.index.get(name)
+        if entry is None:
+            return None
+        offset, h, w = entry
+        size = os.path.getsize(self.path)
+        if self._mm is None or self._mm_size != size:
+            self._mm = np.memmap(self.path, dtype=np.uint8, mode="r")
+            self._mm_size = size
+        return self._mm[offset:offset + h * w].reshape(h, w)
+
+    # Bytes ocupados no disco (dados + índice)
+    def disk_bytes(self) -> int:
+        total = 0
+        for p in (self.path, self.index_path):
+            if os.path.exists(p):
+                total += os.path.getsize(p)
+        return total
+
+_STORES: Dict[str, CropStore] = {}
+
+# Contêiner de um diretório de figuras (o índice é lido uma vez por processo)
+def get_crop_store(img_dir: str = FIGS_DIR) -> CropStore:
+    path = os.path.join(os.path.abspath(str(img_dir)), CROPS_FILENAME)
+    store = _STORES.get(path)
+    if store is None:
+        store = CropStore(path)
+        _STORES[path] = store
+    return store
+
+# Recorte em cinza de uma imagem pelo caminho (<dir>/<base>.png -> contêiner de <dir>, nome <base>);
+# None se o diretório não tiver contêiner ou o recorte não estiver nele
+def crop_view(image_path) -> Optional[np.ndarray]:
+    image_path = str(image_path)
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return get_crop_store(os.path.dirname(image_path) or ".").get(name)
+
+# Caminhos "virtuais" (<dir>/<base>.png) dos recortes do contêiner, para as etapas que listam as figuras
+def crop_image_paths(img_dir: str = FIGS_DIR) -> List[str]:
+    return [os.path.join(img_dir, f"{name}.png") for name in get_crop_store(img_dir).names()]
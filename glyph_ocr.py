@@ -0,0 +1,466 @@
+# glyph_ocr.py
+# Reconhecedor de TAGs por modelos de glifos (backend "glyph" do 1_detect_tags).
+# Os endereços do TIA Portal são impressos em uma fonte fixa e com alfabeto pequeno (%, I/Q/M/D/B,
+# dígitos e '.'): os caracteres são segmentados por componentes conexos e classificados em lote pelo
+# vizinho mais próximo (correlação normalizada) contra os modelos, com a gramática do endereço
+# (% -> letras -> dígitos -> '.') restringindo as classes de cada posição. Palavras com glifo de
+# similaridade baixa vão para o OCR de fallback (tesseract); palavras sem semelhança com o alfabeto
+# (comentários, títulos) são descartadas.
+# Modelos: renderizados de uma fonte (GLYPH_FONTS ou a fonte padrão do Pillow) e, com
+# `python glyph_ocr.py --learn`, aprendidos das Networks que têm camada de texto do PDF (fonte real).
+
+import os, json
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import cv2
+from PIL import Image, ImageDraw, ImageFont
+from pipeline_profiling import profiled, span
+from artifact_store import get_store, TAGS_TEXT
+from crop_store import crop_view, crop_image_paths
+
+# ---- DIRETORIOS ----
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIGS_DIR = os.path.join(BASE_DIR, "02_figures")
+TAGS_OUT_DIR = os.path.join(BASE_DIR, "03_tags")
+TEMPLATES_PATH = os.path.join(BASE_DIR, "glyph_templates.npz")
+
+# ---- PARAMETROS ----
+ALPHABET = "%IQMDB0123456789."
+LETTERS = "IQMDB"
+DIGITS = "0123456789"
+CLASSES = ALPHABET.replace(".", "")      # '.' é reconhecido pela geometria (altura), sem modelo
+GLYPH_W, GLYPH_H = 20, 16                 # Célula normalizada (altura fixa, largura proporcional)
+CELL_BLUR_SIGMA = 0.8                     # Suavização da célula antes da correlação
+BIN_THRESHOLD = 140                       # Mesmo limiar da binarização do OCR multi-pass
+MIN_GLYPH_H = 5                           # Componentes mais baixos só entram como '.' de uma linha
+MAX_GLYPH_W, MAX_GLYPH_H = 64, 64         # Componentes maiores são linhas/blocos do ladder
+MERGE_OVERLAP = 0.5                       # Sobreposição em X (fração do menor) para unir partes de um glifo
+MERGE_MAX_REL_H = 1.25                    # A união não pode passar de 1.25 x a parte mais alta (evita fios/arcos)
+DOT_MAX_REL_H = 0.35                      # Glifo com altura < 35% da linha é '.'
+WORD_GAP_REL = 0.6                        # Espaço > 60% da altura da linha separa palavras
+PAIR_MAX_GAP = 1                          # Vizinhos a até 1 px podem ser partes de um mesmo glifo
+PAIR_MAX_REL_W = 1.3                      # ... se a união não for mais larga que 1.3 x a altura
+SPLIT_REL_W = 1.15                        # Componente com largura > 1.15 x altura: caracteres encostados
+CHAR_REL_W = 0.62                         # Largura típica de um caractere (fração da altura)
+GLYPH_MIN_SIM = 0.80                      # Abaixo disso a palavra vai para o fallback
+GLYPH_REJECT_SIM = 0.45                   # Similaridade média abaixo disso: palavra fora do alfabeto
+MIN_WORD_GLYPHS = 3                       # Endereço mais curto: '%', letra e dígito
+MAX_SAMPLES_PER_CHAR = 16                 # Modelos aprendidos por caractere
+RENDER_SIZES = (14, 18, 24, 32)
+GLYPH_FONTS = ["arial.ttf", "Arial.ttf", "LiberationSans-Regular.ttf", "DejaVuSans.ttf"]
+
+# Binariza (texto = 1) uma imagem em tons de cinza
+def binarize(gray, threshold=BIN_THRESHOLD):
+    return (np.asarray(gray) < threshold).astype(np.uint8)
+
+# Célula normalizada do glifo: altura GLYPH_H, largura proporcional centralizada em GLYPH_W
+def glyph_cell(mask: np.ndarray) -> np.ndarray:
+    h, w = mask.shape
+    nw = max(1, min(GLYPH_W, int(round(w * GLYPH_H / h))))
+    small = cv2.resize(mask.astype(np.float32), (nw, GLYPH_H), interpolation=cv2.INTER_AREA)
+    cell = np.zeros((GLYPH_H, GLYPH_W), np.float32)
+    x0 = (GLYPH_W - nw) // 2
+    cell[:, x0:x0 + nw] = small
+    # Suaviza para tolerar traços deslocados de 1 px (fontes e resoluções diferentes)
+    return cv2.GaussianBlur(cell, (3, 3), CELL_BLUR_SIGMA)
+
+# Célula de uma máscara recortada ao retângulo da tinta; célula vazia se não houver tinta
+def ink_cell(mask: np.ndarray) -> np.ndarray:
+    ys, xs = np.nonzero(mask)
+    if len(ys) == 0:
+        return np.zeros((GLYPH_H, GLYPH_W), np.float32)
+    return glyph_cell(mask[ys.min():ys.max() + 1, xs.min():xs.max() + 1])
+
+# Vetores de características (linhas) com média zero e norma 1: produto escalar = correlação normalizada
+def cell_features(cells: np.ndarray) -> np.ndarray:
+    v = cells.reshape(len(cells), -1).astype(np.float32)
+    v = v - v.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(v, axis=1, keepdims=True)
+    return v / np.maximum(norm, 1e-6)
+
+# ---- SEGMENTAÇÃO ----
+
+# Une componentes conexos sobrepostos em X e próximos em Y (partes de um mesmo glifo, ex.: '%')
+def merge_components(boxes: np.ndarray) -> List[List[int]]:
+    n = len(boxes)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    order = np.argsort(boxes[:, 0], kind="stable")
+    for a_pos, i in enumerate(order):
+        xi, yi, wi, hi = boxes[i]
+        for j in order[a_pos + 1:]:
+            xj, yj, wj, hj = boxes[j]
+            if xj >= xi + wi:
+                break
+            overlap = min(xi + wi, xj + wj) - xj
+            union_h = max(yi + hi, yj + hj) - min(yi, yj)
+            if overlap >= MERGE_OVERLAP * min(wi, wj) and union_h <= MERGE_MAX_REL_H * max(hi, hj):
+                parent[find(j)] = find(i)
+    groups: Dict[int, List[int]] = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+# Divide um glifo largo (caracteres encostados) nas colunas de menor tinta
+def split_wide(mask: np.ndarray) -> List[Tuple[int, int]]:
+    h, w = mask.shape
+    n = max(2, int(round(w / (CHAR_REL_W * h))))
+    ink = mask.sum(axis=0)
+    cuts = [0]
+    for k in range(1, n):
+        center = k * w // n
+        half = max(1, w // (4 * n))
+        lo, hi = max(cuts[-1] + 1, center - half), min(w - 1, center + half)
+        if lo >= hi:
+            continue
+        cuts.append(lo + int(np.argmin(ink[lo:hi])))
+    cuts.append(w)
+    return [(a, b) for a, b in zip(cuts, cuts[1:]) if b > a]
+
+# Glifos da imagem binária: [{"x","y","w","h","mask"}], já unidos e divididos
+def segment_glyphs(bw: np.ndarray) -> List[dict]:
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(bw, connectivity=8)
+    if n <= 1:
+        return []
+    ids = np.arange(1, n)
+    boxes = stats[1:, :4]
+    keep = (boxes[:, 2] <= MAX_GLYPH_W) & (boxes[:, 3] <= MAX_GLYPH_H)
+    ids, boxes = ids[keep], boxes[keep]
+    glyphs = []
+    for group in merge_components(boxes):
+        b = boxes[group]
+        x1, y1 = int(b[:, 0].min()), int(b[:, 1].min())
+        x2, y2 = int((b[:, 0] + b[:, 2]).max()), int((b[:, 1] + b[:, 3]).max())
+        if x2 - x1 > MAX_GLYPH_W or y2 - y1 > MAX_GLYPH_H:
+            continue
+        window = labels[y1:y2, x1:x2]
+        mask = window == ids[group[0]] if len(group) == 1 else np.isin(window, ids[group])
+        h, w = mask.shape
+        parts = split_wide(mask) if h >= MIN_GLYPH_H and w > SPLIT_REL_W * h else [(0, w)]
+        for a, c in parts:
+            sub = mask[:, a:c]
+            rows = np.flatnonzero(sub.any(axis=1))
+            if len(rows) == 0:
+                continue
+            sub = sub[rows[0]:rows[-1] + 1]
+            glyphs.append({"x": x1 + a, "y": y1 + int(rows[0]), "w": c - a, "h": sub.shape[0], "mask": sub})
+    return glyphs
+
+# Agrupa os glifos em linhas (faixas em Y) e palavras (espaços em X). Glifos baixos ('.', ruído)
+# só entram em uma linha já formada por glifos altos
+def group_words(glyphs: List[dict]) -> List[List[dict]]:
+    bands: List[dict] = []
+    tall = sorted((g for g in glyphs if g["h"] >= MIN_GLYPH_H), key=lambda g: g["y"] + g["h"] / 2)
+    small = [g for g in glyphs if g["h"] < MIN_GLYPH_H]
+    for g in tall + small:
+        top, bottom = g["y"], g["y"] + g["h"]
+        target = None
+        for band in bands:
+            overlap = min(bottom, band["bottom"]) - max(top, band["top"])
+            if overlap >= 0.5 * min(g["h"], band["bottom"] - band["top"]):
+                target = band
+                break
+        if target is None:
+            if g["h"] < MIN_GLYPH_H:
+                continue
+            target = {"top": top, "bottom": bottom, "glyphs": []}
+            bands.append(target)
+        target["glyphs"].append(g)
+        if g["h"] >= MIN_GLYPH_H:
+            target["top"], target["bottom"] = min(target["top"], top), max(target["bottom"], bottom)
+
+    words = []
+    for band in bands:
+        line_h = float(np.median([g["h"] for g in band["glyphs"] if g["h"] >= MIN_GLYPH_H]))
+        current: List[dict] = []
+        for g in sorted(band["glyphs"], key=lambda g: g["x"]):
+            g["dot"] = g["h"] < DOT_MAX_REL_H * line_h
+            if current and g["x"] - max(c["x"] + c["w"] for c in current) > WORD_GAP_REL * line_h:
+                words.append(current)
+                current = []
+            current.append(g)
+        if current:
+            words.append(current)
+    return words
+
+# Altura típica (px) das maiúsculas/dígitos da imagem: mediana da altura dos glifos das palavras com
+# ao menos MIN_WORD_GLYPHS glifos (descarta diagonais, arcos e ruído); None se não houver texto
+def text_height(gray) -> Optional[float]:
+    words = group_words(segment_glyphs(binarize(gray)))
+    heights = [g["h"] for w in words if len(w) >= MIN_WORD_GLYPHS for g in w if not g["dot"]]
+    return float(np.median(heights)) if heights else None
+
+# ---- MODELOS ----
+
+# Modelos renderizados das fontes de GLYPH_FONTS encontradas e da fonte padrão do Pillow
+def render_font_templates(font_paths=GLYPH_FONTS, sizes=RENDER_SIZES) -> Tuple[List[str], np.ndarray]:
+    fonts = []
+    for path in font_paths:
+        try:
+            fonts += [ImageFont.truetype(path, s) for s in sizes]
+        except OSError:
+            continue
+    try:
+        fonts += [ImageFont.load_default(size=s) for s in sizes]
+    except TypeError:   # Pillow < 10.1: fonte bitmap de tamanho único
+        fonts.append(ImageFont.load_default())
+    chars, cells = [], []
+    for font in fonts:
+        for ch in CLASSES:
+            img = Image.new("L", (96, 96), 255)
+            ImageDraw.Draw(img).text((16, 16), ch, fill=0, font=font)
+            bw = binarize(img)
+            if not bw.any():
+                continue
+            chars.append(ch)
+            cells.append(ink_cell(bw))
+    return chars, np.array(cells, np.float32)
+
+# Modelos aprendidos (TEMPLATES_PATH); None se ainda não houver
+def load_learned_templates(path=TEMPLATES_PATH) -> Optional[Tuple[List[str], np.ndarray]]:
+    if not os.path.exists(path):
+        return None
+    data = np.load(path)
+    return [str(c) for c in data["chars"]], data["cells"].astype(np.float32)
+
+_TEMPLATES: Dict[str, tuple] = {}
+
+# Modelos em uso: aprendidos + renderizados para os caracteres que não foram aprendidos.
+# Devolve (classe de cada modelo, matriz de características)
+def get_templates(path=TEMPLATES_PATH) -> Tuple[np.ndarray, np.ndarray]:
+    cached = _TEMPLATES.get(path)
+    if cached is not None:
+        return cached
+    chars, cells = render_font_templates()
+    learned = load_learned_templates(path)
+    if learned is not None and learned[0]:
+        known = set(learned[0])
+        rest = [i for i, c in enumerate(chars) if c not in known]
+        chars = learned[0] + [chars[i] for i in rest]
+        cells = np.concatenate([learned[1], cells[rest]]) if rest else learned[1]
+    labels = np.array([CLASSES.index(c) for c in chars])
+    _TEMPLATES[path] = (labels, cell_features(cells))
+    return _TEMPLATES[path]
+
+# ---- CLASSIFICAÇÃO ----
+
+# Similaridade de cada glifo com cada classe (N x classes), em um único produto de matrizes
+def class_similarity(cells: np.ndarray, templates=None) -> np.ndarray:
+    labels, feats = templates if templates is not None else get_templates()
+    sim = cell_features(cells) @ feats.T
+    out = np.full((len(cells), len(CLASSES)), -1.0, np.float32)
+    for c in range(len(CLASSES)):
+        cols = labels == c
+        if cols.any():
+            out[:, c] = sim[:, cols].max(axis=1)
+    return out
+
+_ALLOWED = {
+    "start": CLASSES,
+    "%": LETTERS,
+    "letter": LETTERS + DIGITS,
+    "digit": DIGITS,
+}
+
+# Decodifica uma palavra com a gramática do endereço: % -> letras -> dígitos ('.' entre dígitos)
+def decode_word(word: List[dict], sims: np.ndarray) -> Tuple[str, List[float]]:
+    text, scores, state = "", [], "start"
+    for g in word:
+        if g["dot"]:
+            text += "."
+            continue
+        row = sims[g["row"]]
+        allowed = [CLASSES.index(c) for c in _ALLOWED[state]]
+        best = allowed[int(np.argmax(row[allowed]))]
+        ch = CLASSES[best]
+        text += ch
+        scores.append(float(row[best]))
+        state = "%" if ch == "%" else ("letter" if ch in LETTERS else "digit")
+    return text, scores
+
+# Une dois glifos vizinhos em um só (máscara na caixa da união)
+def join_glyphs(a: dict, b: dict) -> dict:
+    x1, y1 = min(a["x"], b["x"]), min(a["y"], b["y"])
+    x2, y2 = max(a["x"] + a["w"], b["x"] + b["w"]), max(a["y"] + a["h"], b["y"] + b["h"])
+    mask = np.zeros((y2 - y1, x2 - x1), bool)
+    for g in (a, b):
+        mask[g["y"] - y1:g["y"] - y1 + g["h"], g["x"] - x1:g["x"] - x1 + g["w"]] |= g["mask"]
+    return {"x": x1, "y": y1, "w": x2 - x1, "h": y2 - y1, "mask": mask, "dot": False}
+
+# Pares de glifos vizinhos (encostados) que podem ser um glifo só de várias partes (ex.: '%' com as
+# duas metades separadas em algumas fontes)
+def pair_candidates(word: List[dict]) -> List[Tuple[int, dict]]:
+    out = []
+    for i in range(len(word) - 1):
+        a, b = word[i], word[i + 1]
+        if a["dot"] or b["dot"]:
+            continue
+        joined = join_glyphs(a, b)
+        if b["x"] - (a["x"] + a["w"]) <= PAIR_MAX_GAP and joined["w"] <= PAIR_MAX_REL_W * joined["h"]:
+            out.append((i, joined))
+    return out
+
+# Segmenta e classifica as palavras de uma imagem binária. Os glifos e os pares candidatos são
+# classificados em um único lote; um par vira um glifo só quando a união é mais parecida com um
+# modelo do que cada parte. Devolve (palavras, similaridades); g["row"] indexa as similaridades
+def read_words(bw: np.ndarray, templates=None) -> Tuple[List[List[dict]], np.ndarray]:
+    with span("recognize.segment"):
+        words = group_words(segment_glyphs(bw))
+        pairs = [(w, i, j) for w, word in enumerate(words) for i, j in pair_candidates(word)]
+    glyphs = [g for word in words for g in word if not g["dot"]] + [j for _, _, j in pairs]
+    if not glyphs:
+        return words, np.zeros((0, len(CLASSES)), np.float32)
+    for row, g in enumerate(glyphs):
+        g["row"] = row
+    with span("recognize.classify"):
+        sims = class_similarity(np.stack([glyph_cell(g["mask"]) for g in glyphs]), templates)
+    best = sims.max(axis=1)
+    for w, i, joined in reversed(pairs):
+        word = words[w]
+        if i + 1 >= len(word) or "row" not in word[i] or "row" not in word[i + 1]:
+            continue
+        if best[joined["row"]] > max(best[word[i]["row"]], best[word[i + 1]["row"]]):
+            word[i:i + 2] = [joined]
+    return words, sims
+
+# Palavra candidata a endereço: ao menos MIN_WORD_GLYPHS glifos ('%', letra, dígito), primeiro glifo
+# parecido com '%' e similaridade média acima de GLYPH_REJECT_SIM. O resto (títulos, comentários,
+# diagonais de contatos NF, arcos de bobinas) é descartado sem passar pelo fallback
+def looks_like_address(word: List[dict], sims: np.ndarray, scores: List[float]) -> bool:
+    if len(word) < MIN_WORD_GLYPHS or not scores or word[0]["dot"]:
+        return False
+    if sims[word[0]["row"], CLASSES.index("%")] < GLYPH_REJECT_SIM:
+        return False
+    return float(np.mean(scores)) >= GLYPH_REJECT_SIM
+
+# Reconhece as palavras de uma imagem em tons de cinza. 'fallback([recortes_cinza]) -> [(texto, conf) | None]'
+# é chamado uma vez, com todas as palavras de glifos com baixa similaridade. Saída no formato do OCR
+# multi-pass: [{"text","x","y","w","h","conf","source"}] em pixels da imagem
+@profiled
+def recognize(gray: np.ndarray, fallback: Optional[Callable] = None, templates=None) -> List[dict]:
+    gray = np.asarray(gray)
+    words, sims = read_words(binarize(gray), templates)
+
+    out, doubtful = [], []
+    for word in words:
+        x1 = min(g["x"] for g in word)
+        y1 = min(g["y"] for g in word)
+        x2 = max(g["x"] + g["w"] for g in word)
+        y2 = max(g["y"] + g["h"] for g in word)
+        text, scores = decode_word(word, sims)
+        if not looks_like_address(word, sims, scores):
+            continue
+        entry = {"text": text, "x": x1, "y": y1, "w": x2 - x1, "h": y2 - y1,
+                 "conf": round(100.0 * min(scores), 1), "source": "glyph"}
+        if min(scores) < GLYPH_MIN_SIM:
+            if fallback is not None:
+                pad = max(2, (y2 - y1) // 4)
+                doubtful.append((entry, gray[max(0, y1 - pad):y2 + pad, max(0, x1 - pad):x2 + pad]))
+            continue
+        out.append(entry)
+
+    if doubtful:
+        with span("recognize.fallback"):
+            results = fallback([crop for _, crop in doubtful])
+        for (entry, _), res in zip(doubtful, results):
+            if res:
+                entry.update({"text": res[0], "conf": float(res[1]), "source": "fallback"})
+                out.append(entry)
+    return out
+
+# ---- APRENDIZADO ----
+
+# Amostras (caractere, célula) de uma Network com camada de texto: cada palavra do alfabeto cujo
+# número de glifos segmentados bate com o número de caracteres
+def samples_from_words(gray: np.ndarray, words: List[dict]) -> List[Tuple[str, np.ndarray]]:
+    bw = binarize(gray)
+    samples = []
+    for w in words:
+        text = str(w.get("text", "")).strip()
+        if not text or any(c not in ALPHABET for c in text):
+            continue
+        pad = max(2, int(w.get("h", 0)) // 4)
+        x1, y1 = max(0, int(w["x"]) - pad), max(0, int(w["y"]) - pad)
+        x2, y2 = int(w["x"] + w["w"]) + pad, int(w["y"] + w["h"]) + pad
+        found, _ = read_words(bw[y1:y2, x1:x2])
+        if len(found) != 1 or len(found[0]) != len(text):
+            continue
+        for ch, g in zip(text, found[0]):
+            if ch != "." and not g["dot"]:
+                samples.append((ch, glyph_cell(g["mask"])))
+    return samples
+
+# Aprende os modelos das Networks com camada de texto (02_figures + banco de artefatos) e grava
+# TEMPLATES_PATH; mantém até MAX_SAMPLES_PER_CHAR amostras por caractere (as mais distintas entre si)
+def learn_templates(img_dir=FIGS_DIR, path=TEMPLATES_PATH) -> Dict[str, int]:
+    store = get_store()
+    names = {os.path.splitext(f)[0] for f in os.listdir(img_dir) if f.lower().endswith(".png")} if os.path.isdir(img_dir) else set()
+    names |= {os.path.splitext(os.path.basename(p))[0] for p in crop_image_paths(img_dir)}
+    by_char: Dict[str, List[np.ndarray]] = {}
+    for name in sorted(names):
+        words = store.tags(name, TAGS_TEXT)
+        if not words:
+            continue
+        img_path = os.path.join(img_dir, f"{name}.png")
+        gray = crop_view(img_path)
+        if gray is None:
+            gray = np.asarray(Image.open(img_path).convert("L"))
+        for ch, cell in samples_from_words(gray, words):
+            by_char.setdefault(ch, []).append(cell)
+
+    chars, cells = [], []
+    for ch, items in sorted(by_char.items()):
+        picked = [items[0]]
+        feats = cell_features(np.stack(items))
+        chosen = [0]
+        while len(chosen) < min(MAX_SAMPLES_PER_CHAR, len(items)):
+            sim = (feats @ feats[chosen].T).max(axis=1)
+            sim[chosen] = np.inf
+            nxt = int(np.argmin(sim))
+            if sim[nxt] > 0.995:
+                break
+            chosen.append(nxt)
+            picked.append(items[nxt])
+        chars += [ch] * len(picked)
+        cells += picked
+    if cells:
+        np.savez_compressed(path, chars=np.array(chars), cells=np.stack(cells))
+        _TEMPLATES.pop(path, None)
+    return {ch: chars.count(ch) for ch in sorted(set(chars))}
+
+# ---- MAIN ----
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Modelos de glifos do backend de OCR 'glyph'")
+    ap.add_argument("--learn", action="store_true",
+                    help="Aprende os modelos das Networks com camada de texto do PDF (rode após o 0_pdf_extractor)")
+    ap.add_argument("--image", help="Reconhece as TAGs de uma imagem e imprime o resultado")
+    args = ap.parse_args()
+
+    if args.learn:
+        counts = learn_templates()
+        if not counts:
+            print("Nenhuma amostra: é preciso um PDF com camada de texto extraído pelo 0_pdf_extractor.")
+            return
+        print(f"Modelos salvos em: {TEMPLATES_PATH}")
+        print(json.dumps(counts, ensure_ascii=False))
+    if args.image:
+        gray = crop_view(args.image)
+        if gray is None:
+            gray = np.asarray(Image.open(args.image).convert("L"))
+        for w in recognize(gray):
+            print(f"{w['text']:<12} x={w['x']:<5} y={w['y']:<5} conf={w['conf']}")
+    if not args.learn and not args.image:
+        labels, _ = get_templates()
+        learned = load_learned_templates()
+        print(f"{len(labels)} modelos ({'aprendidos + fonte' if learned else 'só fonte'}) para: {CLASSES}")
+
+if __name__ == "__main__":
+    main()
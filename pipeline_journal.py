@@ -0,0 +1,260 @@
+# pipeline_journal.py
+# Diário de execução do pipeline (SQLite): registra o andamento de cada Network em cada etapa.
+# Permite retomar uma execução interrompida (PIPELINE_RESUME=1 / 6_run_code.py --resume) refazendo
+# apenas o trabalho pendente ou que falhou, e consultar estatísticas de falhas (6_run_code.py --stats).
+# Modo WAL + busy_timeout: seguro com vários processos gravando ao mesmo tempo (ex.: 4_group_blocks -w N).
+
+import os, time, sqlite3, traceback
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+# ---- DIRETORIOS ----
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEBUG_DIR = os.path.join(BASE_DIR, "99_debug")
+JOURNAL_PATH = os.path.join(DEBUG_DIR, "pipeline_journal.sqlite")
+
+# ---- PARAMETROS ----
+ENV_RESUME = "PIPELINE_RESUME"
+BUSY_TIMEOUT_MS = 30000
+
+# Ordem das etapas por Network (concluir uma etapa invalida as seguintes)
+STAGE_ORDER = [
+    "1_detect_tags",
+    "1.5_detect_NF",
+    "2_mark_blocks",
+    "3_associate_tags_with_blocks",
+    "4_group_blocks",
+    "4.5_adapt_logical_expression",
+    "5_build_python_condition",
+]
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS steps (
+    network     TEXT NOT NULL,
+    stage       TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    started_at  REAL,
+    finished_at REAL,
+    PRIMARY KEY (network, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_steps_stage_status ON steps (stage, status);
+CREATE TABLE IF NOT EXISTS events (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts       REAL NOT NULL,
+    pid      INTEGER NOT NULL,
+    network  TEXT NOT NULL,
+    stage    TEXT NOT NULL,
+    status   TEXT NOT NULL,
+    elapsed  REAL,
+    error    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_stage ON events (stage, status);
+"""
+
+# Sufixos dos artefatos por etapa; o restante do nome é a Network (nome-base da imagem recortada)
+ARTIFACT_SUFFIXES = (
+    "__17_final_readable.txt", "__17_final_converted.json", "__17_final.json",
+    "__14_groups_AND.json", "__13_horiz_rects.json", "_tags_with_nf.json", "_tags_info.json",
+    ".png", ".jpg", ".jpeg", ".tif", ".tiff",
+)
+
+# Nome da Network a partir do arquivo de qualquer etapa: 'page001_..._Network_1___17_final.json' -> 'page001_..._Network_1_'
+def network_key(filename) -> str:
+    name = os.path.basename(str(filename))
+    for suffix in ARTIFACT_SUFFIXES:
+        if name.lower().endswith(suffix.lower()):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+# Retomada ativada pelo ambiente (6_run_code.py --resume)
+def resume_enabled() -> bool:
+    return os.environ.get(ENV_RESUME, "") not in ("", "0")
+
+class StepOutcome:
+    __slots__ = ("error",)
+
+    def __init__(self):
+        self.error = None
+
+class Journal:
+    """
+    Estado atual por (Network, etapa) na tabela 'steps' e histórico append-only na tabela 'events'.
+    Cada processo abre sua própria conexão (use get_journal()).
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # Transação explícita (BEGIN IMMEDIATE reserva a escrita já no início; espera até busy_timeout)
+    @contextmanager
+    def _transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _event(self, network, stage, status, elapsed=None, error=None):
+        self.conn.execute(
+            "INSERT INTO events (ts, pid, network, stage, status, elapsed, error) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (time.time(), os.getpid(), network, stage, status, elapsed, error))
+
+    # Status atual de uma Network em uma etapa (None se nunca executada ou invalidada)
+    def status(self, network: str, stage: str) -> Optional[str]:
+        row = self.conn.execute("SELECT status FROM steps WHERE network = ? AND stage = ?",
+                                (network, stage)).fetchone()
+        return row[0] if row else None
+
+    def is_done(self, network: str, stage: str) -> bool:
+        return self.status(network, stage) == STATUS_DONE
+
+    # Networks já concluídas em uma etapa (consulta única para filtrar listas grandes)
+    def done_networks(self, stage: str) -> set:
+        rows = self.conn.execute("SELECT network FROM steps WHERE stage = ? AND status = ?",
+                                 (stage, STATUS_DONE)).fetchall()
+        return {r[0] for r in rows}
+
+    # Com retomada ativa, remove da lista as Networks já concluídas na etapa
+    def pending(self, networks: Iterable[str], stage: str) -> List[str]:
+        networks = list(networks)
+        if not resume_enabled():
+            return networks
+        done = self.done_networks(stage)
+        return [n for n in networks if n not in done]
+
+    def start(self, network: str, stage: str):
+        with self._transaction():
+            self.conn.execute(
+                "INSERT INTO steps (network, stage, status, attempts, error, started_at, finished_at) "
+                "VALUES (?, ?, ?, 1, NULL, ?, NULL) "
+                "ON CONFLICT (network, stage) DO UPDATE SET status = excluded.status, "
+                "attempts = attempts + 1, error = NULL, started_at = excluded.started_at, finished_at = NULL",
+                (network, stage, STATUS_RUNNING, time.time()))
+            self._event(network, stage, STATUS_RUNNING)
+
+    # Marca a etapa como concluída e invalida as etapas seguintes da mesma Network
+    def finish(self, network: str, stage: str, elapsed: Optional[float] = None):
+        with self._transaction():
+            self.conn.execute("UPDATE steps SET status = ?, finished_at = ? WHERE network = ? AND stage = ?",
+                              (STATUS_DONE, time.time(), network, stage))
+            self._event(network, stage, STATUS_DONE, elapsed)
+            later = downstream_stages(stage)
+            if later:
+                marks = ",".join("?" * len(later))
+                self.conn.execute(f"DELETE FROM steps WHERE network = ? AND stage IN ({marks})",
+                                  [network] + later)
+
+    def fail(self, network: str, stage: str, error: str, elapsed: Optional[float] = None):
+        with self._transaction():
+            self.conn.execute("UPDATE steps SET status = ?, error = ?, finished_at = ? WHERE network = ? AND stage = ?",
+                              (STATUS_FAILED, error, time.time(), network, stage))
+            self._event(network, stage, STATUS_FAILED, elapsed, error)
+
+    # Registra início/fim de uma unidade de trabalho; exceções são gravadas e propagadas.
+    # Falhas tratadas pela própria etapa (sem exceção) são indicadas em outcome.error.
+    @contextmanager
+    def step(self, network: str, stage: str):
+        outcome = StepOutcome()
+        self.start(network, stage)
+        t0 = time.perf_counter()
+        try:
+            yield outcome
+        except BaseException as e:
+            detail = "".join(traceback.format_exception_only(type(e), e)).strip()
+            self.fail(network, stage, detail, time.perf_counter() - t0)
+            raise
+        if outcome.error:
+            self.fail(network, stage, outcome.error, time.perf_counter() - t0)
+        else:
+            self.finish(network, stage, time.perf_counter() - t0)
+
+    # Marca como falha uma unidade tratada pela própria etapa (ex.: arquivo sem expressão)
+    def record_failure(self, network: str, stage: str, error: str):
+        self.start(network, stage)
+        self.fail(network, stage, error)
+
+    # ---- CONSULTAS ----
+
+    # Contagem por etapa e status atual: {etapa: {status: n}}
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        for stage, status, n in self.conn.execute(
+                "SELECT stage, status, COUNT(*) FROM steps GROUP BY stage, status"):
+            out.setdefault(stage, {})[status] = n
+        return dict(sorted(out.items(), key=lambda kv: stage_index(kv[0])))
+
+    # Estatísticas de falhas a partir do histórico: por etapa, total de falhas, Networks
+    # afetadas e erros mais frequentes
+    def failure_stats(self, top_errors: int = 5) -> Dict[str, dict]:
+        out = {}
+        for stage, n_fail, n_networks in self.conn.execute(
+                "SELECT stage, COUNT(*), COUNT(DISTINCT network) FROM events WHERE status = ? GROUP BY stage",
+                (STATUS_FAILED,)):
+            errors = self.conn.execute(
+                "SELECT error, COUNT(*) AS n FROM events WHERE status = ? AND stage = ? "
+                "GROUP BY error ORDER BY n DESC LIMIT ?", (STATUS_FAILED, stage, top_errors)).fetchall()
+            out[stage] = {"failures": n_fail, "networks": n_networks,
+                          "top_errors": [{"error": e, "count": c} for e, c in errors]}
+        return dict(sorted(out.items(), key=lambda kv: stage_index(kv[0])))
+
+    # Networks com falha no estado atual: [(network, etapa, erro, tentativas)]
+    def failed_steps(self) -> List[tuple]:
+        return self.conn.execute(
+            "SELECT network, stage, error, attempts FROM steps WHERE status = ? ORDER BY network, stage",
+            (STATUS_FAILED,)).fetchall()
+
+# Posição da etapa no pipeline (etapas desconhecidas vão para o final)
+def stage_index(stage: str) -> int:
+    return STAGE_ORDER.index(stage) if stage in STAGE_ORDER else len(STAGE_ORDER)
+
+# Etapas posteriores a 'stage'
+def downstream_stages(stage: str) -> List[str]:
+    if stage not in STAGE_ORDER:
+        return []
+    return STAGE_ORDER[STAGE_ORDER.index(stage) + 1:]
+
+_JOURNALS: Dict[int, Journal] = {}
+
+# Conexão do processo atual (processos de pools abrem a sua própria)
+def get_journal(path: str = JOURNAL_PATH) -> Journal:
+    journal = _JOURNALS.get(os.getpid())
+    if journal is None or journal.path != path:
+        journal = Journal(path)
+        _JOURNALS[os.getpid()] = journal
+    return journal
+
+# Formata o resumo e as estatísticas de falhas para o terminal
+def format_journal_report(journal: Journal) -> str:
+    lines = ["=== Diário do pipeline (estado atual por etapa) ==="]
+    summary = journal.summary()
+    if not summary:
+        lines.append("(vazio)")
+    for stage, counts in summary.items():
+        parts = ", ".join(f"{k}={v}" for k, v in sorted(counts.items()))
+        lines.append(f"{stage}: {parts}")
+    stats = journal.failure_stats()
+    if stats:
+        lines.append("")
+        lines.append("=== Falhas (histórico) ===")
+        for stage, s in stats.items():
+            lines.append(f"{stage}: {s['failures']} falha(s) em {s['networks']} Network(s)")
+            for e in s["top_errors"]:
+                lines.append(f"    {e['count']}x {e['error']}")
+    return "\n".join(lines)
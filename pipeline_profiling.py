@@ -0,0 +1,210 @@
+# pipeline_profiling.py
+# Instrumentação opcional das etapas do pipeline: decorador @profiled e contexto span("nome").
+# Ativada pela variável de ambiente PIPELINE_PROFILE=1 (6_run_code.py --profile). Desativada,
+# @profiled devolve a própria função e span() devolve um contexto vazio compartilhado (custo zero).
+# Agrega por função: chamadas, tempo acumulado, percentis de latência (p50/p95/p99) e bytes gravados.
+# Ao final do processo grava 99_debug/19_profile/<script>.json e, com PIPELINE_PROFILE_TRACE=1,
+# um trace no formato do Chrome (chrome://tracing / Perfetto) em <script>.trace.json.
+# Observação: processos filhos de pools (ex.: 4_group_blocks --workers N) não são agregados.
+
+import os, sys, json, time, atexit, threading, functools
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+# ---- DIRETORIOS ----
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.path.join(BASE_DIR, "99_debug", "19_profile")
+
+# ---- PARAMETROS ----
+ENV_PROFILE = "PIPELINE_PROFILE"
+ENV_TRACE = "PIPELINE_PROFILE_TRACE"
+ENABLED = os.environ.get(ENV_PROFILE, "") not in ("", "0")
+TRACE_ENABLED = ENABLED and os.environ.get(ENV_TRACE, "") not in ("", "0")
+
+_NULL_SPAN = nullcontext()
+_durations: Dict[str, List[float]] = {}
+_bytes: Dict[str, int] = {}
+_events: List[dict] = []
+_lock = threading.Lock()
+# Âncora para converter perf_counter em tempo absoluto (traces de etapas diferentes se alinham)
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+# Registra uma medição (segundos) para 'name'
+def _record(name: str, start: float, elapsed: float):
+    with _lock:
+        _durations.setdefault(name, []).append(elapsed)
+        if TRACE_ENABLED:
+            _events.append({
+                "name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                "ts": (_EPOCH_OFFSET + start) * 1e6, "dur": elapsed * 1e6,
+            })
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _record(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+# Contexto que mede um trecho de código: with span("process_image.close_gaps"): ...
+def span(name: str):
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name)
+
+# Decorador que mede cada chamada da função; aceita @profiled e @profiled("nome")
+def profiled(name=None):
+    def decorate(fn, label):
+        if not ENABLED:
+            return fn
+        label = label or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(label, start, time.perf_counter() - start)
+        return wrapper
+
+    if callable(name):
+        return decorate(name, None)
+    return lambda fn: decorate(fn, name)
+
+# Contabiliza bytes gravados (ex.: tamanho de um JSON/PNG de saída)
+def add_bytes(name: str, n: int):
+    if not ENABLED:
+        return
+    with _lock:
+        _bytes[name] = _bytes.get(name, 0) + int(n)
+
+# Contabiliza o tamanho de um arquivo recém-gravado
+def add_file_bytes(name: str, path):
+    if not ENABLED:
+        return
+    try:
+        add_bytes(name, os.path.getsize(path))
+    except OSError:
+        pass
+
+# ---- RELATÓRIO ----
+
+# Percentil por interpolação linear sobre valores ordenados
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+# Resumo por nome: chamadas, tempo acumulado, média e percentis (ms), bytes gravados
+def summary() -> Dict[str, dict]:
+    with _lock:
+        durations = {k: sorted(v) for k, v in _durations.items()}
+        written = dict(_bytes)
+    out = {}
+    for name in sorted(set(durations) | set(written)):
+        values = durations.get(name, [])
+        total = sum(values)
+        out[name] = {
+            "calls": len(values),
+            "total_s": total,
+            "mean_ms": (total / len(values) * 1000.0) if values else 0.0,
+            "p50_ms": percentile(values, 50) * 1000.0,
+            "p95_ms": percentile(values, 95) * 1000.0,
+            "p99_ms": percentile(values, 99) * 1000.0,
+            "bytes": written.get(name, 0),
+        }
+    return out
+
+# Formata um resumo como tabela, ordenada por tempo acumulado
+def format_report(functions: Dict[str, dict], top: Optional[int] = None) -> str:
+    rows = sorted(functions.items(), key=lambda kv: kv[1]["total_s"], reverse=True)
+    if top:
+        rows = rows[:top]
+    width = max([len(k) for k, _ in rows] + [8])
+    lines = [f"{'função':<{width}} {'chamadas':>8} {'total(s)':>9} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'bytes':>11}"]
+    for name, m in rows:
+        lines.append(f"{name:<{width}} {m['calls']:>8} {m['total_s']:>9.3f} {m['p50_ms']:>9.2f} "
+                     f"{m['p95_ms']:>9.2f} {m['p99_ms']:>9.2f} {m['bytes']:>11}")
+    return "\n".join(lines)
+
+# Nome do script em execução (sem extensão), usado no nome dos arquivos de relatório
+def script_name() -> str:
+    return os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+
+# Grava o relatório JSON (e o trace, se ativado) do processo atual
+def write_report(out_dir: str = PROFILE_DIR, script: Optional[str] = None) -> Optional[str]:
+    functions = summary()
+    if not functions:
+        return None
+    script = script or script_name()
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{script}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"script": script, "pid": os.getpid(), "functions": functions}, f, ensure_ascii=False, indent=2)
+    if TRACE_ENABLED:
+        with _lock:
+            events = list(_events)
+        trace_path = os.path.join(out_dir, f"{script}.trace.json")
+        meta = {"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": script}}
+        with open(trace_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": [meta] + events, "displayTimeUnit": "ms"}, f)
+    return path
+
+# Carrega os relatórios gravados pelas etapas: {script: functions}
+def load_reports(out_dir: str = PROFILE_DIR) -> Dict[str, Dict[str, dict]]:
+    reports = {}
+    if not os.path.isdir(out_dir):
+        return reports
+    for fn in sorted(os.listdir(out_dir)):
+        if not fn.endswith(".json") or fn.endswith(".trace.json"):
+            continue
+        with open(os.path.join(out_dir, fn), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        reports[data.get("script", fn[:-5])] = data.get("functions", {})
+    return reports
+
+# Une os traces de todas as etapas em um único arquivo (uma linha de processo por etapa)
+def merge_traces(out_dir: str = PROFILE_DIR, out_name: str = "pipeline.trace.json") -> Optional[str]:
+    if not os.path.isdir(out_dir):
+        return None
+    events = []
+    for fn in sorted(os.listdir(out_dir)):
+        if fn.endswith(".trace.json") and fn != out_name:
+            with open(os.path.join(out_dir, fn), "r", encoding="utf-8") as f:
+                events.extend(json.load(f).get("traceEvents", []))
+    if not events:
+        return None
+    path = os.path.join(out_dir, out_name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return path
+
+# Remove relatórios de execuções anteriores
+def clear_reports(out_dir: str = PROFILE_DIR):
+    if not os.path.isdir(out_dir):
+        return
+    for fn in os.listdir(out_dir):
+        if fn.endswith(".json"):
+            os.remove(os.path.join(out_dir, fn))
+
+def _write_at_exit():
+    try:
+        path = write_report()
+        if path:
+            print(f"[PROFILE] Relatório salvo em: {path}")
+    except Exception as e:
+        print(f"[PROFILE] Falha ao salvar relatório: {e}")
+
+if ENABLED:
+    atexit.register(_write_at_exit)
@@ -0,0 +1,169 @@
+# plc_symbols.py
+# Tabela de símbolos do projeto: cada endereço do CLP (%I8.7, %M1.2, %DB10, %DB10.DBX0.1, ...) é registrado uma única vez
+# (área, byte, bit) e recebe um ID inteiro denso. A negação (NOT / contato NF) pertence à referência,
+# não ao endereço: uma referência é codificada como (id << 1) | negado. Contatos de borda P()/N() leem o
+# endereço do operando e um bit de memória com o valor do scan anterior (<nome>__prev).
+# Persistida como JSON compacto em 03_tags/symbols.json.
+
+import os, re, json
+from typing import Optional, Tuple
+
+# ---- DIRETORIOS ----
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TAGS_OUT_DIR = os.path.join(BASE_DIR, "03_tags")
+SYMBOLS_PATH = os.path.join(TAGS_OUT_DIR, "symbols.json")
+
+# ---- PARAMETROS ----
+SYMBOLS_VERSION = 1
+
+# Aceita '%I8.7', 'I8.7', 'I8_7' (nome sanitizado), '%DB10', '%MW20' e endereços de DB estruturados
+# ('%DB10.DBX0.1', '%DB10.DBW2', 'DB10_DBX0_1'); nesses a área inclui o bloco ('DB10.DBX').
+# Nomes simbólicos ('"Motor".Start', 'Motor_On') não são endereços e ficam sem ID.
+ADDRESS_RE = re.compile(r'^%?((?:DB\d+[._])?[A-Z]+)(\d+)(?:[._](\d+))?$', re.IGNORECASE)
+# Nomes de variáveis em uma expressão Python gerada (exceto palavras reservadas e constantes)
+PY_NAME_RE = re.compile(r'\b(?!(?:and|or|not|True|False)\b)([A-Za-z_]\w*)\b')
+NOT_RE = re.compile(r'^NOT\s*\((.*)\)$', re.IGNORECASE)
+EDGE_RE = re.compile(r'^([PN])\s*\((.*)\)$', re.IGNORECASE)
+EDGE_PREV_SUFFIX = "__prev"   # Bit de memória da borda: valor do operando no scan anterior
+
+# Separa a negação de uma TAG: 'NOT(%M1.2)' -> ('%M1.2', True); NOT(NOT(x)) -> (x, False)
+# Contatos de borda devolvem o operando: 'P(%M1.2)' -> ('%M1.2', False)
+def split_negation(text: str) -> Tuple[str, bool]:
+    s = str(text).strip()
+    negated = False
+    m = NOT_RE.match(s)
+    while m:
+        negated = not negated
+        s = m.group(1).strip()
+        m = NOT_RE.match(s)
+    return split_edge(s)[0], negated
+
+# Separa o contato de borda de uma TAG: 'P(%M1.2)' -> ('%M1.2', 'P'); sem borda -> (texto, None)
+def split_edge(text: str) -> Tuple[str, Optional[str]]:
+    s = str(text).strip()
+    m = EDGE_RE.match(s)
+    if not m:
+        return s, None
+    return m.group(2).strip(), m.group(1).upper()
+
+# Nome de variável Python de uma TAG (ignora NOT e P/N): '%I8.7' / 'NOT(%I8.7)' -> 'I8_7',
+# '%DB10.DBX0.1' -> 'DB10_DBX0_1'. Único normalizador de nomes do pipeline (4.5, 5, 7 e plc_xref)
+def tag_var_name(text: str) -> str:
+    s = split_negation(text)[0]
+    if s.startswith('%'):
+        s = s[1:]
+    s = s.replace('.', '_')
+    s = re.sub(r'[^0-9A-Za-z_]', '_', s)
+    if re.match(r'^\d', s):
+        s = 'v_' + s
+    return s
+
+# Nome do bit de memória da borda de uma variável: 'I0_0' -> 'I0_0__prev'
+def edge_prev_name(var_name: str) -> str:
+    return var_name + EDGE_PREV_SUFFIX
+
+# Operando de um bit de memória de borda: 'I0_0__prev' -> 'I0_0'; None para os demais nomes
+def edge_base_name(name: str) -> Optional[str]:
+    if name.endswith(EDGE_PREV_SUFFIX) and len(name) > len(EDGE_PREV_SUFFIX):
+        return name[:-len(EDGE_PREV_SUFFIX)]
+    return None
+
+# Decompõe um endereço em (área, byte, bit); bit é None para endereços sem bit (ex.: %DB10)
+def parse_address(text: str) -> Optional[Tuple[str, int, Optional[int]]]:
+    m = ADDRESS_RE.match(str(text).strip())
+    if not m:
+        return None
+    bit = int(m.group(3)) if m.group(3) is not None else None
+    return m.group(1).upper().replace('_', '.'), int(m.group(2)), bit
+
+# Formata (área, byte, bit) como endereço canônico: ('I', 8, 7) -> '%I8.7'
+def format_address(area: str, byte: int, bit: Optional[int]) -> str:
+    return f"%{area}{byte}" if bit is None else f"%{area}{byte}.{bit}"
+
+# Formata (área, byte, bit) como nome de variável Python (mesmo formato de tag_var_name)
+def format_var_name(area: str, byte: int, bit: Optional[int]) -> str:
+    area = area.replace('.', '_')
+    return f"{area}{byte}" if bit is None else f"{area}{byte}_{bit}"
+
+# Codifica/decodifica uma referência (ID do endereço + negação) em um único inteiro
+def encode_ref(symbol_id: int, negated: bool) -> int:
+    return (symbol_id << 1) | int(bool(negated))
+
+def decode_ref(ref: int) -> Tuple[int, bool]:
+    return ref >> 1, bool(ref & 1)
+
+class SymbolTable:
+    """
+    Mapeia endereços do CLP para IDs inteiros densos (0..N-1), na ordem em que foram registrados.
+    """
+
+    def __init__(self):
+        self.addresses = []   # ID -> (área, byte, bit)
+        self._ids = {}        # (área, byte, bit) -> ID
+
+    def __len__(self):
+        return len(self.addresses)
+
+    # Registra o endereço da TAG (ignorando NOT) e retorna seu ID; None se não for um endereço válido
+    def intern(self, text: str) -> Optional[int]:
+        address, _negated = split_negation(text)
+        key = parse_address(address)
+        if key is None:
+            return None
+        symbol_id = self._ids.get(key)
+        if symbol_id is None:
+            symbol_id = len(self.addresses)
+            self.addresses.append(key)
+            self._ids[key] = symbol_id
+        return symbol_id
+
+    # Registra a TAG e retorna a referência codificada (ID + negação); None se inválida
+    def intern_ref(self, text: str) -> Optional[int]:
+        symbol_id = self.intern(text)
+        if symbol_id is None:
+            return None
+        return encode_ref(symbol_id, split_negation(text)[1])
+
+    # Retorna o ID de uma TAG já registrada (sem registrar); None se desconhecida
+    def id_of(self, text: str) -> Optional[int]:
+        key = parse_address(split_negation(text)[0])
+        return None if key is None else self._ids.get(key)
+
+    # Endereço canônico ('%I8.7') de um ID
+    def address(self, symbol_id: int) -> str:
+        return format_address(*self.addresses[symbol_id])
+
+    # Nome de variável ('I8_7') de um ID
+    def var_name(self, symbol_id: int) -> str:
+        return format_var_name(*self.addresses[symbol_id])
+
+    def to_json(self) -> dict:
+        return {
+            "version": SYMBOLS_VERSION,
+            "fields": ["area", "byte", "bit"],
+            "symbols": [list(a) for a in self.addresses],
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "SymbolTable":
+        table = cls()
+        for area, byte, bit in data.get("symbols", []):
+            key = (str(area), int(byte), None if bit is None else int(bit))
+            table._ids[key] = len(table.addresses)
+            table.addresses.append(key)
+        return table
+
+    # Salva em JSON compacto (uma entrada por endereço, sem indentação)
+    def save(self, path: str = SYMBOLS_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+# Carrega a tabela do projeto (ou uma tabela vazia se o arquivo ainda não existir)
+def load_symbol_table(path: str = SYMBOLS_PATH) -> SymbolTable:
+    if not os.path.exists(path):
+        return SymbolTable()
+    with open(path, "r", encoding="utf-8") as f:
+        return SymbolTable.from_json(json.load(f))
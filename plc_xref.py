@@ -0,0 +1,166 @@
+# plc_xref.py
+# Referência cruzada do projeto: quais rungs leem cada TAG (contatos) e quais rungs escrevem cada bobina.
+# Construída a partir das expressões finais (*_converted.json) e das TAGs is_coil (*__tags_info.json).
+# Fornece ordenação topológica dos rungs e o conjunto de rungs a jusante de TAGs alteradas
+# (base para re-simulação incremental). Grava 04_final/cross_reference.json.
+
+import os, re, json, heapq, argparse, importlib.util
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from plc_symbols import tag_var_name, edge_prev_name, PY_NAME_RE
+
+# ---- DIRETORIOS ----
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONVERTED_DIR = os.path.join(BASE_DIR, "03_tags", "13_pseudo_final")
+TAGS_OUT_DIR  = os.path.join(BASE_DIR, "03_tags")
+FINAL_DIR     = os.path.join(BASE_DIR, "04_final")
+XREF_PATH     = os.path.join(FINAL_DIR, "cross_reference.json")
+
+# Carrega um script de estágio do pipeline (nomes com dígitos/pontos não são importáveis diretamente)
+def load_stage(filename):
+    path = os.path.join(BASE_DIR, filename)
+    name = "stage_" + re.sub(r'\W', '_', os.path.splitext(filename)[0])
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Lista as TAGs lidas por uma expressão Python (ordem de primeira ocorrência)
+def expression_inputs(python_expr: str) -> List[str]:
+    out = []
+    for name in PY_NAME_RE.findall(python_expr or ""):
+        if name not in out:
+            out.append(name)
+    return out
+
+class CrossReference:
+    """
+    Índice bidirecional TAG <-> rung. Rungs são identificados pelo índice na ordem do programa.
+    rungs: lista de dicts com 'name', 'python_expression' e 'coils' (ver load_project_rungs).
+    """
+
+    def __init__(self, rungs: List[dict]):
+        self.rung_names = [r["name"] for r in rungs]
+        self.rung_inputs = [expression_inputs(r["python_expression"]) for r in rungs]
+        self.rung_coils = [list(r.get("coils") or []) for r in rungs]
+        self.readers: Dict[str, List[int]] = {}
+        self.writers: Dict[str, List[int]] = {}
+        for idx, names in enumerate(self.rung_inputs):
+            for n in names:
+                self.readers.setdefault(n, []).append(idx)
+        for idx, coils in enumerate(self.rung_coils):
+            for c in coils:
+                self.writers.setdefault(c, []).append(idx)
+
+        # Arestas rung escritor -> rung leitor (auto-laços, como selos, são ignorados)
+        self.successors: List[List[int]] = [[] for _ in rungs]
+        self.predecessors: List[List[int]] = [[] for _ in rungs]
+        edges = set()
+        for coil, writer_idx in self.writers.items():
+            for w in writer_idx:
+                for r in self.readers.get(coil, []):
+                    if r != w and (w, r) not in edges:
+                        edges.add((w, r))
+                        self.successors[w].append(r)
+                        self.predecessors[r].append(w)
+        self.order, self.cyclic = self._topological_order()
+
+        # Rungs que leem o valor do scan anterior (x__prev, contatos P/N) das bobinas de cada rung.
+        # Fora de successors: afetam o próximo scan e não entram na ordenação topológica.
+        self.edge_successors: List[List[int]] = [
+            sorted({r for c in coils for r in self.readers.get(edge_prev_name(c), [])})
+            for coils in self.rung_coils
+        ]
+
+    # Rungs que leem a TAG (índices, ordem do programa)
+    def readers_of(self, tag: str) -> List[int]:
+        return list(self.readers.get(tag_var_name(tag), []))
+
+    # Rungs que escrevem a bobina (índices, ordem do programa)
+    def writers_of(self, coil: str) -> List[int]:
+        return list(self.writers.get(tag_var_name(coil), []))
+
+    # Ordenação topológica (Kahn); empates resolvidos pela ordem do programa.
+    # Rungs em ciclos de realimentação entre rungs são anexados ao final na ordem do programa.
+    def _topological_order(self):
+        indegree = [len(p) for p in self.predecessors]
+        heap = [i for i, d in enumerate(indegree) if d == 0]
+        heapq.heapify(heap)
+        order = []
+        while heap:
+            u = heapq.heappop(heap)
+            order.append(u)
+            for v in self.successors[u]:
+                indegree[v] -= 1
+                if indegree[v] == 0:
+                    heapq.heappush(heap, v)
+        placed = set(order)
+        cyclic = [i for i in range(len(self.rung_names)) if i not in placed]
+        return order + cyclic, cyclic
+
+    # Rungs afetados por mudanças nas TAGs informadas (leitores diretos, leitores da memória
+    # de borda x__prev e tudo a jusante), retornados na ordem topológica
+    def downstream(self, changed_tags: Iterable[str]) -> List[int]:
+        seen = set()
+        q = deque()
+        for tag in changed_tags:
+            name = tag_var_name(tag)
+            for r in self.readers.get(name, []) + self.readers.get(edge_prev_name(name), []):
+                if r not in seen:
+                    seen.add(r)
+                    q.append(r)
+        while q:
+            u = q.popleft()
+            for v in self.successors[u] + self.edge_successors[u]:
+                if v not in seen:
+                    seen.add(v)
+                    q.append(v)
+        return [i for i in self.order if i in seen]
+
+    def to_json(self) -> dict:
+        return {
+            "rungs": [
+                {"index": i, "name": n, "inputs": self.rung_inputs[i], "coils": self.rung_coils[i]}
+                for i, n in enumerate(self.rung_names)
+            ],
+            "readers": {k: v for k, v in sorted(self.readers.items())},
+            "writers": {k: v for k, v in sorted(self.writers.items())},
+            "topological_order": self.order,
+            "cyclic_rungs": self.cyclic,
+        }
+
+# Constrói a referência cruzada a partir dos diretórios do pipeline
+def build_cross_reference(converted_dir=CONVERTED_DIR, tags_dir=TAGS_OUT_DIR) -> CrossReference:
+    stage5 = load_stage("5_build_python_condition.py")
+    stage5.DEBUG = False
+    rungs = stage5.load_project_rungs(Path(converted_dir), Path(tags_dir))
+    return CrossReference(rungs)
+
+# ---- MAIN ----
+
+def main():
+    ap = argparse.ArgumentParser(description="Gera a referência cruzada bobinas/contatos de todas as Networks")
+    ap.add_argument("--converted_dir", "-c", default=CONVERTED_DIR, help="Diretório dos *_converted.json")
+    ap.add_argument("--tags_dir", "-t", default=TAGS_OUT_DIR, help="Diretório dos *__tags_info.json")
+    ap.add_argument("--out", "-o", default=XREF_PATH, help="JSON de saída")
+    ap.add_argument("--readers", nargs="*", default=[], help="Lista os rungs que leem estas TAGs")
+    ap.add_argument("--writers", nargs="*", default=[], help="Lista os rungs que escrevem estas bobinas")
+    args = ap.parse_args()
+
+    xref = build_cross_reference(args.converted_dir, args.tags_dir)
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(xref.to_json(), f, ensure_ascii=False, indent=2)
+    print(f"[OK] {len(xref.rung_names)} rungs | {len(xref.readers)} TAGs lidas | {len(xref.writers)} bobinas -> {args.out}")
+    if xref.cyclic:
+        print(f"[AVISO] {len(xref.cyclic)} rung(s) em ciclos de realimentação entre rungs")
+
+    for tag in args.readers:
+        print(f"  {tag} lida por: {[xref.rung_names[i] for i in xref.readers_of(tag)]}")
+    for coil in args.writers:
+        print(f"  {coil} escrita por: {[xref.rung_names[i] for i in xref.writers_of(coil)]}")
+
+if __name__ == "__main__":
+    main()